@@ -0,0 +1,227 @@
+"""
+Archivo histórico de MovimientosStock.
+
+Los movimientos más viejos que la ventana de retención se mueven a segmentos
+JSONL comprimidos con gzip, particionados por mes:
+
+    archivo/movimientos/2025-09/seg-20260119T030000-0001.jsonl.gz
+    archivo/movimientos/indice.json
+
+El índice guarda por segmento el rango de fechas, de ids y de producto_id, así
+la lectura solo abre los segmentos que pueden tener filas del rango pedido.
+La tabla viva queda con la ventana caliente; MovimientosDiarios conserva el
+historial completo resumido, así que los reportes por día no se ven afectados.
+
+Ejecutar el archivado:
+    python archive.py                  # retención por defecto (ARCHIVE_RETENTION_DAYS o 180 días)
+    python archive.py --retencion 90
+"""
+import argparse
+import gzip
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+CONFIG = {
+    'directorio': os.environ.get('ARCHIVE_DIR', os.path.join('archivo', 'movimientos')),
+    'retencion_dias': int(os.environ.get('ARCHIVE_RETENTION_DAYS', 180)),
+    'filas_por_segmento': 50000,
+    'lote_borrado': 1000,  # ids por DELETE (SQL Server admite hasta 2100 parámetros)
+}
+
+_lock_indice = threading.Lock()
+_cache_indice = {'mtime': None, 'indice': None}
+
+
+def _ruta_indice():
+    return os.path.join(CONFIG['directorio'], 'indice.json')
+
+
+def leer_indice():
+    """Índice de segmentos (cacheado mientras el archivo no cambie)"""
+    ruta = _ruta_indice()
+    try:
+        mtime = os.path.getmtime(ruta)
+    except OSError:
+        return {'corte': None, 'id_max': 0, 'segmentos': []}
+    with _lock_indice:
+        if _cache_indice['mtime'] != mtime:
+            with open(ruta, encoding='utf-8') as f:
+                _cache_indice['indice'] = json.load(f)
+            _cache_indice['mtime'] = mtime
+        return _cache_indice['indice']
+
+
+def _guardar_indice(indice):
+    """Escribir el índice de forma atómica (archivo temporal + rename)"""
+    ruta = _ruta_indice()
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(indice, f, ensure_ascii=False, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+
+
+def corte_caliente():
+    """Fecha a partir de la cual los movimientos están en la tabla viva (None si no hay archivo)"""
+    corte = leer_indice().get('corte')
+    return datetime.fromisoformat(corte) if corte else None
+
+
+def _escribir_segmento(mes, filas, sello, numero):
+    """Escribir un segmento comprimido y devolver su entrada de índice"""
+    carpeta = os.path.join(CONFIG['directorio'], mes)
+    os.makedirs(carpeta, exist_ok=True)
+    nombre = f"seg-{sello}-{numero:04d}.jsonl.gz"
+    ruta = os.path.join(carpeta, nombre)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'wb') as crudo:
+        with gzip.GzipFile(fileobj=crudo, mode='wb') as comprimido:
+            for fila in filas:
+                comprimido.write((json.dumps(fila, ensure_ascii=False) + '\n').encode('utf-8'))
+        crudo.flush()
+        os.fsync(crudo.fileno())
+    os.replace(temporal, ruta)
+    return {
+        'archivo': f"{mes}/{nombre}",
+        'filas': len(filas),
+        'id_min': min(f['id'] for f in filas),
+        'id_max': max(f['id'] for f in filas),
+        'producto_min': min(f['producto_id'] for f in filas),
+        'producto_max': max(f['producto_id'] for f in filas),
+        'fecha_min': min(f['fecha_movimiento'] for f in filas),
+        'fecha_max': max(f['fecha_movimiento'] for f in filas),
+    }
+
+
+def archivar(conn, retencion_dias=None):
+    """Mover a segmentos los movimientos más viejos que la retención y borrarlos de la tabla"""
+    retencion_dias = CONFIG['retencion_dias'] if retencion_dias is None else retencion_dias
+    corte = datetime.combine(date.today() - timedelta(days=retencion_dias), datetime.min.time())
+    os.makedirs(CONFIG['directorio'], exist_ok=True)
+    indice = leer_indice()
+    indice = {'corte': indice.get('corte'), 'id_max': indice.get('id_max', 0),
+              'segmentos': list(indice.get('segmentos', []))}
+    sello = datetime.now().strftime('%Y%m%dT%H%M%S')
+
+    # 1) Leer y escribir segmentos. Se filtra solo por fecha: un id menor que otro ya
+    #    archivado puede cruzar el corte después (importaciones, relojes). Lo que dejó
+    #    en la tabla una corrida interrumpida antes de borrar se vuelve a archivar;
+    #    leer() descarta el id repetido.
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, producto_id, tipo_movimiento, cantidad, motivo, numero_referencia, fecha_movimiento,
+               costo_unitario
+        FROM MovimientosStock
+        WHERE fecha_movimiento < ?
+        ORDER BY fecha_movimiento, id
+    """, corte)
+
+    nuevos = []
+    ids = []
+    pendientes = {}
+    numero = 0
+    archivadas = 0
+    while True:
+        filas = cursor.fetchmany(5000)
+        if not filas:
+            break
+        for row in filas:
+            fila = {
+                'id': row[0],
+                'producto_id': row[1],
+                'tipo_movimiento': row[2],
+                'cantidad': row[3],
+                'motivo': row[4] or '',
+                'numero_referencia': row[5] or '',
+                'fecha_movimiento': row[6].isoformat(),
+                'costo_unitario': float(row[7]) if row[7] is not None else None,
+            }
+            ids.append(fila['id'])
+            mes = fila['fecha_movimiento'][:7]
+            grupo = pendientes.setdefault(mes, [])
+            grupo.append(fila)
+            if len(grupo) >= CONFIG['filas_por_segmento']:
+                numero += 1
+                nuevos.append(_escribir_segmento(mes, grupo, sello, numero))
+                archivadas += len(grupo)
+                pendientes[mes] = []
+    for mes, grupo in sorted(pendientes.items()):
+        if grupo:
+            numero += 1
+            nuevos.append(_escribir_segmento(mes, grupo, sello, numero))
+            archivadas += len(grupo)
+
+    # 2) Publicar los segmentos en el índice antes de tocar la tabla
+    if nuevos:
+        indice['segmentos'].extend(nuevos)
+        indice['id_max'] = max(indice['id_max'], max(s['id_max'] for s in nuevos))
+    if not indice['corte'] or corte.isoformat() > indice['corte']:
+        indice['corte'] = corte.isoformat()
+    _guardar_indice(indice)
+
+    # 3) Borrar de la tabla viva exactamente los ids escritos en segmentos, en lotes cortos
+    borradas = 0
+    ids.sort()
+    for inicio in range(0, len(ids), CONFIG['lote_borrado']):
+        lote = ids[inicio:inicio + CONFIG['lote_borrado']]
+        cursor.execute(f"DELETE FROM MovimientosStock WHERE id IN ({', '.join('?' * len(lote))})", *lote)
+        borradas += max(cursor.rowcount, 0)
+        conn.commit()
+
+    return {'corte': indice['corte'], 'segmentos_nuevos': len(nuevos), 'archivadas': archivadas,
+            'borradas': borradas}
+
+
+def leer(desde=None, hasta=None, producto_id=None):
+    """Movimientos archivados en [desde, hasta), usando el índice para descartar segmentos"""
+    desde_iso = desde.isoformat() if desde else None
+    hasta_iso = hasta.isoformat() if hasta else None
+    vistos = set()
+    for segmento in leer_indice().get('segmentos', []):
+        if desde_iso and segmento['fecha_max'] < desde_iso:
+            continue
+        if hasta_iso and segmento['fecha_min'] >= hasta_iso:
+            continue
+        if producto_id is not None and not (segmento['producto_min'] <= producto_id <= segmento['producto_max']):
+            continue
+        ruta = os.path.join(CONFIG['directorio'], segmento['archivo'])
+        with gzip.open(ruta, 'rt', encoding='utf-8') as f:
+            for linea in f:
+                fila = json.loads(linea)
+                if desde_iso and fila['fecha_movimiento'] < desde_iso:
+                    continue
+                if hasta_iso and fila['fecha_movimiento'] >= hasta_iso:
+                    continue
+                if producto_id is not None and fila['producto_id'] != producto_id:
+                    continue
+                # Una corrida interrumpida puede haber dejado el mismo id en dos segmentos
+                if fila['id'] in vistos:
+                    continue
+                vistos.add(fila['id'])
+                yield fila
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archivar movimientos de stock antiguos')
+    parser.add_argument('--retencion', type=int, default=None,
+                        help=f"Días que quedan en la tabla viva (por defecto {CONFIG['retencion_dias']})")
+    args = parser.parse_args()
+
+    from inventory_api import get_db_connection
+    conn = get_db_connection()
+    if not conn:
+        print("No se pudo conectar a la base de datos")
+        return
+    try:
+        resultado = archivar(conn, args.retencion)
+        print(f"[OK] Archivado hasta {resultado['corte']}: {resultado['archivadas']} movimientos "
+              f"en {resultado['segmentos_nuevos']} segmentos, {resultado['borradas']} borrados de la tabla")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
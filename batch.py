@@ -0,0 +1,162 @@
+"""
+POST /batch: varias llamadas a la API en un solo round trip.
+
+El frontend abría el dashboard con cuatro o cinco peticiones seguidas, cada
+una con su conexión a SQL Server y su verificación del token. El lote recibe
+una lista de sub-peticiones (método, ruta, cuerpo) y las despacha una por una
+a las mismas vistas de Flask, con su propio contexto de petición (g, métricas,
+rate limit y degradación por endpoint), pero:
+
+- todas usan una sola conexión, abierta con la primera que la pide y cerrada
+  al terminar el lote (el conn.close() de cada handler solo deshace lo que no
+  se confirmó);
+- el token se verifica una vez para todo el lote.
+
+Cada sub-petición responde por separado: un error en una no corta las demás.
+
+Configuración (variables de entorno):
+    BATCH_MAX_REQUESTS   sub-peticiones por lote (20)
+"""
+import json
+import os
+import threading
+from functools import wraps
+
+from flask import request
+from werkzeug.test import EnvironBuilder
+
+from instrumentation import Contador, registrar_metrica
+
+CONFIG = {
+    'max_peticiones': int(os.environ.get('BATCH_MAX_REQUESTS', 20)),
+}
+
+METODOS = ('GET', 'POST', 'PUT', 'DELETE')
+
+# Headers de las respuestas que se devuelven dentro del lote
+HEADERS_RESPUESTA = ('X-Total-Count', 'X-Archivo-Corte', 'Retry-After', 'Warning', 'Age')
+
+SUBPETICIONES = registrar_metrica(Contador('batch_subrequests_total',
+                                           'Sub-peticiones despachadas por POST /batch', ('estado',)))
+
+_lote = threading.local()
+
+
+class PeticionInvalida(ValueError):
+    """El cuerpo de POST /batch no tiene el formato esperado"""
+
+
+class ConexionCompartida:
+    """Conexión del lote: close() de un handler deshace lo pendiente pero no la cierra"""
+
+    def __init__(self, conn):
+        object.__setattr__(self, '_conn', conn)
+
+    def close(self):
+        self._conn.rollback()
+
+    def cerrar(self):
+        self._conn.close()
+
+    def __getattr__(self, nombre):
+        return getattr(self._conn, nombre)
+
+    def __setattr__(self, nombre, valor):
+        setattr(self._conn, nombre, valor)
+
+
+def compartida_en_lote(obtener_conexion):
+    """Decorador para get_db_connection: dentro de un lote todas las llamadas reciben la misma conexión"""
+    @wraps(obtener_conexion)
+    def wrapper(*args, **kwargs):
+        if not getattr(_lote, 'activo', False):
+            return obtener_conexion(*args, **kwargs)
+        if _lote.conexion is None:
+            conn = obtener_conexion(*args, **kwargs)
+            if conn is None:
+                return None  # Se vuelve a intentar con la próxima sub-petición
+            _lote.conexion = ConexionCompartida(conn)
+        return _lote.conexion
+    return wrapper
+
+
+def usuario_del_lote():
+    """Payload del token ya verificado por el lote en curso (None fuera de un lote)"""
+    return getattr(_lote, 'usuario', None) if getattr(_lote, 'activo', False) else None
+
+
+def leer_peticiones(data):
+    """Validar el cuerpo {"peticiones": [{"metodo", "ruta", "cuerpo"?, "headers"?}]}"""
+    peticiones = (data or {}).get('peticiones') if isinstance(data, dict) else None
+    if not isinstance(peticiones, list) or not peticiones:
+        raise PeticionInvalida('Se requiere "peticiones": una lista de sub-peticiones')
+    if len(peticiones) > CONFIG['max_peticiones']:
+        raise PeticionInvalida(f'Máximo {CONFIG["max_peticiones"]} sub-peticiones por lote')
+    normalizadas = []
+    for i, peticion in enumerate(peticiones):
+        if not isinstance(peticion, dict):
+            raise PeticionInvalida(f'Sub-petición {i}: se esperaba un objeto')
+        metodo = str(peticion.get('metodo', 'GET')).upper()
+        ruta = peticion.get('ruta')
+        headers = peticion.get('headers') or {}
+        if metodo not in METODOS:
+            raise PeticionInvalida(f'Sub-petición {i}: método no soportado ({metodo})')
+        if not isinstance(ruta, str) or not ruta.startswith('/'):
+            raise PeticionInvalida(f'Sub-petición {i}: "ruta" debe empezar con /')
+        if ruta.split('?')[0].rstrip('/') == '/batch':
+            raise PeticionInvalida(f'Sub-petición {i}: no se pueden anidar lotes')
+        if not isinstance(headers, dict):
+            raise PeticionInvalida(f'Sub-petición {i}: "headers" debe ser un objeto')
+        normalizadas.append({'metodo': metodo, 'ruta': ruta, 'cuerpo': peticion.get('cuerpo'),
+                             # La identidad es la del lote: no se puede cambiar por sub-petición
+                             'headers': {str(k): str(v) for k, v in headers.items()
+                                         if str(k).lower() != 'authorization'}})
+    return normalizadas
+
+
+def _respuesta(response):
+    cuerpo = response.get_data(as_text=True)
+    if response.is_json:
+        cuerpo = json.loads(cuerpo) if cuerpo else None
+    return {'estado': response.status_code,
+            'headers': {h: response.headers[h] for h in HEADERS_RESPUESTA if h in response.headers},
+            'cuerpo': cuerpo}
+
+
+def _despachar(app, peticion, headers):
+    environ = EnvironBuilder(
+        path=peticion['ruta'], method=peticion['metodo'],
+        json=peticion['cuerpo'] if peticion['cuerpo'] is not None else None,
+        headers={**headers, **peticion['headers']},
+        base_url=request.host_url,
+        environ_overrides={'REMOTE_ADDR': request.remote_addr},
+    ).get_environ()
+    # Contexto de app propio: cada sub-petición tiene su g (métricas, estado de la base)
+    with app.app_context(), app.request_context(environ):
+        try:
+            response = app.full_dispatch_request()
+        except Exception as e:
+            print(f"Error en sub-petición {peticion['metodo']} {peticion['ruta']}: {e}")
+            return {'estado': 500, 'headers': {}, 'cuerpo': {'error': f'Error en la sub-petición: {str(e)}'}}
+        return _respuesta(response)
+
+
+def ejecutar(app, peticiones, usuario):
+    """Despachar las sub-peticiones en orden sobre una conexión compartida y juntar las respuestas"""
+    headers = {h: request.headers[h] for h in ('Authorization', 'Accept-Language') if h in request.headers}
+    _lote.activo, _lote.conexion, _lote.usuario = True, None, usuario
+    respuestas = []
+    try:
+        for peticion in peticiones:
+            respuesta = _despachar(app, peticion, headers)
+            SUBPETICIONES.incrementar(str(respuesta['estado']))
+            respuestas.append(respuesta)
+    finally:
+        conexion = _lote.conexion
+        _lote.activo, _lote.conexion, _lote.usuario = False, None, None
+        if conexion is not None:
+            try:
+                conexion.cerrar()
+            except Exception as e:
+                print(f"Error cerrando la conexión del lote: {e}")
+    return respuestas
@@ -0,0 +1,9 @@
+"""
+Benchmark de carga para inventory_api.py y las APIs de tareas.
+
+- dataset: generador de datos sintéticos con el esquema de bdd.sql
+- sqlite_odbc: sustituto de pyodbc sobre SQLite
+- runner: escenarios, ejecución concurrente y reporte JSON
+
+Se ejecuta con ``python -m benchmark`` desde la raíz del repositorio.
+"""
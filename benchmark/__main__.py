@@ -0,0 +1,91 @@
+"""
+Benchmark de carga reproducible.
+
+Uso:
+    python -m benchmark --productos 5000 --movimientos 100000 --hilos 8 --duracion 30 \\
+        --salida bench_output.json
+
+Para comparar dos commits basta con correr el mismo comando (misma semilla y
+escala) en cada uno y diferenciar los JSON resultantes.
+"""
+import argparse
+import json
+import os
+import sys
+
+from . import dataset, runner, sqlite_odbc
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark',
+                                     description='Benchmark de carga de la API de inventario y de tareas')
+    parser.add_argument('--productos', type=int, default=1000, help='Cantidad de productos a generar')
+    parser.add_argument('--movimientos', type=int, default=20000, help='Cantidad de movimientos de stock')
+    parser.add_argument('--categorias', type=int, default=8)
+    parser.add_argument('--proveedores', type=int, default=8)
+    parser.add_argument('--dias', type=int, default=365, help='Días de historia de movimientos')
+    parser.add_argument('--sesgo', type=float, default=1.1, help='Exponente Zipf de los SKU calientes')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--hilos', type=int, default=4, help='Clientes concurrentes')
+    parser.add_argument('--duracion', type=float, default=10.0, help='Segundos de carga')
+    parser.add_argument('--peticiones', type=int, default=None, help='Cortar tras N peticiones en total')
+    parser.add_argument('--apps', default='inventario,tareas,tareas_sql',
+                        help='Servidores a ejercitar (inventario, tareas, tareas_sql)')
+    parser.add_argument('--mezcla', default=None,
+                        help='Archivo JSON {escenario: peso} que reemplaza los pesos por defecto')
+    parser.add_argument('--directorio', default='bench_data', help='Directorio de las bases SQLite')
+    parser.add_argument('--salida', default=None, help='Archivo JSON del reporte (por defecto stdout)')
+    parser.add_argument('--listar', action='store_true', help='Mostrar los escenarios disponibles y salir')
+    args = parser.parse_args(argv)
+
+    if args.listar:
+        for nombre, escenario in runner.ESCENARIOS.items():
+            print(f"{nombre:32} {escenario['app']:12} {escenario['metodo']:7} peso={escenario['peso']}")
+        return 0
+
+    escenarios = {nombre: dict(e) for nombre, e in runner.ESCENARIOS.items()}
+    if args.mezcla:
+        pesos = runner.cargar_mezcla(args.mezcla)
+        desconocidos = set(pesos) - set(escenarios)
+        if desconocidos:
+            parser.error(f"Escenarios desconocidos en la mezcla: {', '.join(sorted(desconocidos))}")
+        for nombre, escenario in escenarios.items():
+            escenario['peso'] = pesos.get(nombre, 0)
+
+    apps = [a.strip() for a in args.apps.split(',') if a.strip()]
+    for nombre in apps:
+        if nombre not in runner.MODULOS:
+            parser.error(f"App desconocida: {nombre}")
+
+    directorio = os.path.abspath(args.directorio)
+    sqlite_odbc.configurar(directorio)
+    print(f"Generando dataset: {args.productos} productos, {args.movimientos} movimientos...", file=sys.stderr)
+    datos = dataset.generar(productos=args.productos, movimientos=args.movimientos,
+                            categorias=args.categorias, proveedores=args.proveedores,
+                            dias=args.dias, sesgo=args.sesgo, semilla=args.semilla)
+    dataset.cargar(sqlite_odbc.ruta_base_datos('InventarioDB'), datos)
+    if os.path.exists(sqlite_odbc.ruta_base_datos('TasksDB')):
+        os.remove(sqlite_odbc.ruta_base_datos('TasksDB'))
+
+    aplicaciones = runner.cargar_apps(apps)
+    if 'inventario' in aplicaciones:
+        runner.preparar_inventario()
+    print(f"Ejecutando carga con {args.hilos} hilos...", file=sys.stderr)
+    resultados, transcurrido = runner.ejecutar(aplicaciones, datos, escenarios, hilos=args.hilos,
+                                               duracion=args.duracion, peticiones=args.peticiones,
+                                               semilla=args.semilla)
+    parametros = {k: v for k, v in vars(args).items() if k not in ('salida', 'listar', 'directorio')}
+    reporte = runner.resumir(resultados, transcurrido, parametros)
+
+    texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+        print(f"Reporte guardado en {args.salida}", file=sys.stderr)
+    else:
+        print(texto)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
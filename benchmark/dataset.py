@@ -0,0 +1,208 @@
+"""
+Generador de datos sintéticos con el esquema de bdd.sql (InventarioDB).
+
+Genera categorías, proveedores, N productos y M movimientos de stock con una
+distribución sesgada (Zipf) para que unos pocos SKU concentren la mayor parte
+de los movimientos, como pasa en un depósito real. La generación es
+determinista para una misma semilla.
+"""
+import hashlib
+import os
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+ESQUEMA = """
+CREATE TABLE Categorias (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nombre NVARCHAR(100) NOT NULL UNIQUE,
+    descripcion NVARCHAR(255) NULL,
+    fecha_creacion DATETIME2 NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE Proveedores (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nombre NVARCHAR(100) NOT NULL,
+    contacto NVARCHAR(100) NULL,
+    email NVARCHAR(100) NULL,
+    telefono NVARCHAR(20) NULL,
+    direccion NVARCHAR(255) NULL,
+    fecha_creacion DATETIME2 NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE Productos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nombre NVARCHAR(100) NOT NULL,
+    descripcion NVARCHAR NULL,
+    codigo_sku NVARCHAR(50) NULL UNIQUE,
+    precio DECIMAL(10, 2) NOT NULL,
+    costo DECIMAL(10, 2) NULL,
+    cantidad_stock INT NOT NULL DEFAULT 0,
+    stock_minimo INT NOT NULL DEFAULT 5,
+    categoria_id INT NOT NULL REFERENCES Categorias(id),
+    proveedor_id INT NULL REFERENCES Proveedores(id),
+    activo BIT NOT NULL DEFAULT 1,
+    fecha_creacion DATETIME2 NOT NULL DEFAULT (datetime('now', 'localtime')),
+    fecha_actualizacion DATETIME2 NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE MovimientosStock (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    producto_id INT NOT NULL REFERENCES Productos(id),
+    tipo_movimiento NVARCHAR(20) NOT NULL,
+    cantidad INT NOT NULL,
+    motivo NVARCHAR(255) NULL,
+    numero_referencia NVARCHAR(50) NULL,
+    fecha_movimiento DATETIME2 NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE Usuarios (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username NVARCHAR(50) NOT NULL UNIQUE,
+    password_hash NVARCHAR(255) NOT NULL,
+    rol NVARCHAR(20) DEFAULT 'usuario',
+    activo BIT DEFAULT 1,
+    fecha_creacion DATETIME DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE INDEX IX_MovimientosStock_Fecha ON MovimientosStock (fecha_movimiento);
+CREATE INDEX IX_MovimientosStock_Producto ON MovimientosStock (producto_id);
+CREATE INDEX IX_Productos_Categoria ON Productos (categoria_id);
+CREATE INDEX IX_Productos_Proveedor ON Productos (proveedor_id);
+CREATE INDEX IX_Productos_SKU ON Productos (codigo_sku);
+"""
+
+# Categorías y proveedores reales de bdd.sql; el resto se numera
+CATEGORIAS_BASE = [
+    ('Electrónicos', 'Dispositivos electrónicos y accesorios'),
+    ('Oficina', 'Artículos y muebles de oficina'),
+    ('Limpieza', 'Productos de limpieza y aseo'),
+    ('Hogar', 'Artículos para el hogar'),
+    ('Informática', 'Equipos y componentes de computación'),
+    ('Papelería', 'Artículos de escritorio y material escolar'),
+    ('Bebidas', 'Bebidas alcohólicas y no alcohólicas'),
+    ('Deportes', 'Artículos deportivos y fitness'),
+]
+
+PROVEEDORES_BASE = [
+    'TechSupply Corp', 'Office Solutions SA', 'CleanPro Distribuidora',
+    'Home Essentials Ltd', 'CompuTech Solutions', 'Papelería Central',
+    'Bebidas Premium SA', 'SportMax Distribuidora',
+]
+
+_PALABRAS = ['Laptop', 'Silla', 'Detergente', 'Toalla', 'Mouse', 'Escritorio',
+             'Limpiador', 'Ollas', 'Monitor', 'Resma', 'Agua', 'Pelota', 'Teclado',
+             'Block', 'Refresco', 'Bicicleta', 'Cable', 'Lámpara', 'Cuaderno', 'Taza']
+_MARCAS = ['Dell', 'Samsung', 'Logitech', 'Adidas', 'Genérico', 'Pro', 'Max', 'Eco']
+_MOTIVOS_ENTRADA = ['Compra a proveedor', 'Devolución de cliente', 'Ajuste de inventario']
+_MOTIVOS_SALIDA = ['Venta', 'Merma', 'Consumo interno', 'Ajuste de inventario']
+
+
+def generar(productos=1000, movimientos=20000, categorias=8, proveedores=8,
+            dias=365, sesgo=1.1, semilla=42, fin=None):
+    """Generar el dataset completo como listas de tuplas listas para insertar"""
+    rnd = random.Random(semilla)
+    fin = fin or datetime.now().replace(microsecond=0)
+    inicio = fin - timedelta(days=dias)
+
+    datos_categorias = []
+    for i in range(categorias):
+        if i < len(CATEGORIAS_BASE):
+            nombre, descripcion = CATEGORIAS_BASE[i]
+        else:
+            nombre, descripcion = f"Categoría {i + 1}", f"Categoría sintética {i + 1}"
+        datos_categorias.append((i + 1, nombre, descripcion, inicio))
+
+    datos_proveedores = []
+    for i in range(proveedores):
+        nombre = PROVEEDORES_BASE[i] if i < len(PROVEEDORES_BASE) else f"Proveedor {i + 1}"
+        datos_proveedores.append((i + 1, nombre, f"Contacto {i + 1}", f"ventas{i + 1}@proveedor.com",
+                                  f"555-{i + 1:04d}", f"Calle {i + 1}", inicio))
+
+    datos_productos = []
+    for i in range(productos):
+        producto_id = i + 1
+        categoria_id = rnd.randint(1, categorias)
+        costo = round(rnd.uniform(2, 600), 2)
+        nombre = f"{rnd.choice(_PALABRAS)} {rnd.choice(_MARCAS)} {producto_id}"
+        datos_productos.append([
+            producto_id, nombre, f"Descripción de {nombre}. " * rnd.randint(1, 6),
+            f"SKU-{categoria_id:02d}-{producto_id:07d}", round(costo * rnd.uniform(1.2, 1.8), 2),
+            costo, 0, rnd.choice([3, 5, 10, 20]), categoria_id,
+            rnd.randint(1, proveedores), 1, inicio, inicio
+        ])
+
+    # Ranking Zipf: el producto de rango r recibe peso 1 / r^sesgo
+    ranking = list(range(1, productos + 1))
+    rnd.shuffle(ranking)
+    acumulados = []
+    total = 0.0
+    for rango in range(1, productos + 1):
+        total += 1.0 / (rango ** sesgo)
+        acumulados.append(total)
+
+    # Marcas de tiempo ordenadas para poder llevar el stock corriente
+    segundos = int((fin - inicio).total_seconds())
+    instantes = sorted(rnd.randrange(segundos) for _ in range(movimientos))
+    stock = [0] * (productos + 1)
+    datos_movimientos = []
+    elegidos = rnd.choices(ranking, cum_weights=acumulados, k=movimientos)
+    for n, (instante, producto_id) in enumerate(zip(instantes, elegidos), start=1):
+        cantidad = rnd.randint(1, 20)
+        if stock[producto_id] >= cantidad and rnd.random() < 0.55:
+            tipo, motivo = 'SALIDA', rnd.choice(_MOTIVOS_SALIDA)
+            stock[producto_id] -= cantidad
+        else:
+            tipo, motivo = 'ENTRADA', rnd.choice(_MOTIVOS_ENTRADA)
+            stock[producto_id] += cantidad
+        datos_movimientos.append((n, producto_id, tipo, cantidad, motivo, f"REF-{n:08d}",
+                                  inicio + timedelta(seconds=instante)))
+
+    for fila in datos_productos:
+        fila[6] = stock[fila[0]]
+
+    return {
+        'categorias': datos_categorias,
+        'proveedores': datos_proveedores,
+        'productos': [tuple(f) for f in datos_productos],
+        'movimientos': datos_movimientos,
+        # Los 1% de productos más movidos, para sesgar también las peticiones
+        'productos_calientes': ranking[:max(1, productos // 100)],
+        'ranking': ranking,
+        'acumulados': acumulados,
+    }
+
+
+def cargar(ruta, datos):
+    """Crear la base SQLite en ruta y cargar el dataset"""
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    for sufijo in ('-wal', '-shm'):
+        if os.path.exists(ruta + sufijo):
+            os.remove(ruta + sufijo)
+
+    conn = sqlite3.connect(ruta)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(ESQUEMA)
+    conn.executemany("INSERT INTO Categorias (id, nombre, descripcion, fecha_creacion) VALUES (?, ?, ?, ?)",
+                     datos['categorias'])
+    conn.executemany("""
+        INSERT INTO Proveedores (id, nombre, contacto, email, telefono, direccion, fecha_creacion)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, datos['proveedores'])
+    conn.executemany("""
+        INSERT INTO Productos (id, nombre, descripcion, codigo_sku, precio, costo, cantidad_stock,
+                               stock_minimo, categoria_id, proveedor_id, activo, fecha_creacion,
+                               fecha_actualizacion)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, datos['productos'])
+    conn.executemany("""
+        INSERT INTO MovimientosStock (id, producto_id, tipo_movimiento, cantidad, motivo,
+                                      numero_referencia, fecha_movimiento)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, datos['movimientos'])
+    conn.execute("INSERT INTO Usuarios (username, password_hash, rol, activo) VALUES (?, ?, 'admin', 1)",
+                 ('admin', hashlib.sha256('admin123'.encode()).hexdigest()))
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
@@ -0,0 +1,115 @@
+"""
+Planes y tiempos de las consultas calientes de productos, antes y después de
+las migraciones de índices.
+
+Genera un dataset, deja la base en el esquema previo a los índices
+(migrations.VERSION_BASE), mide cada consulta y guarda su plan; después aplica
+las migraciones restantes y repite. Las consultas son las que emiten los
+endpoints; la versión "antes" de stock bajo es la comparación de columnas que
+se usaba hasta tener deficit_stock.
+
+Uso:
+    python -m benchmark.planes --productos 50000 --salida planes.json
+
+Los planes son los de SQLite (EXPLAIN QUERY PLAN del sustituto): muestran si la
+consulta recorre la tabla y ordena en un temporal o si la resuelve un índice.
+En SQL Server hay que mirar el plan real de las mismas sentencias.
+"""
+import argparse
+import json
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from . import dataset, sqlite_odbc
+
+_PAGINA = "OFFSET 100 ROWS FETCH NEXT 50 ROWS ONLY"
+
+
+def consultas():
+    """(nombre, sql antes, sql después o None si no cambia, parámetros)"""
+    import fieldsets
+    columnas, joins = fieldsets.seleccionar(fieldsets.PRODUCTOS, fieldsets.nombres_pedidos(fieldsets.PRODUCTOS, None))
+    listado = f"SELECT {columnas} FROM Productos p {joins} WHERE {{donde}} ORDER BY p.nombre, p.id {_PAGINA}"
+    stock_bajo = ("SELECT p.id, p.nombre, p.codigo_sku, p.cantidad_stock, p.stock_minimo, c.nombre as categoria_nombre "
+                  "FROM Productos p LEFT JOIN Categorias c ON p.categoria_id = c.id WHERE {donde} ORDER BY {orden}")
+    return [
+        ('listado_pagina', listado.format(donde='p.activo = 1'), None, ()),
+        ('listado_total', "SELECT COUNT(*) FROM Productos p WHERE p.activo = 1", None, ()),
+        ('listado_categoria', listado.format(donde='p.activo = 1 AND p.categoria_id = ?'), None, (2,)),
+        ('listado_categoria_total', "SELECT COUNT(*) FROM Productos p WHERE p.activo = 1 AND p.categoria_id = ?",
+         None, (2,)),
+        ('productos_por_categoria', "SELECT c.nombre, COUNT(p.id) as cantidad FROM Categorias c "
+                                    "LEFT JOIN Productos p ON c.id = p.categoria_id AND p.activo = 1 "
+                                    "GROUP BY c.id, c.nombre ORDER BY cantidad DESC", None, ()),
+        ('stock_bajo',
+         stock_bajo.format(donde='p.cantidad_stock <= p.stock_minimo AND p.activo = 1',
+                           orden='(p.cantidad_stock - p.stock_minimo) ASC'),
+         stock_bajo.format(donde='p.activo = 1 AND p.deficit_stock >= 0', orden='p.deficit_stock DESC'), ()),
+        ('stock_bajo_total', "SELECT COUNT(*) FROM Productos WHERE cantidad_stock <= stock_minimo AND activo = 1",
+         "SELECT COUNT(*) FROM Productos WHERE activo = 1 AND deficit_stock >= 0", ()),
+    ]
+
+
+def medir(conn, sql, params, repeticiones):
+    """Mediana en ms de ejecutar y leer la consulta, filas y plan"""
+    cursor = conn.cursor()
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        cursor.execute(sql, *params)
+        filas = len(cursor.fetchall())
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return {'ms': round(statistics.median(tiempos), 3), 'filas': filas, 'plan': conn.explicar(sql, *params)}
+
+
+def comparar(productos, movimientos, repeticiones, semilla):
+    """Medir todas las consultas con el esquema base y con todas las migraciones"""
+    import migrations
+    directorio = tempfile.mkdtemp(prefix='planes_')
+    try:
+        sqlite_odbc.configurar(directorio)
+        datos = dataset.generar(productos=productos, movimientos=movimientos, semilla=semilla)
+        dataset.cargar(sqlite_odbc.ruta_base_datos('InventarioDB'), datos)
+        conn = sqlite_odbc.connect('DATABASE=InventarioDB')
+        try:
+            migrations.migrar(conn, hasta=migrations.VERSION_BASE)
+            resultados = {nombre: {'antes': medir(conn, antes, params, repeticiones)}
+                          for nombre, antes, _, params in consultas()}
+            migrations.migrar(conn)
+            for nombre, antes, despues, params in consultas():
+                resultados[nombre]['despues'] = medir(conn, despues or antes, params, repeticiones)
+        finally:
+            conn.close()
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+    return resultados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark.planes',
+                                     description='Planes y tiempos de las consultas de productos antes/después de los índices')
+    parser.add_argument('--productos', type=int, default=20000)
+    parser.add_argument('--movimientos', type=int, default=20000)
+    parser.add_argument('--repeticiones', type=int, default=20, help='Ejecuciones por consulta (se toma la mediana)')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--salida', default=None, help='Archivo JSON con el detalle')
+    args = parser.parse_args(argv)
+
+    resultados = comparar(args.productos, args.movimientos, args.repeticiones, args.semilla)
+    for nombre, r in resultados.items():
+        antes, despues = r['antes'], r['despues']
+        factor = antes['ms'] / despues['ms'] if despues['ms'] else float('inf')
+        print(f"{nombre:<26} {antes['ms']:>9.2f} ms -> {despues['ms']:>8.2f} ms  (x{factor:.1f}, {despues['filas']} filas)")
+        print(f"    antes:   {' | '.join(antes['plan'])}")
+        print(f"    después: {' | '.join(despues['plan'])}")
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'consultas': resultados}, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+Presupuesto de consultas por endpoint.
+
+Las regresiones de rendimiento de inventory_api.py suelen ser un handler que
+de a poco suma sentencias. Este chequeo ejecuta cada endpoint una vez, en un
+orden fijo y contra el sustituto SQLite, registra las sentencias SQL exactas
+que emite (cada execute es un round trip) y las compara con el presupuesto
+versionado en benchmark/query_budget.json. Cualquier diferencia falla con un
+diff legible de las sentencias.
+
+Uso:
+    python -m benchmark.query_budget              # comparar (código de salida 1 si hay diferencias)
+    python -m benchmark.query_budget --actualizar # reescribir el presupuesto tras un cambio intencional
+
+El tope por petición de query_log.py (QUERY_BUDGET) avisa en producción; este
+presupuesto es exacto y se revisa antes de mergear.
+"""
+import argparse
+import difflib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from datetime import date, timedelta
+
+from . import dataset, runner, sqlite_odbc
+
+RUTA_PRESUPUESTO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_budget.json')
+
+# Endpoints que no se ejercitan: no son de la API
+SIN_CASO = {'static'}
+
+USUARIO = {'username': 'admin', 'password': 'admin123'}
+
+
+def _trabajo_terminado(ctx):
+    """Ruta del trabajo encolado por el caso anterior, una vez terminado (el estado no depende de cuánto tarde)"""
+    import inventory_api
+    inventory_api.trabajos.esperar(ctx['trabajo']['id'], timeout=120)
+    return f"/trabajos/{ctx['trabajo']['id']}"
+
+
+def _producto(ctx):
+    return {'nombre': 'Producto presupuesto', 'descripcion': 'Creado por el chequeo de consultas',
+            'codigo_sku': 'PRESUPUESTO-1', 'precio': 10.5, 'cantidad_stock': 20, 'stock_minimo': 5,
+            'categoria_id': 1, 'proveedor_id': 1}
+
+
+# (nombre, método, ruta, cuerpo, clave de ctx donde guardar la respuesta). ruta y cuerpo pueden ser
+# funciones de ctx para usar ids creados por casos anteriores. El orden importa: es el de una sesión.
+CASOS = [
+    ('root', 'GET', '/', None, None),
+    ('login', 'POST', '/auth/login', USUARIO, 'login'),
+    ('register', 'POST', '/auth/register',
+     {'username': 'presupuesto', 'password': 'presupuesto123', 'email': 'presupuesto@example.com'}, None),
+    ('verify_auth', 'GET', '/auth/verify', None, None),
+    ('logout', 'POST', '/auth/logout', None, None),
+
+    ('get_categorias', 'GET', '/categorias', None, None),
+    ('get_categorias_campos', 'GET', '/categorias?fields=id,nombre', None, None),
+    ('create_categoria', 'POST', '/categorias', {'nombre': 'Categoría presupuesto', 'descripcion': 'x'},
+     'categoria'),
+    ('delete_categoria', 'DELETE', lambda c: f"/categorias/{c['categoria']['id']}", None, None),
+    ('get_proveedores', 'GET', '/proveedores', None, None),
+    ('create_proveedor', 'POST', '/proveedores', {'nombre': 'Proveedor presupuesto', 'email': 'p@example.com'},
+     'proveedor'),
+    ('delete_proveedor', 'DELETE', lambda c: f"/proveedores/{c['proveedor']['id']}", None, None),
+
+    ('get_productos', 'GET', '/productos', None, None),
+    ('get_productos_pagina', 'GET', '/productos?limit=50&offset=100&categoria_id=2', None, None),
+    ('get_producto', 'GET', '/productos/5', None, None),
+    ('get_stock_producto', 'GET', '/productos/5/stock', None, None),
+    ('create_producto', 'POST', '/productos', _producto, 'producto'),
+    ('update_producto', 'PUT', lambda c: f"/productos/{c['producto']['id']}",
+     lambda c: dict(_producto(c), precio=12.0, cantidad_stock=25), None),
+    ('delete_producto', 'DELETE', lambda c: f"/productos/{c['producto']['id']}", None, None),
+    ('ajustar_productos_dry_run', 'POST', '/productos/ajuste-masivo',
+     {'cambios': {'precio': {'porcentaje': 5}}, 'categoria_id': 2, 'dry_run': True}, None),
+    ('ajustar_productos', 'POST', '/productos/ajuste-masivo',
+     {'cambios': {'precio': {'porcentaje': 5}, 'stock_minimo': {'monto': 1}}, 'categoria_id': 2}, None),
+    ('buscar_productos', 'GET', '/productos/buscar?q=silla%20eco', None, None),
+    ('get_producto_por_sku', 'GET', lambda c: f"/productos/sku/{c['skus'][5]}", None, None),
+    ('get_producto_por_sku_indexado', 'GET', lambda c: f"/productos/sku/{c['skus'][5]}", None, None),
+    ('get_producto_por_sku_inexistente', 'GET', '/productos/sku/NO-EXISTE-1', None, None),
+    ('resolver_skus', 'POST', '/productos/sku', lambda c: {'skus': [c['skus'][1], c['skus'][5], 'NO-EXISTE-2']},
+     None),
+    ('sync_productos', 'GET', '/sync/productos?since=0', None, None),
+    ('debug_productos_categorias', 'GET', '/debug/productos-categorias', None, None),
+
+    ('get_movimientos', 'GET', '/movimientos?limit=50', None, None),
+    ('get_movimientos_producto', 'GET', '/movimientos?producto_id=5&limit=20', None, None),
+    ('create_movimiento', 'POST', '/movimientos',
+     {'producto_id': 5, 'tipo_movimiento': 'ENTRADA', 'cantidad': 3, 'motivo': 'Presupuesto',
+      'numero_referencia': 'PRESUPUESTO-MOV-1'}, None),
+    ('get_estado_ingesta', 'GET', '/ingesta/estado', None, None),
+
+    ('create_reserva', 'POST', '/reservas', {'producto_id': 5, 'cantidad': 2, 'referencia': 'PRESUPUESTO-R1'},
+     'reserva'),
+    ('get_reserva', 'GET', lambda c: f"/reservas/{c['reserva']['id']}", None, None),
+    ('get_estado_reservas', 'GET', '/reservas/estado', None, None),
+    ('confirmar_reserva', 'POST', lambda c: f"/reservas/{c['reserva']['id']}/confirmar", {'motivo': 'Venta'},
+     None),
+    ('create_reserva_liberar', 'POST', '/reservas', {'producto_id': 1, 'cantidad': 1}, 'reserva_liberar'),
+    ('liberar_reserva', 'POST', lambda c: f"/reservas/{c['reserva_liberar']['id']}/liberar", None, None),
+
+    ('get_dashboard_stats', 'GET', '/reportes/dashboard-stats', None, None),
+    ('get_movimientos_serie', 'GET', '/reportes/movimientos-serie?dias=90&granularidad=semana&agrupar=categoria',
+     None, None),
+    ('get_valuacion', 'GET', '/reportes/valuacion', None, None),
+    ('get_reabastecimiento', 'GET', '/reportes/reabastecimiento', None, None),
+    ('get_stock_bajo', 'GET', '/reportes/stock-bajo', None, None),
+    ('get_stock_al', 'GET', lambda c: f"/reportes/stock-al?fecha={date.today() - timedelta(days=30)}", None, None),
+
+    ('crear_trabajo', 'POST', '/trabajos', {'tipo': 'dashboard'}, 'trabajo'),
+    ('get_trabajo', 'GET', _trabajo_terminado, None, None),
+    ('descargar_trabajo', 'GET', lambda c: f"/trabajos/{c['trabajo']['id']}/resultado", None, None),
+    ('listar_trabajos', 'GET', '/trabajos', None, None),
+    ('get_programa_trabajos', 'GET', '/trabajos/programa', None, None),
+
+    ('ejecutar_lote', 'POST', '/batch',
+     {'peticiones': [{'metodo': 'GET', 'ruta': ruta} for ruta in
+                     ('/categorias?fields=id,nombre', '/proveedores?fields=id,nombre', '/reportes/stock-bajo')]},
+     None),
+    ('iniciar_perfilado', 'POST', '/admin/perfilado', {'endpoint': 'root', 'duracion_s': 60}, None),
+    ('root_perfilado', 'GET', '/', None, None),
+    ('estado_perfilado', 'GET', '/admin/perfilado', None, None),
+    ('detener_perfilado', 'DELETE', '/admin/perfilado', None, None),
+    ('descargar_perfilado', 'GET', '/admin/perfilado/descarga?tipo=texto', None, None),
+    ('salud_db', 'GET', '/salud/db', None, None),
+    ('metrics', 'GET', '/metrics', None, None),
+]
+
+
+def _normalizar(sql):
+    return ' '.join(sql.split())
+
+
+class Registro:
+    """Observador del sustituto SQLite que guarda las sentencias del hilo de las peticiones"""
+
+    def __init__(self):
+        self.hilo = threading.get_ident()
+        self.sentencias = []
+
+    def __call__(self, sql, params, duracion):
+        # Los índices en memoria y el vencimiento de reservas consultan desde sus propios hilos
+        if threading.get_ident() == self.hilo:
+            self.sentencias.append(_normalizar(sql))
+
+
+def medir(directorio):
+    """Ejecutar los casos sobre un dataset chico y fijo; devuelve {caso: medición} y los endpoints sin caso"""
+    os.environ.update({
+        'RATE_LIMIT_ENABLED': '0',
+        'INGEST_ENABLED': '0',
+        'RESERVATIONS_JOURNAL_PATH': os.path.join(directorio, 'reservas', 'reservas.jsonl'),
+        # Sin revisiones de cambios por tiempo: solo las que disparan las escrituras de cada caso
+        'SEARCH_REFRESH_MS': str(10 ** 9),
+        'SKU_REFRESH_MS': str(10 ** 9),
+    })
+    sqlite_odbc.configurar(directorio)
+    datos = dataset.generar(productos=300, movimientos=3000, dias=120, semilla=7)
+    dataset.cargar(sqlite_odbc.ruta_base_datos('InventarioDB'), datos)
+
+    app = runner.cargar_apps(['inventario'])['inventario']
+    runner.preparar_inventario()
+    app.try_trigger_before_first_request_functions()
+    cliente = app.test_client()
+
+    registro = Registro()
+    sqlite_odbc.observadores.append(registro)
+    cubiertos = set()
+    ctx = {'skus': {fila[0]: fila[3] for fila in datos['productos']}}
+    mediciones = {}
+    try:
+        for nombre, metodo, ruta, cuerpo, guardar in CASOS:
+            ruta = ruta(ctx) if callable(ruta) else ruta
+            cuerpo = cuerpo(ctx) if callable(cuerpo) else cuerpo
+            token = ctx.get('login', {}).get('token')
+            headers = {'Authorization': f'Bearer {token}'} if token else {}
+            registro.sentencias = []
+            response = cliente.open(ruta, method=metodo, json=cuerpo, headers=headers)
+            if guardar:
+                ctx[guardar] = response.get_json()
+            endpoint, regla = _regla(app, ruta, metodo)
+            cubiertos.add(endpoint)
+            mediciones[nombre] = {'endpoint': f'{metodo} {regla}', 'estado': response.status_code,
+                                  'round_trips': len(registro.sentencias), 'sentencias': registro.sentencias}
+    finally:
+        sqlite_odbc.observadores.remove(registro)
+
+    sin_caso = sorted(r.endpoint for r in app.url_map.iter_rules()
+                      if r.endpoint not in cubiertos and r.endpoint not in SIN_CASO)
+    return mediciones, sin_caso
+
+
+def _regla(app, ruta, metodo):
+    """Endpoint de Flask y regla de URL (sin los ids concretos) que atiende la ruta"""
+    adaptador = app.url_map.bind('localhost')
+    try:
+        regla, _ = adaptador.match(ruta.split('?')[0], method=metodo, return_rule=True)
+        return regla.endpoint, regla.rule
+    except Exception:
+        return None, ruta.split('?')[0]
+
+
+def comparar(presupuesto, mediciones):
+    """Líneas de reporte de las diferencias (vacío si todo coincide)"""
+    reporte = []
+    for nombre in sorted(set(presupuesto) - set(mediciones)):
+        reporte.append(f"FALTA  {nombre}: está en el presupuesto pero ya no es un caso")
+    for nombre, actual in mediciones.items():
+        esperado = presupuesto.get(nombre)
+        if esperado is None:
+            reporte.append(f"NUEVO  {nombre} ({actual['endpoint']}): {actual['round_trips']} round trips "
+                           f"sin presupuesto; correr con --actualizar")
+            continue
+        if esperado['estado'] != actual['estado']:
+            reporte.append(f"ESTADO {nombre} ({actual['endpoint']}): {esperado['estado']} -> {actual['estado']}")
+        if esperado['sentencias'] != actual['sentencias']:
+            signo = '+' if actual['round_trips'] > esperado['round_trips'] else ''
+            reporte.append(f"SQL    {nombre} ({actual['endpoint']}): {esperado['round_trips']} -> "
+                           f"{actual['round_trips']} round trips ({signo}"
+                           f"{actual['round_trips'] - esperado['round_trips']})")
+            reporte.extend('    ' + linea.rstrip('\n') for linea in difflib.unified_diff(
+                esperado['sentencias'], actual['sentencias'], 'presupuesto', 'actual', lineterm='', n=1))
+    return reporte
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark.query_budget',
+                                     description='Comparar las sentencias SQL de cada endpoint con el presupuesto')
+    parser.add_argument('--actualizar', action='store_true', help='Reescribir el presupuesto con lo medido')
+    parser.add_argument('--presupuesto', default=RUTA_PRESUPUESTO, help='Archivo JSON del presupuesto')
+    args = parser.parse_args(argv)
+
+    directorio = tempfile.mkdtemp(prefix='query_budget_')
+    try:
+        mediciones, sin_caso = medir(directorio)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    if sin_caso:
+        print(f"Endpoints sin caso en benchmark/query_budget.py: {', '.join(sin_caso)}", file=sys.stderr)
+
+    if args.actualizar:
+        with open(args.presupuesto, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(mediciones, indent=2, ensure_ascii=False) + '\n')
+        total = sum(m['round_trips'] for m in mediciones.values())
+        print(f"Presupuesto guardado en {args.presupuesto}: {len(mediciones)} casos, {total} round trips",
+              file=sys.stderr)
+        return 1 if sin_caso else 0
+
+    try:
+        with open(args.presupuesto, encoding='utf-8') as f:
+            presupuesto = json.load(f)
+    except FileNotFoundError:
+        print(f"No existe {args.presupuesto}; generarlo con --actualizar", file=sys.stderr)
+        return 1
+
+    reporte = comparar(presupuesto, mediciones)
+    for linea in reporte:
+        print(linea)
+    if reporte or sin_caso:
+        diferencias = sum(1 for linea in reporte if not linea.startswith(' '))
+        print(f"\nPresupuesto de consultas excedido o desactualizado ({diferencias} diferencias). "
+              "Si el cambio es intencional: python -m benchmark.query_budget --actualizar", file=sys.stderr)
+        return 1
+    print(f"OK: {len(mediciones)} casos dentro del presupuesto", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,413 @@
+"""
+Ejecución de la carga contra los servidores Flask y armado del reporte JSON.
+
+Cada hilo trabajador tiene su propio test_client de Flask y elige escenarios
+según los pesos de la mezcla. Los escenarios cubren todos los endpoints de
+inventory_api.py y de las APIs de tareas (flask_server.py y flask_sql_server.py).
+"""
+import importlib
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+from . import sqlite_odbc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Contador de sentencias SQL por hilo (round trips a la base de datos)
+_local = threading.local()
+
+
+def _contar_sentencia(sql, params, duracion):
+    _local.sentencias = getattr(_local, 'sentencias', 0) + 1
+
+
+def _sentencias():
+    return getattr(_local, 'sentencias', 0)
+
+
+def _producto_sesgado(ctx, rnd):
+    """Elegir un producto siguiendo la misma distribución Zipf del dataset"""
+    return rnd.choices(ctx['ranking'], cum_weights=ctx['acumulados'])[0]
+
+
+def _cuerpo_producto(ctx, rnd):
+    n = next(ctx['secuencia'])
+    return {
+        'nombre': f"Producto benchmark {n}",
+        'descripcion': 'Creado por el benchmark',
+        'codigo_sku': f"BENCH-{ctx['corrida']}-{n}",
+        'precio': round(rnd.uniform(5, 500), 2),
+        'cantidad_stock': rnd.randint(0, 100),
+        'stock_minimo': 5,
+        'categoria_id': rnd.randint(1, ctx['categorias']),
+        'proveedor_id': rnd.randint(1, ctx['proveedores']),
+    }
+
+
+def _preparar_actualizacion(cliente, ctx, rnd):
+    """Leer el producto actual para enviar un PUT completo (como hace el frontend)"""
+    producto_id = _producto_sesgado(ctx, rnd)
+    actual = cliente.get(f"/productos/{producto_id}", headers=ctx['headers']).get_json() or {}
+    actual['precio'] = round(float(actual.get('precio', 10)) * rnd.uniform(0.95, 1.05), 2)
+    return {'id': producto_id, 'cuerpo': actual}
+
+
+def _preparar_creado(ruta, cuerpo):
+    """Crear un recurso fuera de la medición y devolver su id"""
+    def preparar(cliente, ctx, rnd):
+        respuesta = cliente.post(ruta, json=cuerpo(ctx, rnd), headers=ctx['headers'])
+        return {'id': (respuesta.get_json() or {}).get('id')}
+    return preparar
+
+
+def _cuerpo_reserva(ctx, rnd):
+    return {'producto_id': _producto_sesgado(ctx, rnd), 'cantidad': 1, 'ttl_segundos': 60,
+            'referencia': f"BENCH-{ctx['corrida']}-{next(ctx['secuencia'])}"}
+
+
+def _cuerpo_movimiento(ctx, rnd):
+    return {
+        'producto_id': _producto_sesgado(ctx, rnd),
+        'tipo_movimiento': 'ENTRADA' if rnd.random() < 0.5 else 'SALIDA',
+        'cantidad': rnd.randint(1, 5),
+        'motivo': 'Benchmark',
+        'numero_referencia': f"BENCH-{ctx['corrida']}-{next(ctx['secuencia'])}",
+    }
+
+
+def _cuerpo_categoria(ctx, rnd):
+    return {'nombre': f"Categoría bench {ctx['corrida']}-{next(ctx['secuencia'])}", 'descripcion': 'Benchmark'}
+
+
+def _cuerpo_proveedor(ctx, rnd):
+    return {'nombre': f"Proveedor bench {next(ctx['secuencia'])}", 'contacto': 'Benchmark'}
+
+
+def _cuerpo_tarea(ctx, rnd):
+    return {'title': f"Tarea {next(ctx['secuencia'])}", 'description': 'Benchmark'}
+
+
+def _cuerpo_usuario(ctx, rnd):
+    return {'username': f"bench_{ctx['corrida']}_{next(ctx['secuencia'])}", 'password': 'benchmark'}
+
+
+# Catálogo de escenarios: app, método, ruta, cuerpo, preparación previa (no medida) y peso por defecto
+ESCENARIOS = {
+    'raiz': dict(app='inventario', metodo='GET', ruta=lambda c, r, p: '/', peso=1),
+    'auth_login': dict(app='inventario', metodo='POST', ruta=lambda c, r, p: '/auth/login',
+                       cuerpo=lambda c, r, p: {'username': 'admin', 'password': 'admin123'}, peso=2),
+    'auth_register': dict(app='inventario', metodo='POST', ruta=lambda c, r, p: '/auth/register',
+                          cuerpo=lambda c, r, p: _cuerpo_usuario(c, r), peso=1),
+    'auth_verify': dict(app='inventario', metodo='GET', ruta=lambda c, r, p: '/auth/verify', peso=2),
+    'auth_logout': dict(app='inventario', metodo='POST', ruta=lambda c, r, p: '/auth/logout', peso=1),
+    'categorias_listar': dict(app='inventario', metodo='GET', ruta=lambda c, r, p: '/categorias', peso=6),
+    'categorias_crear': dict(app='inventario', metodo='POST', ruta=lambda c, r, p: '/categorias',
+                             cuerpo=lambda c, r, p: _cuerpo_categoria(c, r), peso=1),
+    'categorias_eliminar': dict(app='inventario', metodo='DELETE',
+                                ruta=lambda c, r, p: f"/categorias/{p['id']}",
+                                preparar=_preparar_creado('/categorias', _cuerpo_categoria), peso=1),
+    'proveedores_listar': dict(app='inventario', metodo='GET', ruta=lambda c, r, p: '/proveedores', peso=6),
+    'proveedores_crear': dict(app='inventario', metodo='POST', ruta=lambda c, r, p: '/proveedores',
+                              cuerpo=lambda c, r, p: _cuerpo_proveedor(c, r), peso=1),
+    'proveedores_eliminar': dict(app='inventario', metodo='DELETE',
+                                 ruta=lambda c, r, p: f"/proveedores/{p['id']}",
+                                 preparar=_preparar_creado('/proveedores', _cuerpo_proveedor), peso=1),
+    'productos_listar': dict(app='inventario', metodo='GET', ruta=lambda c, r, p: '/productos', peso=10),
+    'productos_pagina': dict(app='inventario', metodo='GET',
+                             ruta=lambda c, r, p: r.choice([
+                                 f"/productos?limit=100&offset={r.randrange(0, 5000, 100)}",
+                                 f"/productos?limit=100&q={r.choice(['silla', 'sku-01', 'agua', 'x'])}",
+                                 '/productos?limit=100&estado_stock=bajo']), peso=6),
+    'productos_buscar': dict(app='inventario', metodo='GET',
+                             ruta=lambda c, r, p: "/productos/buscar?q=" + r.choice([
+                                 'silla', 'sila+dell', 'lamp', 'monitr', 'sku-01', 'agua+eco']), peso=4),
+    'producto_sku': dict(app='inventario', metodo='GET',
+                         ruta=lambda c, r, p: r.choice([
+                             f"/productos/sku/{c['skus'][_producto_sesgado(c, r)]}",
+                             f"/productos/sku/DESCONOCIDO-{r.randrange(10 ** 6)}"]), peso=10),
+    'productos_sku_lote': dict(app='inventario', metodo='POST', ruta=lambda c, r, p: '/productos/sku',
+                               cuerpo=lambda c, r, p: {'skus': [c['skus'][_producto_sesgado(c, r)]
+                                                                for _ in range(20)]}, peso=2),
+    'producto_detalle': dict(app='inventario', metodo='GET',
+                             ruta=lambda c, r, p: f"/productos/{_producto_sesgado(c, r)}", peso=15),
+    'producto_crear': dict(app='inventario', metodo='POST', ruta=lambda c, r, p: '/productos',
+                           cuerpo=lambda c, r, p: _cuerpo_producto(c, r), peso=2),
+    'producto_actualizar': dict(app='inventario', metodo='PUT', ruta=lambda c, r, p: f"/productos/{p['id']}",
+                                cuerpo=lambda c, r, p: p['cuerpo'], preparar=_preparar_actualizacion, peso=3),
+    'producto_eliminar': dict(app='inventario', metodo='DELETE', ruta=lambda c, r, p: f"/productos/{p['id']}",
+                              preparar=_preparar_creado('/productos', _cuerpo_producto), peso=1),
+    'debug_productos_categorias': dict(app='inventario', metodo='GET',
+                                       ruta=lambda c, r, p: '/debug/productos-categorias', peso=1),
+    'movimientos_listar': dict(app='inventario', metodo='GET', ruta=lambda c, r, p: '/movimientos', peso=3),
+    'movimientos_pagina': dict(app='inventario', metodo='GET',
+                               ruta=lambda c, r, p: f"/movimientos?limit=100&offset={r.randrange(0, 10000, 100)}",
+                               peso=3),
+    'movimiento_crear': dict(app='inventario', metodo='POST', ruta=lambda c, r, p: '/movimientos',
+                             cuerpo=lambda c, r, p: _cuerpo_movimiento(c, r), peso=15),
+    'reserva_crear': dict(app='inventario', metodo='POST', ruta=lambda c, r, p: '/reservas',
+                          cuerpo=lambda c, r, p: _cuerpo_reserva(c, r), peso=4),
+    'reserva_cerrar': dict(app='inventario', metodo='POST',
+                           ruta=lambda c, r, p: f"/reservas/{p['id']}/{r.choice(['confirmar', 'liberar'])}",
+                           preparar=_preparar_creado('/reservas', _cuerpo_reserva), peso=4),
+    'dashboard_lote': dict(app='inventario', metodo='POST', ruta=lambda c, r, p: '/batch',
+                           cuerpo=lambda c, r, p: {'peticiones': [
+                               {'metodo': 'GET', 'ruta': ruta} for ruta in
+                               ('/sync/productos?since=0', '/categorias?fields=id,nombre',
+                                '/proveedores?fields=id,nombre', '/reportes/stock-bajo')]}, peso=2),
+    'stock_al': dict(app='inventario', metodo='GET',
+                     ruta=lambda c, r, p: f"/reportes/stock-al?fecha={date.today() - timedelta(days=r.randint(1, 300))}"
+                                          f"&categoria_id={r.randint(1, c['categorias'])}", peso=1),
+    'dashboard_stats': dict(app='inventario', metodo='GET', ruta=lambda c, r, p: '/reportes/dashboard-stats',
+                            peso=5),
+    'movimientos_serie': dict(app='inventario', metodo='GET',
+                              ruta=lambda c, r, p: r.choice([
+                                  '/reportes/movimientos-serie?dias=90&granularidad=semana&agrupar=categoria',
+                                  '/reportes/movimientos-serie?dias=30&agrupar=producto',
+                                  '/reportes/movimientos-serie?dias=365&granularidad=mes']), peso=2),
+    'stock_bajo': dict(app='inventario', metodo='GET', ruta=lambda c, r, p: '/reportes/stock-bajo', peso=5),
+    'valuacion': dict(app='inventario', metodo='GET', ruta=lambda c, r, p: '/reportes/valuacion', peso=1),
+    'trabajo_exportar': dict(app='inventario', metodo='POST', ruta=lambda c, r, p: '/trabajos',
+                             cuerpo=lambda c, r, p: {'tipo': 'movimientos_csv', 'parametros': {
+                                 'desde': str(date.today() - timedelta(days=r.randint(7, 90)))}}, peso=1),
+}
+
+for _app in ('tareas', 'tareas_sql'):
+    ESCENARIOS.update({
+        f'{_app}_raiz': dict(app=_app, metodo='GET', ruta=lambda c, r, p: '/', peso=1),
+        f'{_app}_listar': dict(app=_app, metodo='GET', ruta=lambda c, r, p: '/tasks', peso=4),
+        f'{_app}_crear': dict(app=_app, metodo='POST', ruta=lambda c, r, p: '/tasks',
+                              cuerpo=lambda c, r, p: _cuerpo_tarea(c, r), peso=2),
+        f'{_app}_detalle': dict(app=_app, metodo='GET', ruta=lambda c, r, p: f"/tasks/{p['id']}",
+                                preparar=_preparar_creado('/tasks', _cuerpo_tarea), peso=2),
+        f'{_app}_actualizar': dict(app=_app, metodo='PUT', ruta=lambda c, r, p: f"/tasks/{p['id']}",
+                                   cuerpo=lambda c, r, p: {'title': 'Editada', 'completed': True},
+                                   preparar=_preparar_creado('/tasks', _cuerpo_tarea), peso=1),
+        f'{_app}_eliminar': dict(app=_app, metodo='DELETE', ruta=lambda c, r, p: f"/tasks/{p['id']}",
+                                 preparar=_preparar_creado('/tasks', _cuerpo_tarea), peso=1),
+        f'{_app}_completadas': dict(app=_app, metodo='GET', ruta=lambda c, r, p: '/tasks/completed', peso=1),
+        f'{_app}_pendientes': dict(app=_app, metodo='GET', ruta=lambda c, r, p: '/tasks/pending', peso=1),
+    })
+
+MODULOS = {
+    'inventario': 'inventory_api',
+    'tareas': 'flask_server',
+    'tareas_sql': 'flask_sql_server',
+}
+
+
+def usar_sustituto(directorio):
+    """Inicializador de los procesos del pool de trabajos: el mismo sustituto y la misma base"""
+    sys.modules['pyodbc'] = sqlite_odbc
+    sqlite_odbc.configurar(directorio)
+
+
+def cargar_apps(nombres):
+    """Importar los servidores con pyodbc reemplazado por el sustituto SQLite"""
+    sys.modules['pyodbc'] = sqlite_odbc
+    directorio = os.path.dirname(sqlite_odbc.ruta_base_datos('InventarioDB'))
+    # El benchmark mide la capacidad del servidor, no las cuotas por usuario
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    # Ni reportes precalculados: se mide el cálculo en la petición
+    os.environ.setdefault('JOBS_SCHEDULE', '')
+    os.environ.setdefault('JOBS_DIR', os.path.join(directorio, 'trabajos'))
+    apps = {}
+    for nombre in nombres:
+        modulo = importlib.import_module(MODULOS[nombre])
+        modulo.app.testing = True
+        apps[nombre] = modulo.app
+        if hasattr(modulo, 'trabajos'):
+            modulo.trabajos.inicializadores.append((usar_sustituto, (directorio,)))
+    return apps
+
+
+def preparar_inventario():
+    """Completar las tablas derivadas que la app mantiene a partir del historial"""
+    import rollups
+    import snapshots
+    conn = sqlite_odbc.connect('DATABASE=InventarioDB')
+    try:
+        rollups.backfill(conn)
+        # Fotos de stock mensuales, como las dejaría un cron
+        for dias in range(1, 366, 30):
+            snapshots.tomar(conn, date.today() - timedelta(days=dias))
+    finally:
+        conn.close()
+    # Los índices en memoria se cargan antes de medir, como en un servidor ya arrancado
+    import inventory_api
+    inventory_api.indice_busqueda.construir()
+    inventory_api.indice_sku.cargar()
+
+
+def percentil(valores_ordenados, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not valores_ordenados:
+        return None
+    indice = max(0, min(len(valores_ordenados) - 1, int(round(p / 100 * len(valores_ordenados) + 0.5)) - 1))
+    return valores_ordenados[indice]
+
+
+def memoria_pico_kb():
+    """RSS máxima del proceso en KB (None si la plataforma no la expone)"""
+    if resource is None:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset // 1024
+        except Exception:
+            return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico // 1024 if sys.platform == 'darwin' else pico
+
+
+def commit_actual():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def _trabajador(indice, apps, escenarios, pesos, ctx, fin, tomar_turno, resultados, semilla):
+    rnd = random.Random(semilla + indice)
+    clientes = {nombre: app.test_client() for nombre, app in apps.items()}
+    nombres = list(escenarios)
+    while time.perf_counter() < fin and tomar_turno():
+        nombre = rnd.choices(nombres, weights=pesos)[0]
+        escenario = escenarios[nombre]
+        cliente = clientes[escenario['app']]
+        preparado = {}
+        if 'preparar' in escenario:
+            preparado = escenario['preparar'](cliente, ctx, rnd)
+        ruta = escenario['ruta'](ctx, rnd, preparado)
+        cuerpo = escenario['cuerpo'](ctx, rnd, preparado) if 'cuerpo' in escenario else None
+
+        sentencias_antes = _sentencias()
+        inicio = time.perf_counter()
+        try:
+            respuesta = cliente.open(ruta, method=escenario['metodo'], json=cuerpo, headers=ctx['headers'])
+            estado = respuesta.status_code
+            respuesta.close()
+        except Exception:
+            estado = 599
+        duracion = time.perf_counter() - inicio
+        resultados[nombre].append((duracion, estado, _sentencias() - sentencias_antes))
+
+
+def ejecutar(apps, datos, escenarios, hilos=4, duracion=10.0, peticiones=None, semilla=42):
+    """Lanzar la carga y devolver las muestras crudas por escenario"""
+    if _contar_sentencia not in sqlite_odbc.observadores:
+        sqlite_odbc.observadores.append(_contar_sentencia)
+
+    ctx = {
+        'ranking': datos['ranking'],
+        'acumulados': datos['acumulados'],
+        'skus': {fila[0]: fila[3] for fila in datos['productos']},
+        'categorias': len(datos['categorias']),
+        'proveedores': len(datos['proveedores']),
+        'secuencia': itertools.count(1),
+        'corrida': int(time.time()),
+        'headers': {},
+    }
+    if 'inventario' in apps:
+        login = apps['inventario'].test_client().post(
+            '/auth/login', json={'username': 'admin', 'password': 'admin123'})
+        token = (login.get_json() or {}).get('token')
+        if token:
+            ctx['headers'] = {'Authorization': f'Bearer {token}'}
+
+    seleccion = {n: e for n, e in escenarios.items() if e['app'] in apps and e['peso'] > 0}
+    pesos = [e['peso'] for e in seleccion.values()]
+    resultados = {nombre: [] for nombre in seleccion}
+    # Límite global de peticiones compartido por todos los hilos
+    restantes = {'n': peticiones}
+    lock = threading.Lock()
+
+    def tomar_turno():
+        if restantes['n'] is None:
+            return True
+        with lock:
+            if restantes['n'] <= 0:
+                return False
+            restantes['n'] -= 1
+            return True
+
+    inicio = time.perf_counter()
+    fin = inicio + duracion if duracion else float('inf')
+    trabajadores = [
+        threading.Thread(target=_trabajador,
+                         args=(i, apps, seleccion, pesos, ctx, fin, tomar_turno, resultados, semilla))
+        for i in range(hilos)
+    ]
+    for t in trabajadores:
+        t.start()
+    for t in trabajadores:
+        t.join()
+    return resultados, time.perf_counter() - inicio
+
+
+def resumir(resultados, transcurrido, parametros):
+    """Armar el reporte JSON comparable entre commits"""
+    endpoints = {}
+    total = 0
+    errores_totales = 0
+    todas = []
+    for nombre, muestras in sorted(resultados.items()):
+        if not muestras:
+            continue
+        latencias = sorted(m[0] * 1000 for m in muestras)
+        sentencias = [m[2] for m in muestras]
+        errores = sum(1 for m in muestras if m[1] >= 500)
+        total += len(muestras)
+        errores_totales += errores
+        todas.extend(latencias)
+        escenario = ESCENARIOS[nombre]
+        endpoints[nombre] = {
+            'app': escenario['app'],
+            'metodo': escenario['metodo'],
+            'peticiones': len(muestras),
+            'errores': errores,
+            'estados': {str(e): sum(1 for m in muestras if m[1] == e) for e in sorted({m[1] for m in muestras})},
+            'throughput_rps': round(len(muestras) / transcurrido, 2),
+            'p50_ms': round(percentil(latencias, 50), 3),
+            'p95_ms': round(percentil(latencias, 95), 3),
+            'p99_ms': round(percentil(latencias, 99), 3),
+            'db_round_trips_promedio': round(sum(sentencias) / len(sentencias), 2),
+            'db_round_trips_max': max(sentencias),
+        }
+    todas.sort()
+    return {
+        'meta': {
+            'commit': commit_actual(),
+            'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'parametros': parametros,
+        },
+        'totales': {
+            'peticiones': total,
+            'errores': errores_totales,
+            'duracion_s': round(transcurrido, 3),
+            'throughput_rps': round(total / transcurrido, 2) if transcurrido else None,
+            'p50_ms': round(percentil(todas, 50), 3) if todas else None,
+            'p95_ms': round(percentil(todas, 95), 3) if todas else None,
+            'p99_ms': round(percentil(todas, 99), 3) if todas else None,
+        },
+        'endpoints': endpoints,
+        'memoria_pico_kb': memoria_pico_kb(),
+    }
+
+
+def cargar_mezcla(ruta):
+    """Leer pesos {escenario: peso} desde un archivo JSON"""
+    with open(ruta, encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,386 @@
+"""
+Sustituto de pyodbc sobre SQLite para benchmarks y pruebas locales.
+
+Expone la misma interfaz que usan inventory_api.py y flask_sql_server.py
+(connect, cursor.execute(sql, *params), fetchone/fetchall, commit...) y traduce
+al vuelo el dialecto T-SQL que aparece en esos servidores. Cada base de datos
+del connection string (DATABASE=...) se guarda en un archivo dentro del
+directorio configurado con configurar().
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+
+# Jerarquía de excepciones compatible con pyodbc
+Error = sqlite3.Error
+DatabaseError = sqlite3.DatabaseError
+IntegrityError = sqlite3.IntegrityError
+OperationalError = sqlite3.OperationalError
+ProgrammingError = sqlite3.ProgrammingError
+
+# Directorio donde viven los archivos .sqlite3
+_config = {'directorio': os.path.join(os.getcwd(), 'bench_data')}
+
+# Funciones llamadas con (sql_original, params, duracion_segundos) tras cada sentencia
+observadores = []
+
+sqlite3.register_adapter(Decimal, float)
+
+_lock_ddl = threading.Lock()
+
+
+def configurar(directorio):
+    """Definir el directorio de los archivos de base de datos"""
+    os.makedirs(directorio, exist_ok=True)
+    _config['directorio'] = directorio
+
+
+def ruta_base_datos(nombre):
+    """Ruta del archivo SQLite para una base de datos lógica"""
+    return os.path.join(_config['directorio'], f"{nombre}.sqlite3")
+
+
+def connect(connection_string='', autocommit=False, timeout=0, **kwargs):
+    """Equivalente a pyodbc.connect"""
+    match = re.search(r'DATABASE=([^;\s]+)', connection_string, re.IGNORECASE)
+    nombre = match.group(1) if match else 'default'
+    conn = sqlite3.connect(ruta_base_datos(nombre), timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    if autocommit:
+        conn.isolation_level = None
+    return Connection(conn)
+
+
+# ==================== TRADUCCIÓN T-SQL -> SQLite ====================
+
+def _argumentos(sql, inicio):
+    """Separar los argumentos de una llamada que abre en sql[inicio] == '('"""
+    nivel = 0
+    args = []
+    actual = inicio + 1
+    for i in range(inicio, len(sql)):
+        c = sql[i]
+        if c == '(':
+            nivel += 1
+        elif c == ')':
+            nivel -= 1
+            if nivel == 0:
+                args.append(sql[actual:i].strip())
+                return args, i
+        elif c == ',' and nivel == 1:
+            args.append(sql[actual:i].strip())
+            actual = i + 1
+    raise ProgrammingError(f"Paréntesis sin cerrar en: {sql}")
+
+
+def _reemplazar_funcion(sql, nombre, traductor):
+    """Reemplazar cada llamada nombre(...) por traductor(args)"""
+    patron = re.compile(r'\b' + nombre + r'\s*\(', re.IGNORECASE)
+    posicion = 0
+    while True:
+        match = patron.search(sql, posicion)
+        if not match:
+            return sql
+        args, fin = _argumentos(sql, match.end() - 1)
+        reemplazo = traductor([_reemplazar_funcion(a, nombre, traductor) for a in args])
+        sql = sql[:match.start()] + reemplazo + sql[fin + 1:]
+        posicion = match.start() + len(reemplazo)
+
+
+def _traducir_cast(args):
+    expresion, _, tipo = args[0].rpartition(' AS ')
+    if not expresion:
+        expresion, _, tipo = args[0].rpartition(' as ')
+    tipo = tipo.strip().upper()
+    if tipo == 'DATE':
+        return f"date({expresion})"
+    if tipo.startswith(('DECIMAL', 'FLOAT', 'NUMERIC', 'MONEY')):
+        return f"CAST({expresion} AS REAL)"
+    if tipo.startswith(('NVARCHAR', 'VARCHAR', 'CHAR', 'NCHAR')):
+        return f"CAST({expresion} AS TEXT)"
+    return f"CAST({expresion} AS {tipo})"
+
+
+def _traducir_dateadd(args):
+    unidad, cantidad, expresion = args
+    unidades = {'day': 'days', 'dd': 'days', 'd': 'days', 'hour': 'hours',
+                'minute': 'minutes', 'month': 'months', 'year': 'years'}
+    unidad = unidades.get(unidad.lower(), 'days')
+    if re.fullmatch(r'-?\d+', cantidad):
+        modificador = f"'{int(cantidad):+d} {unidad}'"
+    else:
+        modificador = f"(({cantidad}) || ' {unidad}')"
+    return f"datetime({expresion}, {modificador})"
+
+
+def _traducir_datediff(args):
+    unidad, desde, hasta = args
+    dias = f"(julianday({hasta}) - julianday({desde}))"
+    if unidad.lower() in ('hour', 'hh'):
+        return f"CAST({dias} * 24 AS INTEGER)"
+    return f"CAST({dias} AS INTEGER)"
+
+
+_REGLAS = [
+    (re.compile(r"IF\s+NOT\s+EXISTS\s*\(\s*SELECT\s+\*\s+FROM\s+sysobjects\s+WHERE\s+name\s*=\s*'\w+'"
+                r"\s+AND\s+xtype\s*=\s*'U'\s*\)\s*CREATE\s+TABLE", re.IGNORECASE),
+     'CREATE TABLE IF NOT EXISTS'),
+    (re.compile(r"INFORMATION_SCHEMA\.TABLES\s+WHERE\s+TABLE_NAME", re.IGNORECASE),
+     "sqlite_master WHERE type = 'table' AND name"),
+    (re.compile(r"INFORMATION_SCHEMA\.COLUMNS\s+WHERE\s+TABLE_NAME\s*=\s*(\?|'\w+')\s+AND\s+COLUMN_NAME",
+                re.IGNORECASE),
+     r"pragma_table_info(\1) WHERE name"),
+    (re.compile(r"\bINT\s+IDENTITY\s*\(\s*1\s*,\s*1\s*\)\s+PRIMARY\s+KEY", re.IGNORECASE),
+     'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    (re.compile(r"\bIDENTITY\s*\(\s*\d+\s*,\s*\d+\s*\)", re.IGNORECASE), ''),
+    (re.compile(r"\((MAX)\)", re.IGNORECASE), ''),
+    (re.compile(r"DEFAULT\s+GETDATE\(\)", re.IGNORECASE), "DEFAULT (datetime('now', 'localtime'))"),
+    (re.compile(r"DEFAULT\s+SYSDATETIME\(\)", re.IGNORECASE), "DEFAULT (datetime('now', 'localtime'))"),
+    (re.compile(r"\b(GETDATE|SYSDATETIME)\(\)", re.IGNORECASE), "datetime('now', 'localtime')"),
+    (re.compile(r"\bWITH\s*\(\s*(NOLOCK|UPDLOCK|HOLDLOCK|ROWLOCK|READPAST)(\s*,\s*\w+)*\s*\)", re.IGNORECASE), ''),
+    (re.compile(r"\bISNULL\s*\(", re.IGNORECASE), 'IFNULL('),
+    (re.compile(r"\bLEN\s*\(", re.IGNORECASE), 'length('),
+    (re.compile(r"\bN'", re.IGNORECASE), "'"),
+    (re.compile(r"\bOFFSET\s+(\?|\d+)\s+ROWS\s+FETCH\s+NEXT\s+(\?|\d+)\s+ROWS\s+ONLY", re.IGNORECASE),
+     r"LIMIT \1, \2"),
+    (re.compile(r"\bMIN_ACTIVE_ROWVERSION\(\)", re.IGNORECASE), "(SELECT valor + 1 FROM _dbts)"),
+    # Índices: SQLite no tiene columnas incluidas; se agregan al final de la clave
+    (re.compile(r"\bCREATE\s+NONCLUSTERED\s+INDEX", re.IGNORECASE), 'CREATE INDEX'),
+    (re.compile(r"\)\s*INCLUDE\s*\(", re.IGNORECASE), ', '),
+    # ALTER TABLE no puede agregar columnas calculadas STORED; VIRTUAL también se indexa
+    (re.compile(r"\bPERSISTED\b", re.IGNORECASE), 'VIRTUAL'),
+]
+
+_TOP = re.compile(r"\bSELECT\s+TOP\s*\(?\s*(\d+|\?)\s*\)?", re.IGNORECASE)
+_OUTPUT = re.compile(r"\bOUTPUT\s+INSERTED\.(\w+)\s*", re.IGNORECASE)
+_ROWVERSION = re.compile(r"^\s*ALTER\s+TABLE\s+(\w+)\s+ADD\s+(\w+)\s+(ROWVERSION|TIMESTAMP)\s*$", re.IGNORECASE)
+_NO_OPS = re.compile(r"^\s*(SET\s+(TRANSACTION\s+ISOLATION|LOCK_TIMEOUT|NOCOUNT)|ALTER\s+DATABASE)", re.IGNORECASE)
+
+_cache_traducciones = {}
+
+
+def traducir(sql):
+    """Traducir una sentencia T-SQL a SQLite (con caché)"""
+    traducida = _cache_traducciones.get(sql)
+    if traducida is not None:
+        return traducida
+
+    if _NO_OPS.match(sql):
+        _cache_traducciones[sql] = ''
+        return ''
+
+    texto = sql
+    for patron, reemplazo in _REGLAS:
+        texto = patron.sub(reemplazo, texto)
+    texto = _reemplazar_funcion(texto, 'CAST', _traducir_cast)
+    texto = _reemplazar_funcion(texto, 'DATEADD', _traducir_dateadd)
+    texto = _reemplazar_funcion(texto, 'DATEDIFF', _traducir_datediff)
+
+    # OUTPUT INSERTED.col -> RETURNING col
+    match = _OUTPUT.search(texto)
+    if match:
+        texto = texto[:match.start()] + texto[match.end():]
+        texto = texto.rstrip().rstrip(';') + f" RETURNING {match.group(1)}"
+
+    # SELECT TOP n -> LIMIT n al final (el parámetro ? se mueve al final)
+    match = _TOP.search(texto)
+    mover_top = False
+    if match:
+        limite = match.group(1)
+        texto = texto[:match.start()] + 'SELECT ' + texto[match.end():]
+        texto = texto.rstrip().rstrip(';') + f" LIMIT {limite}"
+        mover_top = limite == '?'
+
+    _cache_traducciones[sql] = (texto, mover_top)
+    return _cache_traducciones[sql]
+
+
+def _sentencias_rowversion(tabla, columna):
+    """Emular una columna ROWVERSION: contador global de la base (_dbts) más triggers"""
+    asignar = (f"UPDATE _dbts SET valor = valor + 1; "
+               f"UPDATE {tabla} SET {columna} = (SELECT valor FROM _dbts) WHERE rowid = NEW.rowid;")
+    return [
+        "CREATE TABLE IF NOT EXISTS _dbts (valor INTEGER NOT NULL)",
+        "INSERT INTO _dbts SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM _dbts)",
+        f"ALTER TABLE {tabla} ADD {columna} INTEGER",
+        f"UPDATE {tabla} SET {columna} = (SELECT valor FROM _dbts) + rowid",
+        f"UPDATE _dbts SET valor = valor + (SELECT IFNULL(MAX(rowid), 0) FROM {tabla})",
+        f"CREATE TRIGGER {tabla}_{columna}_ins AFTER INSERT ON {tabla} BEGIN {asignar} END",
+        f"CREATE TRIGGER {tabla}_{columna}_upd AFTER UPDATE ON {tabla} "
+        f"WHEN NEW.{columna} IS OLD.{columna} BEGIN {asignar} END",
+    ]
+
+
+# ==================== CONVERSIÓN DE RESULTADOS ====================
+
+_FECHA_HORA = re.compile(r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d+)?$')
+_FECHA = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def _convertir_valor(valor):
+    """Devolver fechas como objetos datetime/date, igual que pyodbc"""
+    if isinstance(valor, str) and len(valor) >= 10 and valor[4] == '-':
+        if _FECHA.match(valor):
+            return date.fromisoformat(valor)
+        if _FECHA_HORA.match(valor):
+            return datetime.fromisoformat(valor.replace(' ', 'T')[:26])
+    return valor
+
+
+class Row(tuple):
+    """Fila con acceso por índice y por nombre de columna"""
+
+    def __new__(cls, valores, columnas):
+        fila = super().__new__(cls, valores)
+        fila._columnas = columnas
+        return fila
+
+    def __getattr__(self, nombre):
+        try:
+            return self[self._columnas[nombre]]
+        except KeyError:
+            raise AttributeError(nombre)
+
+
+@contextmanager
+def _como_sql_server():
+    """Reportar la base bloqueada como el lock timeout de SQL Server (error 1222)"""
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if 'locked' not in str(e):
+            raise
+        raise OperationalError('HY000', f'[SQLite] Lock request time out period exceeded. (1222) {e}') from e
+
+
+class Cursor:
+    """Cursor con la semántica de pyodbc: execute(sql, *params)"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection._conn.cursor()
+        self._vacio = False
+        self._columnas = {}
+        self.description = None
+        self.rowcount = -1
+
+    def execute(self, sql, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = tuple(params[0])
+        inicio = time.perf_counter()
+        traducida = traducir(sql)
+        rowversion = _ROWVERSION.match(sql)
+        if rowversion:
+            with _lock_ddl:
+                for sentencia in _sentencias_rowversion(*rowversion.group(1, 2)):
+                    self._cursor.execute(sentencia)
+            self._vacio = True
+            self.description = None
+            self.rowcount = -1
+        elif traducida == '':
+            self._vacio = True
+            self.description = None
+            self.rowcount = -1
+        else:
+            texto, mover_top = traducida
+            if mover_top:
+                params = params[1:] + params[:1]
+            with _como_sql_server():
+                if texto.lstrip().upper().startswith(('CREATE', 'ALTER', 'DROP')):
+                    with _lock_ddl:
+                        self._cursor.execute(texto, params)
+                else:
+                    self._cursor.execute(texto, params)
+            self._vacio = False
+            self.description = self._cursor.description
+            self.rowcount = self._cursor.rowcount
+            self._columnas = {d[0]: i for i, d in enumerate(self.description or [])}
+        duracion = time.perf_counter() - inicio
+        for observador in observadores:
+            observador(sql, params, duracion)
+        return self
+
+    def executemany(self, sql, secuencia):
+        secuencia = [tuple(p) for p in secuencia]
+        inicio = time.perf_counter()
+        texto, _ = traducir(sql)
+        with _como_sql_server():
+            self._cursor.executemany(texto, secuencia)
+        self.rowcount = self._cursor.rowcount
+        duracion = time.perf_counter() - inicio
+        for observador in observadores:
+            observador(sql, secuencia, duracion)
+
+    def _fila(self, valores):
+        return Row([_convertir_valor(v) for v in valores], self._columnas)
+
+    def fetchone(self):
+        if self._vacio:
+            return None
+        fila = self._cursor.fetchone()
+        return self._fila(fila) if fila is not None else None
+
+    def fetchmany(self, size=1):
+        if self._vacio:
+            return []
+        return [self._fila(f) for f in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        if self._vacio:
+            return []
+        return [self._fila(f) for f in self._cursor.fetchall()]
+
+    def nextset(self):
+        return False
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    """Conexión con la interfaz de pyodbc.Connection"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.timeout = 0
+
+    @property
+    def autocommit(self):
+        return self._conn.isolation_level is None
+
+    @autocommit.setter
+    def autocommit(self, valor):
+        self._conn.isolation_level = None if valor else ''
+
+    def cursor(self):
+        return Cursor(self)
+
+    def execute(self, sql, *params):
+        return self.cursor().execute(sql, *params)
+
+    def explicar(self, sql, *params):
+        """Plan de SQLite (EXPLAIN QUERY PLAN) para la sentencia T-SQL traducida"""
+        texto, mover_top = traducir(sql)
+        if mover_top:
+            params = params[1:] + params[:1]
+        return [fila[3] for fila in self._conn.execute(f"EXPLAIN QUERY PLAN {texto}", params)]
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        # Como pyodbc: lo no confirmado se descarta al cerrar
+        self._conn.rollback()
+        self._conn.close()
@@ -0,0 +1,153 @@
+"""
+Ajuste masivo de precio, costo y stock mínimo.
+
+Repreciar una categoría era leer cada producto y mandar un PUT completo por
+producto: tres round trips y una reescritura de todas las columnas, stock
+incluido. POST /productos/ajuste-masivo aplica un cambio porcentual o absoluto
+a los productos activos que cumplen el filtro con un único UPDATE, y con
+"dry_run" devuelve cuántos cambiarían y una muestra con los valores antes y
+después, sin escribir.
+
+Cuerpo:
+    {"cambios": {"precio": {"porcentaje": 10}, "stock_minimo": {"monto": 2}},
+     "categoria_id": 3, "proveedor_id": 7, "ids": [1, 2, 3], "dry_run": true}
+
+Los filtros se combinan (AND) y hace falta al menos uno. Precio y costo se
+redondean a 2 decimales y el stock mínimo a entero; ningún valor queda
+negativo y un costo NULL sigue NULL.
+"""
+import math
+
+# Campo -> decimales del resultado
+CAMPOS = {'precio': 2, 'costo': 2, 'stock_minimo': 0}
+TIPOS = ('porcentaje', 'monto')
+
+MAX_IDS = 1000
+MUESTRA = 20
+
+
+class AjusteInvalido(ValueError):
+    """El cuerpo de POST /productos/ajuste-masivo no tiene el formato esperado"""
+
+
+def _numero(valor, descripcion):
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)) or not math.isfinite(valor):
+        raise AjusteInvalido(f'{descripcion} debe ser un número')
+    return valor
+
+
+def _entero(valor, descripcion):
+    if isinstance(valor, bool) or not isinstance(valor, int) or valor <= 0:
+        raise AjusteInvalido(f'{descripcion} debe ser un id entero positivo')
+    return valor
+
+
+def leer_ajuste(data):
+    """Validar el cuerpo y devolver {'cambios': [(campo, tipo, valor)], 'filtro': {...}, 'dry_run'}"""
+    if not isinstance(data, dict):
+        raise AjusteInvalido('Se esperaba un objeto JSON')
+    cambios = data.get('cambios')
+    if not isinstance(cambios, dict) or not cambios:
+        raise AjusteInvalido(f'Se requiere "cambios" con alguno de: {", ".join(CAMPOS)}')
+
+    normalizados = []
+    for campo, cambio in cambios.items():
+        if campo not in CAMPOS:
+            raise AjusteInvalido(f'Campo no ajustable: {campo} (permitidos: {", ".join(CAMPOS)})')
+        tipos = [t for t in TIPOS if isinstance(cambio, dict) and t in cambio]
+        if len(tipos) != 1:
+            raise AjusteInvalido(f'{campo}: indicar "porcentaje" o "monto" (uno solo)')
+        valor = _numero(cambio[tipos[0]], f'{campo}.{tipos[0]}')
+        if tipos[0] == 'porcentaje' and valor < -100:
+            raise AjusteInvalido(f'{campo}.porcentaje no puede ser menor a -100')
+        normalizados.append((campo, tipos[0], valor))
+
+    filtro = {}
+    for clave in ('categoria_id', 'proveedor_id'):
+        if data.get(clave) is not None:
+            filtro[clave] = _entero(data[clave], clave)
+    if data.get('ids') is not None:
+        ids = data['ids']
+        if not isinstance(ids, list) or not ids:
+            raise AjusteInvalido('"ids" debe ser una lista no vacía')
+        if len(ids) > MAX_IDS:
+            raise AjusteInvalido(f'Máximo {MAX_IDS} ids por ajuste')
+        filtro['ids'] = sorted({_entero(i, 'ids') for i in ids})
+    if not filtro:
+        raise AjusteInvalido('Se requiere al menos un filtro: categoria_id, proveedor_id o ids')
+
+    return {'cambios': normalizados, 'filtro': filtro, 'dry_run': bool(data.get('dry_run'))}
+
+
+def _expresion(campo, tipo, valor):
+    """SQL del nuevo valor del campo y sus parámetros"""
+    nuevo = f"{campo} * (1 + ? / 100.0)" if tipo == 'porcentaje' else f"{campo} + ?"
+    nuevo = f"ROUND({nuevo}, {CAMPOS[campo]})"
+    if CAMPOS[campo] == 0:
+        nuevo = f"CAST({nuevo} AS INT)"
+    return f"CASE WHEN {nuevo} < 0 THEN 0 ELSE {nuevo} END", [valor, valor]
+
+
+def _condicion(filtro):
+    condiciones, parametros = ['activo = 1'], []
+    for clave in ('categoria_id', 'proveedor_id'):
+        if clave in filtro:
+            condiciones.append(f'{clave} = ?')
+            parametros.append(filtro[clave])
+    if 'ids' in filtro:
+        condiciones.append(f"id IN ({', '.join('?' * len(filtro['ids']))})")
+        parametros.extend(filtro['ids'])
+    return ' AND '.join(condiciones), parametros
+
+
+def _decimal(valor, campo):
+    if valor is None:
+        return None
+    return int(valor) if CAMPOS[campo] == 0 else float(valor)
+
+
+def previsualizar(cursor, ajuste, muestra=MUESTRA):
+    """Cuántos productos cambiarían y los primeros con sus valores antes y después"""
+    columnas, parametros = [], []
+    for campo, tipo, valor in ajuste['cambios']:
+        expresion, params = _expresion(campo, tipo, valor)
+        columnas.append(f'{campo}, {expresion}')
+        parametros.extend(params)
+    condicion, params_filtro = _condicion(ajuste['filtro'])
+    cursor.execute(f"""
+        SELECT TOP (?) id, nombre, {', '.join(columnas)}, COUNT(*) OVER () as total
+        FROM Productos
+        WHERE {condicion}
+        ORDER BY id
+    """, muestra, *parametros, *params_filtro)
+    rows = cursor.fetchall()
+
+    productos = []
+    for row in rows:
+        producto = {'id': row[0], 'nombre': row[1]}
+        for i, (campo, _, _) in enumerate(ajuste['cambios']):
+            producto[campo] = {'antes': _decimal(row[2 + 2 * i], campo),
+                               'despues': _decimal(row[3 + 2 * i], campo)}
+        productos.append(producto)
+    return {'dry_run': True, 'afectados': rows[0][-1] if rows else 0,
+            'cambios': _describir(ajuste), 'muestra': productos}
+
+
+def aplicar(cursor, ajuste, ahora):
+    """Ejecutar el UPDATE; el commit queda a cargo de quien llama"""
+    asignaciones, parametros = [], []
+    for campo, tipo, valor in ajuste['cambios']:
+        expresion, params = _expresion(campo, tipo, valor)
+        asignaciones.append(f'{campo} = {expresion}')
+        parametros.extend(params)
+    condicion, params_filtro = _condicion(ajuste['filtro'])
+    cursor.execute(f"""
+        UPDATE Productos
+        SET {', '.join(asignaciones)}, fecha_actualizacion = ?
+        WHERE {condicion}
+    """, *parametros, ahora, *params_filtro)
+    return {'dry_run': False, 'afectados': cursor.rowcount, 'cambios': _describir(ajuste)}
+
+
+def _describir(ajuste):
+    return {campo: {tipo: valor} for campo, tipo, valor in ajuste['cambios']}
@@ -0,0 +1,280 @@
+"""
+Circuit breaker para la conexión a SQL Server y degradación de las lecturas.
+
+Con la base caída cada petición pagaba el timeout completo de login de ODBC.
+El interruptor cuenta los fallos seguidos (al conectar, o consultas que
+terminan por conexión perdida o timeout) y:
+
+- cerrado: las conexiones pasan normalmente;
+- abierto: tras BREAKER_FAILURES fallos seguidos; las peticiones fallan al
+  instante sin intentar conectar, durante BREAKER_RESET_SECONDS (que se
+  duplica con cada sonda fallida, hasta BREAKER_MAX_RESET_SECONDS);
+- semiabierto: vencida la espera, una sola petición prueba la conexión; si
+  anda el circuito se cierra y si falla vuelve a abrirse.
+
+configurar_degradacion() agrega a la app una caché de la última respuesta
+correcta de los GET de lectura: sin base se sirve esa copia marcada como
+desactualizada (headers Age y Warning) y, si no hay copia, 503 con
+Retry-After. GET /salud/db expone el estado del interruptor.
+
+Configuración (variables de entorno):
+    BREAKER_FAILURES           fallos seguidos para abrir el circuito (5)
+    BREAKER_RESET_SECONDS      espera antes de la primera sonda (15)
+    BREAKER_MAX_RESET_SECONDS  espera máxima entre sondas (120)
+    STALE_CACHE_MB             memoria para respuestas de respaldo (64)
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, g, has_request_context, jsonify, request
+
+from instrumentation import Contador, observadores_consulta, registrar_metrica
+
+CONFIG = {
+    'umbral_fallos': int(os.environ.get('BREAKER_FAILURES', 5)),
+    'espera_s': float(os.environ.get('BREAKER_RESET_SECONDS', 15)),
+    'espera_max_s': float(os.environ.get('BREAKER_MAX_RESET_SECONDS', 120)),
+    'cache_bytes': int(float(os.environ.get('STALE_CACHE_MB', 64)) * 1024 * 1024),
+}
+
+CERRADO, SEMIABIERTO, ABIERTO = 'cerrado', 'semiabierto', 'abierto'
+_VALOR_ESTADO = {CERRADO: 0, SEMIABIERTO: 1, ABIERTO: 2}
+
+# SQLSTATE de ODBC que indican conexión perdida o timeout, no un error de la consulta
+_ESTADOS_CONEXION = ('08', 'HYT00', 'HYT01')
+
+TRANSICIONES = registrar_metrica(Contador('db_circuit_transitions_total',
+                                          'Cambios de estado del circuit breaker de la base', ('estado',)))
+RECHAZOS = registrar_metrica(Contador('db_circuit_rejections_total',
+                                      'Conexiones rechazadas sin intentar con el circuito abierto', ()))
+RESPUESTAS_DEGRADADAS = registrar_metrica(Contador('db_degraded_responses_total',
+                                                   'Respuestas servidas sin base de datos', ('tipo',)))
+
+
+def es_fallo_de_conexion(error):
+    """True si la excepción de pyodbc es de conexión o timeout (SQLSTATE 08xxx, HYT00, HYT01)"""
+    estado = error.args[0] if getattr(error, 'args', None) else ''
+    return isinstance(estado, str) and estado.startswith(_ESTADOS_CONEXION)
+
+
+class Interruptor:
+    """Circuit breaker de tres estados con una sola sonda en semiabierto"""
+
+    def __init__(self, umbral_fallos=None, espera_s=None, espera_max_s=None):
+        self.umbral_fallos = umbral_fallos or CONFIG['umbral_fallos']
+        self.espera_inicial = espera_s if espera_s is not None else CONFIG['espera_s']
+        self.espera_max = espera_max_s if espera_max_s is not None else CONFIG['espera_max_s']
+        self.estado = CERRADO
+        self.fallos = 0
+        self.espera = self.espera_inicial
+        self.abierto_desde = None
+        self.reintento_en = 0.0
+        self.ultimo_error = None
+        self.rechazos = 0
+        self._lock = threading.Lock()
+
+    def _cambiar(self, estado):
+        if estado != self.estado:
+            self.estado = estado
+            TRANSICIONES.incrementar(estado)
+            print(f"Circuit breaker de la base: {estado}")
+
+    def abierto(self):
+        """True si ahora mismo una conexión sería rechazada sin intentar"""
+        if self.estado == CERRADO:
+            return False
+        return time.monotonic() < self.reintento_en
+
+    def segundos_para_reintento(self):
+        return max(0.0, self.reintento_en - time.monotonic())
+
+    def permitir(self):
+        """Decidir si se intenta conectar; en semiabierto solo pasa una sonda a la vez"""
+        if self.estado == CERRADO:
+            return True
+        with self._lock:
+            if self.estado == CERRADO:
+                return True
+            ahora = time.monotonic()
+            if ahora >= self.reintento_en:
+                # Si la sonda anterior nunca informó, se permite otra tras la misma espera
+                self._cambiar(SEMIABIERTO)
+                self.reintento_en = ahora + self.espera
+                return True
+            self.rechazos += 1
+        RECHAZOS.incrementar()
+        return False
+
+    def exito(self):
+        if self.estado == CERRADO and self.fallos == 0:
+            return
+        with self._lock:
+            self.fallos = 0
+            self.espera = self.espera_inicial
+            self.abierto_desde = None
+            self._cambiar(CERRADO)
+
+    def fallo(self, error=None):
+        with self._lock:
+            self.fallos += 1
+            self.ultimo_error = str(error) if error else self.ultimo_error
+            if self.estado == SEMIABIERTO:
+                # Falló la sonda: volver a abrir esperando el doble
+                self.espera = min(self.espera * 2, self.espera_max)
+            elif self.fallos < self.umbral_fallos:
+                return
+            if self.abierto_desde is None:
+                self.abierto_desde = time.time()
+            self.reintento_en = time.monotonic() + self.espera
+            self._cambiar(ABIERTO)
+
+    def proteger(self, obtener_conexion):
+        """Decorador para get_db_connection: falla al instante con el circuito abierto y cuenta fallos"""
+        @wraps(obtener_conexion)
+        def wrapper(*args, **kwargs):
+            if not self.permitir():
+                _marcar_sin_base()
+                return None
+            conn = obtener_conexion(*args, **kwargs)
+            if conn is None:
+                self.fallo()
+                _marcar_sin_base()
+            else:
+                self.exito()
+            return conn
+        return wrapper
+
+    def observar_consulta(self, sql, params, duracion, error):
+        """Observador de instrumentation: una consulta cortada por la conexión cuenta como fallo"""
+        if error is not None and es_fallo_de_conexion(error):
+            self.fallo(error)
+
+    def resumen(self):
+        return {
+            'estado': self.estado,
+            'fallos_seguidos': self.fallos,
+            'umbral_fallos': self.umbral_fallos,
+            'abierto_desde': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.abierto_desde))
+            if self.abierto_desde else None,
+            'proxima_sonda_en_s': round(self.segundos_para_reintento(), 3) if self.estado != CERRADO else None,
+            'rechazos': self.rechazos,
+            'ultimo_error': self.ultimo_error,
+        }
+
+    def exportar(self):
+        """Estado como gauge de Prometheus (0 cerrado, 1 semiabierto, 2 abierto)"""
+        return ["# HELP db_circuit_state Estado del circuit breaker (0 cerrado, 1 semiabierto, 2 abierto)",
+                "# TYPE db_circuit_state gauge",
+                f"db_circuit_state {_VALOR_ESTADO[self.estado]}"]
+
+
+def _marcar_sin_base():
+    if has_request_context():
+        g._sin_base = True
+
+
+# ==================== CACHÉ DE RESPALDO ====================
+
+class CacheRespaldo:
+    """Última respuesta 200 de cada GET de lectura, con un presupuesto de memoria (LRU)"""
+
+    HEADERS = ('X-Total-Count', 'X-Archivo-Corte')
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or CONFIG['cache_bytes']
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def guardar(self, clave, response):
+        cuerpo = response.get_data()
+        if len(cuerpo) > self.max_bytes // 4:
+            return
+        headers = {h: response.headers[h] for h in self.HEADERS if h in response.headers}
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior:
+                self._bytes -= len(anterior[0])
+            self._entradas[clave] = (cuerpo, response.mimetype, headers, time.time())
+            self._bytes += len(cuerpo)
+            while self._bytes > self.max_bytes:
+                _, (viejo, *_resto) = self._entradas.popitem(last=False)
+                self._bytes -= len(viejo)
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada:
+                self._entradas.move_to_end(clave)
+            return entrada
+
+    def resumen(self):
+        with self._lock:
+            return {'entradas': len(self._entradas), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+def configurar_degradacion(app, interruptor, lecturas, sin_base=()):
+    """Hooks de degradación: corte rápido, respuestas de respaldo y GET /salud/db
+
+    lecturas: endpoints GET cuya última respuesta se guarda para servirla sin base.
+    sin_base: endpoints que no usan la base y nunca se cortan.
+    """
+    cache = CacheRespaldo()
+    exentos = set(sin_base) | {'salud_db', 'metrics', 'static'}
+    observadores_consulta.append(interruptor.observar_consulta)
+    registrar_metrica(interruptor)
+
+    def _clave():
+        return request.full_path
+
+    def _degradada():
+        if request.method == 'GET' and request.endpoint in lecturas:
+            entrada = cache.obtener(_clave())
+            if entrada:
+                cuerpo, mimetype, headers, guardado = entrada
+                RESPUESTAS_DEGRADADAS.incrementar('desactualizada')
+                response = Response(cuerpo, mimetype=mimetype)
+                response.headers.extend(headers)
+                response.headers['Age'] = str(int(time.time() - guardado))
+                response.headers['Warning'] = '110 - "Response is Stale"'
+                return response
+        RESPUESTAS_DEGRADADAS.incrementar('rechazada')
+        espera = max(1, math.ceil(interruptor.segundos_para_reintento()))
+        response = jsonify({"error": "Base de datos no disponible, reintentar más tarde",
+                            "reintentar_en": espera})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(espera)
+        return response
+
+    @app.before_request
+    def _cortar_sin_base():
+        if request.endpoint in exentos or request.endpoint is None:
+            return None
+        if interruptor.abierto():
+            return _degradada()
+        return None
+
+    @app.after_request
+    def _respaldar(response):
+        if request.endpoint in exentos:
+            return response
+        if g.get('_sin_base') and response.status_code >= 500:
+            # El handler no consiguió conexión (recién abierto o sonda en curso)
+            return _degradada()
+        if request.method == 'GET' and request.endpoint in lecturas and response.status_code == 200 \
+                and not response.headers.get('Warning'):
+            cache.guardar(_clave(), response)
+        return response
+
+    @app.route('/salud/db', methods=['GET'])
+    def salud_db():
+        """Estado del circuit breaker de la base y de la caché de respaldo"""
+        estado = interruptor.resumen()
+        estado['cache_respaldo'] = cache.resumen()
+        return jsonify(estado), 503 if interruptor.estado == ABIERTO else 200
+
+    return cache
@@ -0,0 +1,218 @@
+"""
+Aislamiento de las lecturas y reintento de escrituras ante bloqueos.
+
+Los GROUP BY del dashboard y los listados toman locks compartidos sobre
+Productos que chocan con los UPDATE de stock de create_movimiento. Con
+@aislamiento() el handler lee en SNAPSHOT (versiones de fila en tempdb): no
+pide locks compartidos ni espera a los escritores. El nivel se puede cambiar
+por handler con DB_ISOLATION_<ENDPOINT>, p. ej.
+DB_ISOLATION_GET_VALUACION="READ COMMITTED"; si la base tiene
+READ_COMMITTED_SNAPSHOT activado, "READ COMMITTED" ya lee versiones por
+sentencia.
+
+@reintentar() vuelve a ejecutar una escritura que terminó en error por
+deadlock (1205), lock timeout (1222) o conflicto de snapshot (3960), con
+espera exponencial y jitter. La transacción elegida como víctima ya se
+deshizo entera, así que repetir el handler es seguro solo si confirma una
+sola vez y al final: un conflicto en una lectura posterior al commit
+repetiría una escritura ya confirmada. Por eso los handlers decorados hacen
+el commit después de releer lo que devuelven.
+
+El nivel se fija con SET al entregar la conexión (get_db_connection decorado
+con @con_aislamiento), solo si difiere del que ya tiene: una conexión nueva
+arranca en READ COMMITTED y la compartida de un lote recuerda el suyo. Si la
+base no tiene ALLOW_SNAPSHOT_ISOLATION (verificar_snapshot lo consulta al
+arrancar), las lecturas en SNAPSHOT pasan a READ COMMITTED.
+
+Configuración (variables de entorno):
+    DB_READ_ISOLATION       nivel de los handlers con @aislamiento() (SNAPSHOT)
+    DB_ISOLATION_<ENDPOINT> nivel de un handler en particular
+    DB_LOCK_TIMEOUT_MS      SET LOCK_TIMEOUT de las escrituras con @reintentar (0 = sin límite)
+    DB_RETRY_ATTEMPTS       reintentos por escritura (3)
+    DB_RETRY_BASE_MS        espera antes del primer reintento (50), se duplica en cada uno
+    DB_RETRY_MAX_MS         espera máxima entre reintentos (1000)
+"""
+import os
+import random
+import re
+import time
+import weakref
+from functools import wraps
+
+from flask import g, has_request_context, make_response, request
+
+from instrumentation import Contador, observadores_consulta, registrar_metrica
+
+NIVELES = ('READ UNCOMMITTED', 'READ COMMITTED', 'REPEATABLE READ', 'SNAPSHOT', 'SERIALIZABLE')
+POR_DEFECTO = 'READ COMMITTED'
+
+
+def _nivel(valor, origen):
+    nivel = ' '.join(valor.upper().replace('_', ' ').split())
+    if nivel not in NIVELES:
+        raise ValueError(f"{origen}: nivel de aislamiento desconocido ({valor}); usar uno de {', '.join(NIVELES)}")
+    return nivel
+
+
+CONFIG = {
+    'lecturas': _nivel(os.environ.get('DB_READ_ISOLATION', 'SNAPSHOT'), 'DB_READ_ISOLATION'),
+    'lock_timeout_ms': int(os.environ.get('DB_LOCK_TIMEOUT_MS', 0)),
+    'reintentos': int(os.environ.get('DB_RETRY_ATTEMPTS', 3)),
+    'espera_base_ms': float(os.environ.get('DB_RETRY_BASE_MS', 50)),
+    'espera_max_ms': float(os.environ.get('DB_RETRY_MAX_MS', 1000)),
+    # Pasa a False si la base rechaza SNAPSHOT (ALLOW_SNAPSHOT_ISOLATION desactivado)
+    'snapshot_disponible': True,
+}
+
+# Código de error de SQL Server -> tipo de conflicto
+_CONFLICTOS = {'1205': 'deadlock', '1222': 'lock_timeout', '3960': 'conflicto_snapshot'}
+_CODIGO = re.compile(r'\((1205|1222|3960|3952)\)')
+
+CONFLICTOS = registrar_metrica(Contador('db_lock_conflicts_total',
+                                        'Sentencias terminadas por deadlock, lock timeout o conflicto de snapshot',
+                                        ('endpoint', 'tipo')))
+REINTENTOS = registrar_metrica(Contador('db_write_retries_total',
+                                        'Reintentos de escrituras tras un conflicto de bloqueo',
+                                        ('endpoint', 'resultado')))
+LECTURAS = registrar_metrica(Contador('db_isolation_requests_total',
+                                      'Peticiones por nivel de aislamiento pedido', ('endpoint', 'nivel')))
+
+# Funciones sin argumentos llamadas antes de cada reintento, para descartar el estado de la
+# petición que quedó ligado a la transacción deshecha
+al_reintentar = []
+
+# Conexión -> (nivel, lock timeout) fijados con SET; solo se repite en la compartida de un lote
+_sesiones = weakref.WeakKeyDictionary()
+
+
+def tipo_conflicto(error):
+    """'deadlock', 'lock_timeout', 'conflicto_snapshot', 'sin_snapshot' o None para otros errores"""
+    args = getattr(error, 'args', None) or ()
+    codigo = _CODIGO.search(' '.join(str(a) for a in args))
+    if codigo:
+        return _CONFLICTOS.get(codigo.group(1), 'sin_snapshot')
+    if args and args[0] == '40001':
+        return 'deadlock'
+    return None
+
+
+def _observar(sql, params, duracion, error):
+    if error is None:
+        return
+    tipo = tipo_conflicto(error)
+    if tipo is None:
+        return
+    if tipo == 'sin_snapshot':
+        if CONFIG['snapshot_disponible']:
+            CONFIG['snapshot_disponible'] = False
+            print("SNAPSHOT no habilitado en la base (ALLOW_SNAPSHOT_ISOLATION); las lecturas pasan a READ COMMITTED")
+        return
+    if has_request_context():
+        g._conflicto_bd = tipo
+    CONFLICTOS.incrementar(request.endpoint if has_request_context() else '', tipo)
+
+
+observadores_consulta.append(_observar)
+
+
+def verificar_snapshot(conn):
+    """Consultar una vez si la base admite SNAPSHOT, para no descubrirlo con el error 3952 de una petición"""
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT snapshot_isolation_state FROM sys.databases WHERE name = DB_NAME()")
+        row = cursor.fetchone()
+    except Exception as e:
+        print(f"[WARN] No se pudo consultar ALLOW_SNAPSHOT_ISOLATION: {e}")
+        return CONFIG['snapshot_disponible']
+    # 1 = ON; 0 = OFF y 2/3 = cambiando de estado, que todavía rechazan SNAPSHOT
+    CONFIG['snapshot_disponible'] = row is not None and row[0] == 1
+    if not CONFIG['snapshot_disponible']:
+        print("SNAPSHOT no habilitado en la base (ALLOW_SNAPSHOT_ISOLATION); las lecturas pasan a READ COMMITTED")
+    return CONFIG['snapshot_disponible']
+
+
+# ==================== CONEXIONES ====================
+
+def _sesion_pedida():
+    if not has_request_context():
+        return None
+    nivel = g.get('_aislamiento') or POR_DEFECTO
+    if nivel == 'SNAPSHOT' and not CONFIG['snapshot_disponible']:
+        nivel = POR_DEFECTO
+    return nivel, g.get('_lock_timeout_ms', 0)
+
+
+def con_aislamiento(obtener_conexion):
+    """Decorador para get_db_connection: fijar el nivel de aislamiento y lock timeout del handler"""
+    @wraps(obtener_conexion)
+    def wrapper(*args, **kwargs):
+        conn = obtener_conexion(*args, **kwargs)
+        pedida = _sesion_pedida()
+        if conn is None or pedida is None:
+            return conn
+        actual = _sesiones.get(conn, (POR_DEFECTO, 0))
+        if pedida != actual:
+            sentencias = []
+            if pedida[0] != actual[0]:
+                sentencias.append(f"SET TRANSACTION ISOLATION LEVEL {pedida[0]}")
+            if pedida[1] != actual[1]:
+                sentencias.append(f"SET LOCK_TIMEOUT {pedida[1] or -1}")
+            conn.cursor().execute('; '.join(sentencias))
+            _sesiones[conn] = pedida
+        return conn
+    return wrapper
+
+
+# ==================== DECORADORES DE HANDLERS ====================
+
+def aislamiento(nivel=None):
+    """Decorador: el handler lee con el nivel indicado (por defecto DB_READ_ISOLATION)"""
+    def decorador(f):
+        variable = f'DB_ISOLATION_{f.__name__.upper()}'
+        elegido = _nivel(os.environ[variable], variable) if os.environ.get(variable) else (
+            _nivel(nivel, f.__name__) if nivel else None)
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            g._aislamiento = elegido or CONFIG['lecturas']
+            LECTURAS.incrementar(request.endpoint, g._aislamiento)
+            return f(*args, **kwargs)
+        return wrapper
+    return decorador
+
+
+def _espera(intento):
+    """Segundos antes del reintento número intento (0 = el primero), con jitter completo"""
+    tope = min(CONFIG['espera_max_ms'], CONFIG['espera_base_ms'] * 2 ** intento)
+    return random.uniform(0, tope) / 1000
+
+
+def reintentar(intentos=None):
+    """Decorador: repetir la escritura si terminó por un conflicto de bloqueo"""
+    def decorador(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            maximo = CONFIG['reintentos'] if intentos is None else intentos
+            g._lock_timeout_ms = CONFIG['lock_timeout_ms']
+            for intento in range(maximo + 1):
+                g._conflicto_bd = None
+                try:
+                    respuesta = make_response(f(*args, **kwargs))
+                except Exception:
+                    # Un error que el handler no atrapó: se reintenta igual si fue un conflicto
+                    if g.get('_conflicto_bd') is None or intento == maximo:
+                        raise
+                    respuesta = None
+                if g.get('_conflicto_bd') is None or (respuesta is not None and respuesta.status_code < 500):
+                    if intento:
+                        REINTENTOS.incrementar(request.endpoint, 'recuperado')
+                    return respuesta
+                if intento == maximo:
+                    REINTENTOS.incrementar(request.endpoint, 'agotado')
+                    return respuesta
+                REINTENTOS.incrementar(request.endpoint, 'reintento')
+                for descartar in al_reintentar:
+                    descartar()
+                time.sleep(_espera(intento))
+        return wrapper
+    return decorador
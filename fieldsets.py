@@ -0,0 +1,124 @@
+"""
+Selección de campos (sparse fieldsets) para los listados: ?fields=id,nombre.
+
+Cada recurso declara sus campos con la expresión SQL, el JOIN que necesita (si
+necesita alguno) y la conversión a JSON. seleccionar() arma la lista del
+SELECT y los JOIN solo con lo pedido, así los selectores livianos no leen
+columnas NVARCHAR(MAX) como descripcion ni hacen joins que no van a usar.
+Sin fields se devuelven todos los campos, como siempre.
+"""
+
+
+def _igual(valor):
+    return valor
+
+
+def _texto(valor):
+    return valor or ''
+
+
+def _decimal(valor):
+    return float(valor)
+
+
+def _decimal_opcional(valor):
+    return float(valor) if valor is not None else None
+
+
+def _booleano(valor):
+    return bool(valor)
+
+
+def _fecha(valor):
+    return valor.isoformat()
+
+
+# nombre -> (expresión SQL, join requerido, conversión)
+PRODUCTOS = {
+    'campos': {
+        'id': ('p.id', None, _igual),
+        'nombre': ('p.nombre', None, _igual),
+        'descripcion': ('p.descripcion', None, _texto),
+        'codigo_sku': ('p.codigo_sku', None, _texto),
+        'precio': ('p.precio', None, _decimal),
+        'cantidad_stock': ('p.cantidad_stock', None, _igual),
+        'stock_minimo': ('p.stock_minimo', None, _igual),
+        'activo': ('p.activo', None, _booleano),
+        'fecha_creacion': ('p.fecha_creacion', None, _fecha),
+        'categoria_nombre': ('c.nombre', 'categoria', _texto),
+        'proveedor_nombre': ('pr.nombre', 'proveedor', _texto),
+        'categoria_id': ('p.categoria_id', None, _igual),
+        'proveedor_id': ('p.proveedor_id', None, _igual),
+    },
+    'joins': {
+        'categoria': 'LEFT JOIN Categorias c ON p.categoria_id = c.id',
+        'proveedor': 'LEFT JOIN Proveedores pr ON p.proveedor_id = pr.id',
+    },
+}
+
+MOVIMIENTOS = {
+    'campos': {
+        'id': ('m.id', None, _igual),
+        'producto_id': ('m.producto_id', None, _igual),
+        'producto_nombre': ('p.nombre', 'producto', _texto),
+        'tipo_movimiento': ('m.tipo_movimiento', None, _igual),
+        'cantidad': ('m.cantidad', None, _igual),
+        'motivo': ('m.motivo', None, _texto),
+        'numero_referencia': ('m.numero_referencia', None, _texto),
+        'fecha_movimiento': ('m.fecha_movimiento', None, _fecha),
+        'costo_unitario': ('m.costo_unitario', None, _decimal_opcional),
+    },
+    'joins': {
+        'producto': 'LEFT JOIN Productos p ON m.producto_id = p.id',
+    },
+}
+
+CATEGORIAS = {
+    'campos': {
+        'id': ('id', None, _igual),
+        'nombre': ('nombre', None, _igual),
+        'descripcion': ('descripcion', None, _texto),
+        'fecha_creacion': ('fecha_creacion', None, _fecha),
+    },
+    'joins': {},
+}
+
+PROVEEDORES = {
+    'campos': {
+        'id': ('id', None, _igual),
+        'nombre': ('nombre', None, _igual),
+        'contacto': ('contacto', None, _texto),
+        'email': ('email', None, _texto),
+        'telefono': ('telefono', None, _texto),
+        'direccion': ('direccion', None, _texto),
+        'fecha_creacion': ('fecha_creacion', None, _fecha),
+    },
+    'joins': {},
+}
+
+
+def nombres_pedidos(recurso, texto):
+    """Campos pedidos en ?fields= (todos si no se pidió ninguno); ValueError si hay desconocidos"""
+    campos = recurso['campos']
+    nombres = list(dict.fromkeys(n.strip() for n in (texto or '').split(',') if n.strip()))
+    if not nombres:
+        return list(campos)
+    desconocidos = [n for n in nombres if n not in campos]
+    if desconocidos:
+        raise ValueError(f"Campos desconocidos: {', '.join(desconocidos)}. "
+                         f"Disponibles: {', '.join(campos)}")
+    return nombres
+
+
+def seleccionar(recurso, nombres):
+    """Lista de columnas y JOINs necesarios para los campos pedidos"""
+    campos = recurso['campos']
+    columnas = ', '.join(campos[n][0] for n in nombres)
+    joins = dict.fromkeys(campos[n][1] for n in nombres if campos[n][1])
+    return columnas, '\n'.join(recurso['joins'][j] for j in joins)
+
+
+def a_dict(recurso, nombres, row):
+    """Fila del SELECT armado con seleccionar() convertida a dict JSON"""
+    campos = recurso['campos']
+    return {nombre: campos[nombre][2](row[i]) for i, nombre in enumerate(nombres)}
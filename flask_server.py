@@ -2,10 +2,14 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import uuid
 from datetime import datetime
+from instrumentation import instrumentar_app
+from profiling import configurar_perfilado
 
 # Crear la aplicación Flask
 app = Flask(__name__)
 CORS(app)  # Permitir CORS para el frontend
+instrumentar_app(app, 'tareas')  # Métricas en /metrics y header Server-Timing
+configurar_perfilado(app)  # Perfilado bajo demanda con X-Admin-Token
 
 # Base de datos en memoria (para simplicidad)
 tasks_db = []
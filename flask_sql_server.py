@@ -3,10 +3,16 @@ from flask_cors import CORS
 import pyodbc
 import uuid
 from datetime import datetime
+from instrumentation import instrumentar_app, conexion_instrumentada
+from query_log import configurar_registro_consultas
+from profiling import configurar_perfilado
 
 # Crear la aplicación Flask
 app = Flask(__name__)
 CORS(app)  # Permitir CORS para el frontend
+instrumentar_app(app, 'tareas_sql')  # Métricas en /metrics y header Server-Timing
+configurar_registro_consultas(app)  # Log de consultas lentas y redundantes
+configurar_perfilado(app)  # Perfilado bajo demanda con X-Admin-Token
 
 # Configuración de la base de datos SQL Server
 # Ajusta estos valores según tu configuración
@@ -17,6 +23,7 @@ DB_CONFIG = {
     'driver': '{ODBC Driver 17 for SQL Server}'  # o la versión que tengas
 }
 
+@conexion_instrumentada
 def get_db_connection():
     """Crear conexión a la base de datos"""
     try:
@@ -0,0 +1,181 @@
+"""
+Pronóstico de demanda y puntos de reorden para todos los productos.
+
+Arma con NumPy una matriz producto × día con las SALIDAS del resumen diario
+(MovimientosDiarios) y calcula para cada bloque de productos, sin recorrerlos
+uno por uno:
+
+- demanda diaria pronosticada: promedio móvil de los últimos `ventana` días
+  (sma) o suavizado exponencial simple (ses), este último como un producto
+  matriz × vector de pesos alfa·(1-alfa)^k;
+- desviación de la demanda diaria en los últimos `ventana_error` días;
+- stock de seguridad = z(nivel de servicio) · desviación · √plazo;
+- punto de reorden = demanda · plazo + stock de seguridad, y nivel objetivo =
+  punto de reorden + demanda · días de cobertura.
+
+Los resultados reemplazan la tabla PuntosReorden en una transacción, y
+GET /reportes/reabastecimiento los cruza con el stock actual.
+
+Ejecutar el cálculo:
+    python forecast.py
+    python forecast.py --metodo ses --alfa 0.3 --plazo 10 --nivel-servicio 0.98
+"""
+import argparse
+import math
+import os
+import time
+from datetime import date, timedelta
+from statistics import NormalDist
+
+import numpy as np
+
+SQL_CREAR_TABLA = """
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='PuntosReorden' AND xtype='U')
+    CREATE TABLE PuntosReorden (
+        producto_id INT PRIMARY KEY,
+        metodo NVARCHAR(10) NOT NULL,
+        demanda_diaria DECIMAL(12, 4) NOT NULL,
+        desviacion_diaria DECIMAL(12, 4) NOT NULL,
+        stock_seguridad INT NOT NULL,
+        punto_reorden INT NOT NULL,
+        nivel_objetivo INT NOT NULL,
+        dias_historia INT NOT NULL,
+        fecha_calculo DATETIME DEFAULT GETDATE()
+    )
+"""
+
+PARAMETROS = {
+    'metodo': os.environ.get('FORECAST_METHOD', 'ses'),
+    'dias': int(os.environ.get('FORECAST_HISTORY_DAYS', 730)),
+    'ventana': 28,
+    'ventana_error': 90,
+    'alfa': 0.2,
+    'nivel_servicio': 0.95,
+    'plazo': int(os.environ.get('FORECAST_LEAD_DAYS', 7)),
+    'cobertura': int(os.environ.get('FORECAST_COVERAGE_DAYS', 14)),
+    'productos_por_bloque': 20000,
+}
+
+METODOS = ('sma', 'ses')
+
+
+def crear_tabla(cursor):
+    """Crear la tabla de puntos de reorden si no existe"""
+    cursor.execute(SQL_CREAR_TABLA)
+
+
+# ==================== CÁLCULO VECTORIZADO ====================
+
+def pronosticar(demanda, metodo='ses', ventana=28, alfa=0.2):
+    """Demanda diaria pronosticada por fila de la matriz (productos × días, del más viejo al más nuevo)"""
+    dias = demanda.shape[1]
+    if dias == 0:
+        return np.zeros(demanda.shape[0])
+    if metodo == 'sma':
+        return demanda[:, -min(ventana, dias):].mean(axis=1)
+    # Suavizado exponencial con nivel inicial = primera observación, desarrollado como
+    # Σ alfa·(1-alfa)^(T-1-k)·d_k; a d_0 le corresponde en total (1-alfa)^(T-1)
+    exponentes = np.arange(dias - 1, -1, -1, dtype=np.float64)
+    pesos = alfa * (1 - alfa) ** exponentes
+    pesos[0] += (1 - alfa) ** dias
+    return demanda @ pesos.astype(demanda.dtype)
+
+
+def puntos_reorden(demanda, metodo, ventana, ventana_error, alfa, nivel_servicio, plazo, cobertura):
+    """Pronóstico, desviación, stock de seguridad, punto de reorden y nivel objetivo por fila"""
+    pronostico = pronosticar(demanda, metodo, ventana, alfa)
+    reciente = demanda[:, -min(ventana_error, demanda.shape[1]):]
+    desviacion = reciente.std(axis=1) if reciente.shape[1] else np.zeros(demanda.shape[0])
+    z = NormalDist().inv_cdf(nivel_servicio)
+    seguridad = np.ceil(z * desviacion * math.sqrt(plazo))
+    reorden = np.ceil(pronostico * plazo + seguridad)
+    objetivo = np.ceil(reorden + pronostico * cobertura)
+    return pronostico, desviacion, seguridad, reorden, objetivo
+
+
+# ==================== PROCESO POR LOTES ====================
+
+def calcular(conn, **parametros):
+    """Recalcular PuntosReorden para todos los productos activos; devuelve un resumen"""
+    p = dict(PARAMETROS, **{k: v for k, v in parametros.items() if v is not None})
+    if p['metodo'] not in METODOS:
+        raise ValueError(f"metodo debe ser uno de {', '.join(METODOS)}")
+    inicio = time.perf_counter()
+    hasta = date.today()  # Se excluye el día en curso, todavía incompleto
+    desde = hasta - timedelta(days=p['dias'])
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM Productos WHERE activo = 1 ORDER BY id")
+    ids = np.asarray([row[0] for row in cursor.fetchall()], dtype=np.int64)
+
+    filas_resultado = []
+    for i in range(0, len(ids), p['productos_por_bloque']):
+        bloque = ids[i:i + p['productos_por_bloque']]
+        demanda = np.zeros((len(bloque), p['dias']), dtype=np.float32)
+        cursor.execute("""
+            SELECT producto_id, DATEDIFF(day, ?, fecha) as dia, cantidad_total
+            FROM MovimientosDiarios
+            WHERE tipo_movimiento = 'SALIDA' AND fecha >= ? AND fecha < ?
+              AND producto_id BETWEEN ? AND ?
+        """, desde, desde, hasta, int(bloque[0]), int(bloque[-1]))
+        while True:
+            filas = cursor.fetchmany(100000)
+            if not filas:
+                break
+            productos, dias, cantidades = (np.asarray(c) for c in zip(*filas))
+            posicion = np.searchsorted(bloque, productos.astype(np.int64))
+            validas = (posicion < len(bloque)) & (dias >= 0) & (dias < p['dias'])
+            validas[validas] &= bloque[posicion[validas]] == productos[validas]
+            np.add.at(demanda, (posicion[validas], dias[validas].astype(np.int64)),
+                      cantidades[validas].astype(np.float32))
+
+        pronostico, desviacion, seguridad, reorden, objetivo = puntos_reorden(
+            demanda, p['metodo'], p['ventana'], p['ventana_error'], p['alfa'],
+            p['nivel_servicio'], p['plazo'], p['cobertura'])
+        filas_resultado.extend(zip(
+            bloque.tolist(), [p['metodo']] * len(bloque),
+            np.round(pronostico.astype(np.float64), 4).tolist(),
+            np.round(desviacion.astype(np.float64), 4).tolist(),
+            seguridad.astype(int).tolist(), reorden.astype(int).tolist(), objetivo.astype(int).tolist(),
+            [p['dias']] * len(bloque)))
+
+    # Reemplazo completo en una transacción: los lectores ven el cálculo anterior o el nuevo
+    cursor.execute("DELETE FROM PuntosReorden")
+    for i in range(0, len(filas_resultado), 1000):
+        cursor.executemany("""
+            INSERT INTO PuntosReorden (producto_id, metodo, demanda_diaria, desviacion_diaria,
+                                       stock_seguridad, punto_reorden, nivel_objetivo, dias_historia)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, filas_resultado[i:i + 1000])
+    conn.commit()
+    return {'productos': len(ids), 'metodo': p['metodo'], 'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(), 'duracion_s': round(time.perf_counter() - inicio, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pronóstico de demanda y puntos de reorden')
+    parser.add_argument('--metodo', choices=METODOS,
+                        help=f"Método de pronóstico (por defecto {PARAMETROS['metodo']})")
+    parser.add_argument('--dias', type=int, help='Días de historia a considerar')
+    parser.add_argument('--ventana', type=int, help='Días del promedio móvil')
+    parser.add_argument('--alfa', type=float, help='Constante de suavizado exponencial')
+    parser.add_argument('--nivel-servicio', dest='nivel_servicio', type=float, help='Nivel de servicio (0-1)')
+    parser.add_argument('--plazo', type=int, help='Plazo de reposición en días')
+    parser.add_argument('--cobertura', type=int, help='Días de demanda a cubrir por encima del punto de reorden')
+    args = parser.parse_args()
+
+    from inventory_api import get_db_connection
+    conn = get_db_connection()
+    if not conn:
+        print("No se pudo conectar a la base de datos")
+        return
+    try:
+        resumen = calcular(conn, **vars(args))
+        print(f"[OK] Puntos de reorden calculados para {resumen['productos']} productos "
+              f"({resumen['metodo']}, {resumen['desde']} a {resumen['hasta']}) en {resumen['duracion_s']} s")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
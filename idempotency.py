@@ -0,0 +1,211 @@
+"""
+Claves de idempotencia para los POST que crean recursos.
+
+El cliente manda el header Idempotency-Key (o, en POST /movimientos, el
+numero_referencia del cuerpo). La primera petición con esa clave se ejecuta y
+su respuesta se guarda en la tabla IdempotencyKeys dentro de la misma
+transacción que la escritura; los reintentos reciben la respuesta original
+(header Idempotent-Replayed: true) sin volver a tocar la base. Un índice en
+memoria acotado y con vencimiento evita la consulta a la tabla en los
+reintentos inmediatos.
+
+- Un reintento que llega mientras la original todavía se procesa recibe 409
+  con Retry-After.
+- La misma Idempotency-Key con otro cuerpo recibe 422. Con numero_referencia
+  la clave incluye la huella del cuerpo, así dos movimientos distintos con la
+  misma referencia (una factura con varios productos) no se confunden.
+
+Uso:
+    idempotencia = Idempotencia(get_db_connection)
+
+    @app.route('/movimientos', methods=['POST'])
+    @idempotencia.proteger(respaldo='numero_referencia')
+    def create_movimiento():
+        ...
+        idempotencia.registrar(cursor, movimiento, 201)
+        conn.commit()
+
+Configuración (variables de entorno):
+    IDEMPOTENCY_TTL_HOURS    horas que se recuerda una clave (24)
+    IDEMPOTENCY_CACHE_SIZE   claves en memoria (10000)
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import Response, g, jsonify, request
+
+CONFIG = {
+    'ttl_horas': float(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24)),
+    'capacidad': int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000)),
+}
+
+SQL_CREAR_TABLA = """
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='IdempotencyKeys' AND xtype='U')
+    CREATE TABLE IdempotencyKeys (
+        clave NVARCHAR(300) PRIMARY KEY,
+        huella CHAR(64) NOT NULL,
+        estado_http INT NOT NULL,
+        respuesta NVARCHAR(MAX) NOT NULL,
+        fecha_creacion DATETIME DEFAULT GETDATE()
+    )
+"""
+
+
+class Idempotencia:
+    """Índice de claves (memoria LRU con TTL + tabla persistente) y decorador de endpoints"""
+
+    def __init__(self, obtener_conexion, capacidad=None, ttl_horas=None):
+        self.obtener_conexion = obtener_conexion
+        self.capacidad = capacidad or CONFIG['capacidad']
+        self.ttl = (ttl_horas if ttl_horas is not None else CONFIG['ttl_horas']) * 3600
+        self._cache = OrderedDict()
+        self._en_curso = set()
+        self._lock = threading.Lock()
+
+    def crear_tabla(self, cursor):
+        """Crear la tabla si no existe y borrar las claves vencidas"""
+        cursor.execute(SQL_CREAR_TABLA)
+        self.purgar_vencidas(cursor)
+
+    def descartar_registro(self):
+        """La transacción donde se registró la respuesta se deshizo (se va a reintentar)"""
+        g.pop('_idempotencia_registrada', None)
+
+    def purgar_vencidas(self, cursor):
+        """Borrar de la tabla las claves que ya vencieron"""
+        cursor.execute("DELETE FROM IdempotencyKeys WHERE fecha_creacion < ?",
+                       datetime.now() - timedelta(seconds=self.ttl))
+
+    # ---------- índice en memoria ----------
+
+    def _recordar(self, clave, huella, estado, respuesta):
+        with self._lock:
+            self._cache[clave] = (huella, estado, respuesta, time.monotonic() + self.ttl)
+            self._cache.move_to_end(clave)
+            while len(self._cache) > self.capacidad:
+                self._cache.popitem(last=False)
+
+    def _buscar_en_memoria(self, clave):
+        with self._lock:
+            entrada = self._cache.get(clave)
+            if entrada is None:
+                return None
+            if entrada[3] < time.monotonic():
+                del self._cache[clave]
+                return None
+            self._cache.move_to_end(clave)
+            return entrada[:3]
+
+    def _buscar_en_tabla(self, clave):
+        conn = self.obtener_conexion()
+        if not conn:
+            return None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT huella, estado_http, respuesta FROM IdempotencyKeys
+                WHERE clave = ? AND fecha_creacion >= ?
+            """, clave, datetime.now() - timedelta(seconds=self.ttl))
+            row = cursor.fetchone()
+            conn.close()
+        except Exception as e:
+            conn.close()
+            print(f"Error consultando claves de idempotencia: {e}")
+            return None
+        if not row:
+            return None
+        self._recordar(clave, row[0], row[1], row[2])
+        return row[0], row[1], row[2]
+
+    # ---------- integración con los endpoints ----------
+
+    def registrar(self, cursor, cuerpo, estado):
+        """Guardar la respuesta de la petición actual; llamar antes del commit de la escritura
+
+        Con cursor=None se guarda en una transacción propia (escrituras que no pasan
+        por la base, como la ingesta diferida).
+        """
+        actual = g.get('_idempotencia')
+        if not actual:
+            return
+        clave, huella = actual
+        respuesta = json.dumps(cuerpo, ensure_ascii=False, default=str)
+        if cursor is None:
+            conn = self.obtener_conexion()
+            if not conn:
+                return
+            try:
+                self.registrar(conn.cursor(), cuerpo, estado)
+                conn.commit()
+            finally:
+                conn.close()
+            return
+        cursor.execute("""
+            INSERT INTO IdempotencyKeys (clave, huella, estado_http, respuesta)
+            VALUES (?, ?, ?, ?)
+        """, clave, huella, estado, respuesta)
+        g._idempotencia_registrada = (clave, huella, estado, respuesta)
+
+    def _reproducir(self, estado, respuesta):
+        response = Response(respuesta, status=estado, mimetype='application/json')
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    def proteger(self, respaldo=None):
+        """Decorador: deduplicar por Idempotency-Key (o por el campo de respaldo del cuerpo)"""
+        def decorador(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                cuerpo = request.get_data() or b''
+                huella = hashlib.sha256(cuerpo).hexdigest()
+                clave = request.headers.get('Idempotency-Key', '').strip()
+                if clave:
+                    clave = f"{request.endpoint}:{clave}"
+                elif respaldo:
+                    data = request.get_json(silent=True) or {}
+                    referencia = str(data.get(respaldo) or '').strip()
+                    if not referencia:
+                        return f(*args, **kwargs)
+                    clave = f"{request.endpoint}:{respaldo}:{referencia}:{huella[:16]}"
+                else:
+                    return f(*args, **kwargs)
+                if len(clave) > 300:
+                    return jsonify({"error": "Idempotency-Key demasiado larga"}), 400
+
+                guardada = self._buscar_en_memoria(clave)
+                if guardada is None:
+                    with self._lock:
+                        if clave in self._en_curso:
+                            response = jsonify({"error": "Hay una petición en curso con la misma clave"})
+                            response.headers['Retry-After'] = '1'
+                            return response, 409
+                        self._en_curso.add(clave)
+                    try:
+                        guardada = self._buscar_en_tabla(clave)
+                        if guardada is None:
+                            g._idempotencia = (clave, huella)
+                            resultado = f(*args, **kwargs)
+                            registrada = g.pop('_idempotencia_registrada', None)
+                            if registrada:
+                                self._recordar(*registrada)
+                                return resultado
+                            # Otro proceso pudo haber registrado la clave primero (choque de PK)
+                            guardada = self._buscar_en_tabla(clave)
+                            if guardada is None:
+                                return resultado
+                    finally:
+                        g.pop('_idempotencia', None)
+                        with self._lock:
+                            self._en_curso.discard(clave)
+
+                if guardada[0] != huella:
+                    return jsonify({"error": "Idempotency-Key ya usada con otro cuerpo"}), 422
+                return self._reproducir(guardada[1], guardada[2])
+            return wrapper
+        return decorador
@@ -0,0 +1,337 @@
+"""
+Ingesta diferida (write-behind) de movimientos de stock.
+
+Pensada para los lectores de mano del depósito, que envían un POST
+/movimientos por unidad escaneada. Con la ingesta activa el movimiento se
+confirma apenas queda escrito (con fsync) en un diario local, y un hilo de
+fondo vacía la cola en lotes: inserta los movimientos y aplica un único
+UPDATE de stock neto por producto en cada transacción.
+
+- El vaciado se dispara cada INGEST_FLUSH_MS o al juntar INGEST_FLUSH_SIZE
+  movimientos, lo que ocurra primero.
+- Con más de INGEST_MAX_PENDING movimientos sin aplicar la cola rechaza con
+  ColaLlena (la API responde 503 con Retry-After).
+- La última secuencia aplicada se guarda en la tabla IngestaCheckpoint dentro
+  de la misma transacción del lote; al arrancar se reproducen las entradas del
+  diario posteriores a ese punto, así un corte no pierde ni duplica movimientos.
+
+Configuración (variables de entorno):
+    INGEST_ENABLED       1 para activar la ingesta diferida (0)
+    INGEST_JOURNAL_PATH  diario local (ingesta/movimientos.jsonl)
+    INGEST_FLUSH_MS      intervalo máximo entre vaciados (500)
+    INGEST_FLUSH_SIZE    movimientos que disparan un vaciado (500)
+    INGEST_MAX_PENDING   límite de movimientos pendientes (20000)
+"""
+import json
+import os
+import threading
+import time
+
+import stock
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo del diario entre procesos
+    fcntl = None
+
+CONFIG = {
+    'activa': os.environ.get('INGEST_ENABLED', '0') == '1',
+    'ruta': os.environ.get('INGEST_JOURNAL_PATH', os.path.join('ingesta', 'movimientos.jsonl')),
+    'intervalo_ms': int(os.environ.get('INGEST_FLUSH_MS', 500)),
+    'tamano_lote': int(os.environ.get('INGEST_FLUSH_SIZE', 500)),
+    'max_pendientes': int(os.environ.get('INGEST_MAX_PENDING', 20000)),
+    'reintentos_lote': 3,
+}
+
+SQL_CREAR_TABLA = """
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='IngestaCheckpoint' AND xtype='U')
+    CREATE TABLE IngestaCheckpoint (
+        diario NVARCHAR(200) PRIMARY KEY,
+        secuencia BIGINT NOT NULL
+    )
+"""
+
+
+def referencia_en_diario(numero_referencia, ruta=None):
+    """Si el diario tiene un movimiento con esa referencia (pendiente, o aplicado y sin truncar)
+
+    Solo lee: sirve aunque el diario lo tenga abierto otro proceso.
+    """
+    ruta = ruta or CONFIG['ruta']
+    if not os.path.exists(ruta):
+        return False
+    with open(ruta, 'rb') as f:
+        for linea in f:
+            try:
+                entrada = json.loads(linea)
+            except ValueError:
+                break  # Última línea cortada por una caída: nunca se confirmó al cliente
+            if isinstance(entrada, dict) and entrada.get('numero_referencia') == numero_referencia:
+                return True
+    return False
+
+
+class ColaLlena(Exception):
+    """La cola superó el límite de movimientos pendientes"""
+
+    def __init__(self, reintentar_en):
+        super().__init__('Cola de ingesta llena')
+        self.reintentar_en = reintentar_en
+
+
+class DiarioOcupado(Exception):
+    """Otro proceso ya tiene abierto el diario"""
+
+
+class ColaIngesta:
+    """Diario durable + cola en memoria + hilo de vaciado por lotes"""
+
+    def __init__(self, obtener_conexion, ruta=None, intervalo_ms=None, tamano_lote=None, max_pendientes=None):
+        self.obtener_conexion = obtener_conexion
+        self.ruta = ruta or CONFIG['ruta']
+        self.intervalo = (intervalo_ms if intervalo_ms is not None else CONFIG['intervalo_ms']) / 1000
+        self.tamano_lote = tamano_lote or CONFIG['tamano_lote']
+        self.max_pendientes = max_pendientes or CONFIG['max_pendientes']
+        self._pendientes = []
+        self._deltas = {}
+        self._secuencia = 0
+        self._lock = threading.Lock()
+        self._hay_trabajo = threading.Condition(self._lock)
+        self._detener = False
+        self._hilo = None
+        self._diario = None
+        self._ultimo_lote_ms = 0.0
+
+    # ---------- diario ----------
+
+    def _abrir_diario(self):
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._diario = open(self.ruta, 'ab')
+        if fcntl:
+            try:
+                fcntl.flock(self._diario.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._diario.close()
+                self._diario = None
+                raise DiarioOcupado(self.ruta)
+
+    def _leer_checkpoint(self, cursor):
+        cursor.execute("SELECT secuencia FROM IngestaCheckpoint WHERE diario = ?", self.ruta)
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def reproducir(self):
+        """Cargar en la cola las entradas del diario que todavía no llegaron a la base"""
+        conn = self.obtener_conexion()
+        if not conn:
+            raise RuntimeError('Sin conexión para leer el checkpoint de ingesta')
+        try:
+            aplicada = self._leer_checkpoint(conn.cursor())
+        finally:
+            conn.close()
+
+        recuperadas = 0
+        self._secuencia = aplicada
+        if os.path.exists(self.ruta):
+            with open(self.ruta, 'rb') as f:
+                for linea in f:
+                    try:
+                        entrada = json.loads(linea)
+                    except ValueError:
+                        break  # Última línea cortada por una caída: nunca se confirmó al cliente
+                    secuencia = entrada.get('seq') if isinstance(entrada, dict) else None
+                    if isinstance(secuencia, bool) or not isinstance(secuencia, int):
+                        self._rechazar(entrada, ValueError('entrada sin secuencia'))
+                        continue
+                    self._secuencia = max(self._secuencia, secuencia)
+                    if secuencia <= aplicada:
+                        continue
+                    # Una entrada mal formada (de una versión sin validación) no frena a las demás
+                    try:
+                        delta = self._delta(entrada)
+                    except (KeyError, ValueError) as e:
+                        self._rechazar(entrada, e)
+                        continue
+                    self._agregar(entrada, delta)
+                    recuperadas += 1
+        return recuperadas
+
+    @staticmethod
+    def _delta(entrada):
+        stock.validar_movimiento(entrada['producto_id'], entrada['tipo_movimiento'], entrada['cantidad'])
+        return stock.delta_stock(entrada['tipo_movimiento'], entrada['cantidad'])
+
+    def _agregar(self, entrada, delta):
+        self._pendientes.append(entrada)
+        producto_id = entrada['producto_id']
+        self._deltas[producto_id] = self._deltas.get(producto_id, 0) + delta
+
+    # ---------- API ----------
+
+    def iniciar(self):
+        self._abrir_diario()
+        try:
+            recuperadas = self.reproducir()
+        except Exception:
+            self._diario.close()
+            self._diario = None
+            raise
+        if recuperadas:
+            print(f"[OK] Ingesta: {recuperadas} movimientos recuperados del diario")
+        self._hilo = threading.Thread(target=self._bucle, name='ingesta-movimientos', daemon=True)
+        self._hilo.start()
+        return self
+
+    def encolar(self, producto_id, tipo_movimiento, cantidad, motivo='', numero_referencia='',
+                costo_unitario=None):
+        """Escribir el movimiento en el diario y dejarlo pendiente; devuelve su secuencia
+
+        Valida antes de escribir (ValueError): lo que entra al diario ya no se puede rechazar al cliente.
+        """
+        stock.validar_movimiento(producto_id, tipo_movimiento, cantidad)
+        delta = stock.delta_stock(tipo_movimiento, cantidad)
+        with self._lock:
+            if len(self._pendientes) >= self.max_pendientes:
+                # Estimar cuándo habrá lugar según lo que tarda un lote
+                lotes = len(self._pendientes) / self.tamano_lote
+                raise ColaLlena(max(1, int(lotes * max(self._ultimo_lote_ms / 1000, self.intervalo)) + 1))
+            self._secuencia += 1
+            entrada = {'seq': self._secuencia, 'producto_id': producto_id, 'tipo_movimiento': tipo_movimiento,
+                       'cantidad': cantidad, 'motivo': motivo, 'numero_referencia': numero_referencia,
+                       'costo_unitario': costo_unitario, 'recibido': time.time()}
+            self._diario.write((json.dumps(entrada, ensure_ascii=False) + '\n').encode('utf-8'))
+            self._diario.flush()
+            os.fsync(self._diario.fileno())
+            self._agregar(entrada, delta)
+            if len(self._pendientes) >= self.tamano_lote:
+                self._hay_trabajo.notify()
+            return entrada['seq']
+
+    def pendiente(self, producto_id):
+        """Delta de stock todavía no aplicado en la base para un producto"""
+        with self._lock:
+            return self._deltas.get(producto_id, 0)
+
+    def estado(self):
+        with self._lock:
+            return {'pendientes': len(self._pendientes), 'secuencia': self._secuencia,
+                    'productos_con_pendientes': sum(1 for d in self._deltas.values() if d),
+                    'ultimo_lote_ms': round(self._ultimo_lote_ms, 3)}
+
+    def detener(self, vaciar=True):
+        with self._lock:
+            self._detener = True
+            self._hay_trabajo.notify()
+        if self._hilo:
+            self._hilo.join()
+        if vaciar:
+            while self._pendientes and self._vaciar():
+                pass
+        if self._diario:
+            self._diario.close()
+            self._diario = None
+
+    # ---------- vaciado ----------
+
+    def _bucle(self):
+        fallos = 0
+        while True:
+            with self._lock:
+                if not self._detener and len(self._pendientes) < self.tamano_lote:
+                    # Con fallos seguidos se espera más para no martillar una base caída
+                    self._hay_trabajo.wait(self.intervalo * min(2 ** fallos, 60))
+                if self._detener:
+                    return
+                if not self._pendientes:
+                    continue
+            fallos = 0 if self._vaciar() else fallos + 1
+
+    def _vaciar(self):
+        """Aplicar el próximo lote en una transacción; True si se aplicó"""
+        with self._lock:
+            lote = self._pendientes[:self.tamano_lote]
+        if not lote:
+            return True
+
+        inicio = time.perf_counter()
+        procesados = len(lote)
+        try:
+            self._aplicar(lote)
+        except Exception as e:
+            print(f"Error aplicando lote de ingesta ({len(lote)} movimientos): {e}")
+            lote[0]['_fallos'] = lote[0].get('_fallos', 0) + 1
+            if lote[0]['_fallos'] < CONFIG['reintentos_lote']:
+                return False
+            # El lote falla siempre: aplicar de a uno y apartar los que no entran
+            procesados = self._aplicar_individual(lote)
+        self._ultimo_lote_ms = (time.perf_counter() - inicio) * 1000
+        self._descartar(lote[:procesados])
+        return procesados == len(lote)
+
+    def _descartar(self, aplicados):
+        """Quitar de la cola las entradas que ya quedaron registradas en la base"""
+        if not aplicados:
+            return
+        with self._lock:
+            del self._pendientes[:len(aplicados)]
+            for entrada in aplicados:
+                producto_id = entrada['producto_id']
+                self._deltas[producto_id] -= stock.delta_stock(entrada['tipo_movimiento'], entrada['cantidad'])
+                if not self._deltas[producto_id]:
+                    del self._deltas[producto_id]
+            if not self._pendientes:
+                # Todo lo del diario ya está en la base: se puede truncar
+                self._diario.truncate(0)
+
+    def _guardar_checkpoint(self, cursor, secuencia):
+        cursor.execute("UPDATE IngestaCheckpoint SET secuencia = ? WHERE diario = ?", secuencia, self.ruta)
+        if cursor.rowcount == 0:
+            cursor.execute("INSERT INTO IngestaCheckpoint (diario, secuencia) VALUES (?, ?)", self.ruta, secuencia)
+
+    def _aplicar(self, lote):
+        conn = self.obtener_conexion()
+        if not conn:
+            raise RuntimeError('Sin conexión a la base de datos')
+        try:
+            cursor = conn.cursor()
+            stock.aplicar_lote(cursor, lote)
+            self._guardar_checkpoint(cursor, lote[-1]['seq'])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _aplicar_individual(self, lote):
+        """Aplicar movimiento por movimiento; devuelve cuántos quedaron aplicados o rechazados"""
+        conn = self.obtener_conexion()
+        if not conn:
+            return 0
+        procesados = 0
+        try:
+            cursor = conn.cursor()
+            for entrada in lote:
+                try:
+                    stock.aplicar_lote(cursor, [entrada])
+                    self._guardar_checkpoint(cursor, entrada['seq'])
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    # Si ni siquiera se puede avanzar el checkpoint el problema es la base, no el movimiento
+                    self._guardar_checkpoint(cursor, entrada['seq'])
+                    conn.commit()
+                    self._rechazar(entrada, e)
+                procesados += 1
+        except Exception as e:
+            print(f"Error aplicando movimientos de ingesta de a uno: {e}")
+        finally:
+            conn.close()
+        return procesados
+
+    def _rechazar(self, entrada, error):
+        ruta = os.path.splitext(self.ruta)[0] + '.rechazados.jsonl'
+        registro = dict(entrada if isinstance(entrada, dict) else {'entrada': entrada}, error=str(error))
+        registro.pop('_fallos', None)
+        with open(ruta, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        print(f"Movimiento de ingesta rechazado (seq {registro.get('seq')}): {error}")
@@ -0,0 +1,318 @@
+"""
+Instrumentación de peticiones para los servidores Flask.
+
+Registra por endpoint la latencia total, la cantidad y el tiempo de las
+consultas a la base, el tiempo de obtener la conexión y el de serializar la
+respuesta JSON. Los datos se publican en /metrics (formato de texto de
+Prometheus) y en el header Server-Timing de cada respuesta.
+
+Uso:
+    app = Flask(__name__)
+    instrumentar_app(app, 'inventario')
+
+    @conexion_instrumentada
+    def get_db_connection():
+        ...
+"""
+import threading
+import time
+from functools import wraps
+
+from flask import Response, g, has_request_context, request
+
+# Límites de los buckets en segundos (los de los clientes oficiales de Prometheus)
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+class Histograma:
+    """Histograma acumulativo con etiquetas, al estilo Prometheus"""
+
+    def __init__(self, nombre, ayuda, etiquetas, buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores_etiquetas):
+        with self._lock:
+            serie = self._series.get(valores_etiquetas)
+            if serie is None:
+                serie = self._series[valores_etiquetas] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+            for valores, (conteos, suma, total) in series:
+                base = _etiquetas(self.etiquetas, valores)
+                for limite, conteo in zip(self.buckets, conteos):
+                    lineas.append(f'{self.nombre}_bucket{{{base}le="{limite}"}} {conteo}')
+                lineas.append(f'{self.nombre}_bucket{{{base}le="+Inf"}} {total}')
+                lineas.append(f'{self.nombre}_sum{{{base.rstrip(",")}}} {suma:.6f}')
+                lineas.append(f'{self.nombre}_count{{{base.rstrip(",")}}} {total}')
+        return lineas
+
+
+class Contador:
+    """Contador monótono con etiquetas"""
+
+    def __init__(self, nombre, ayuda, etiquetas):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, *valores_etiquetas, cantidad=1):
+        with self._lock:
+            self._series[valores_etiquetas] = self._series.get(valores_etiquetas, 0) + cantidad
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            for valores, total in sorted(self._series.items()):
+                lineas.append(f'{self.nombre}{{{_etiquetas(self.etiquetas, valores).rstrip(",")}}} {total}')
+        return lineas
+
+
+def _etiquetas(nombres, valores):
+    return ''.join(f'{n}="{str(v).replace(chr(34), chr(39))}",' for n, v in zip(nombres, valores))
+
+
+# ==================== MÉTRICAS REGISTRADAS ====================
+
+LATENCIA = Histograma('http_request_duration_seconds', 'Latencia total de la petición',
+                      ('servicio', 'endpoint', 'metodo'))
+PETICIONES = Contador('http_requests_total', 'Peticiones atendidas por código de estado',
+                      ('servicio', 'endpoint', 'metodo', 'estado'))
+CONSULTAS_POR_PETICION = Histograma('db_queries_per_request', 'Consultas SQL ejecutadas por petición',
+                                    ('servicio', 'endpoint'), buckets=BUCKETS_CONSULTAS)
+TIEMPO_DB = Histograma('db_query_duration_seconds', 'Tiempo en la base de datos por petición',
+                       ('servicio', 'endpoint'))
+CONSULTAS = Contador('db_queries_total', 'Consultas SQL ejecutadas', ('servicio', 'endpoint'))
+TIEMPO_CONEXION = Histograma('db_connection_acquire_seconds', 'Tiempo para obtener una conexión',
+                             ('servicio',))
+TIEMPO_SERIALIZACION = Histograma('response_serialization_seconds', 'Tiempo de serialización JSON',
+                                  ('servicio', 'endpoint'))
+
+METRICAS = [LATENCIA, PETICIONES, CONSULTAS_POR_PETICION, TIEMPO_DB, CONSULTAS,
+            TIEMPO_CONEXION, TIEMPO_SERIALIZACION]
+
+
+def registrar_metrica(metrica):
+    """Agregar una métrica propia a la exportación de /metrics"""
+    METRICAS.append(metrica)
+    return metrica
+
+
+def exportar_prometheus():
+    """Todas las métricas en formato de texto de Prometheus"""
+    lineas = []
+    for metrica in METRICAS:
+        lineas.extend(metrica.exportar())
+    return '\n'.join(lineas) + '\n'
+
+
+# ==================== CONTEXTO POR PETICIÓN ====================
+
+def _datos_peticion():
+    """Acumuladores de la petición actual (None fuera de una petición)"""
+    if not has_request_context():
+        return None
+    datos = g.get('_instrumentacion')
+    if datos is None:
+        datos = g._instrumentacion = {'inicio': time.perf_counter(), 'consultas': 0, 'db': 0.0,
+                                      'conexion': 0.0, 'serializacion': 0.0}
+    return datos
+
+
+def registrar_consulta(duracion, cantidad=1):
+    """Sumar una consulta (o lote) a la petición actual"""
+    datos = _datos_peticion()
+    if datos is not None:
+        datos['consultas'] += cantidad
+        datos['db'] += duracion
+
+
+def registrar_tiempo_db(duracion):
+    """Sumar tiempo de base sin contar una consulta nueva (fetch de filas)"""
+    datos = _datos_peticion()
+    if datos is not None:
+        datos['db'] += duracion
+
+
+# Funciones llamadas con (sql, params, duracion_segundos, error) tras cada sentencia
+observadores_consulta = []
+
+
+class CursorInstrumentado:
+    """Cursor que mide cada execute/fetch y delega el resto en el cursor real"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, *params):
+        inicio = time.perf_counter()
+        error = None
+        try:
+            self._cursor.execute(sql, *params)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duracion = time.perf_counter() - inicio
+            registrar_consulta(duracion)
+            for observador in observadores_consulta:
+                observador(sql, params, duracion, error)
+            error = None  # Evitar el ciclo excepción -> traceback -> frame
+        return self
+
+    def executemany(self, sql, secuencia):
+        inicio = time.perf_counter()
+        error = None
+        try:
+            return self._cursor.executemany(sql, secuencia)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duracion = time.perf_counter() - inicio
+            registrar_consulta(duracion)
+            for observador in observadores_consulta:
+                observador(sql, secuencia, duracion, error)
+            error = None
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.fetchone()
+        finally:
+            registrar_tiempo_db(time.perf_counter() - inicio)
+
+    def fetchmany(self, *args):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.fetchmany(*args)
+        finally:
+            registrar_tiempo_db(time.perf_counter() - inicio)
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.fetchall()
+        finally:
+            registrar_tiempo_db(time.perf_counter() - inicio)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+
+class ConexionInstrumentada:
+    """Envoltorio de la conexión que entrega cursores instrumentados"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return CursorInstrumentado(self._conn.cursor())
+
+    def execute(self, sql, *params):
+        return self.cursor().execute(sql, *params)
+
+    def __getattr__(self, nombre):
+        return getattr(self._conn, nombre)
+
+    def __setattr__(self, nombre, valor):
+        if nombre == '_conn':
+            object.__setattr__(self, nombre, valor)
+        else:
+            setattr(self._conn, nombre, valor)
+
+
+def conexion_instrumentada(funcion):
+    """Decorador para get_db_connection: mide la obtención y envuelve la conexión"""
+    @wraps(funcion)
+    def wrapper(*args, **kwargs):
+        inicio = time.perf_counter()
+        conn = funcion(*args, **kwargs)
+        duracion = time.perf_counter() - inicio
+        datos = _datos_peticion()
+        if datos is not None:
+            datos['conexion'] += duracion
+            TIEMPO_CONEXION.observar(duracion, g.get('_servicio', ''))
+        if conn is None:
+            return None
+        return ConexionInstrumentada(conn)
+    return wrapper
+
+
+# ==================== INTEGRACIÓN CON FLASK ====================
+
+def instrumentar_app(app, servicio):
+    """Registrar los hooks de medición, el encoder JSON medido y /metrics"""
+    encoder_base = app.json_encoder
+
+    class EncoderMedido(encoder_base):
+        def encode(self, o):
+            inicio = time.perf_counter()
+            try:
+                return super().encode(o)
+            finally:
+                datos = _datos_peticion()
+                if datos is not None:
+                    datos['serializacion'] += time.perf_counter() - inicio
+
+    app.json_encoder = EncoderMedido
+
+    @app.before_request
+    def _iniciar_medicion():
+        g._servicio = servicio
+        _datos_peticion()
+
+    @app.after_request
+    def _cerrar_medicion(response):
+        datos = _datos_peticion()
+        if datos is None or request.endpoint == 'metrics':
+            return response
+        total = time.perf_counter() - datos['inicio']
+        endpoint = request.endpoint or 'desconocido'
+        metodo = request.method
+
+        LATENCIA.observar(total, servicio, endpoint, metodo)
+        PETICIONES.incrementar(servicio, endpoint, metodo, response.status_code)
+        CONSULTAS_POR_PETICION.observar(datos['consultas'], servicio, endpoint)
+        TIEMPO_DB.observar(datos['db'], servicio, endpoint)
+        TIEMPO_SERIALIZACION.observar(datos['serializacion'], servicio, endpoint)
+        if datos['consultas']:
+            CONSULTAS.incrementar(servicio, endpoint, cantidad=datos['consultas'])
+
+        # El resto del tiempo es lógica del handler y conversión de filas
+        resto = max(0.0, total - datos['db'] - datos['conexion'] - datos['serializacion'])
+        response.headers['Server-Timing'] = ', '.join([
+            f"conexion;dur={datos['conexion'] * 1000:.2f};desc=\"Obtener conexion\"",
+            f"db;dur={datos['db'] * 1000:.2f};desc=\"{datos['consultas']} consultas\"",
+            f"serializacion;dur={datos['serializacion'] * 1000:.2f};desc=\"JSON\"",
+            f"app;dur={resto * 1000:.2f};desc=\"Handler y conversion de filas\"",
+            f"total;dur={total * 1000:.2f}",
+        ])
+        # Permite que las devtools muestren el desglose en peticiones cross-origin
+        response.headers['Timing-Allow-Origin'] = '*'
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Métricas en formato de texto de Prometheus"""
+        return Response(exportar_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    return app
@@ -1,17 +1,42 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 import pyodbc
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
 import hashlib
 import jwt
 import os
+import time
 from functools import wraps
+from instrumentation import instrumentar_app, conexion_instrumentada
+from query_log import configurar_registro_consultas
+from profiling import configurar_perfilado
+import rollups
+import archive
+import ingest
+from idempotency import Idempotencia
+import stock
+import valuation
+import sync
+import fieldsets
+from search_index import IndiceBusqueda, LIMITE_MAXIMO as LIMITE_BUSQUEDA
+import sku_index
+import reservations
+import snapshots
+import bulk_update
+import migrations
+import batch
+import contention
+import jobs
+from rate_limit import Limitador
+from circuit_breaker import Interruptor, configurar_degradacion
 
 # Crear la aplicación Flask
 app = Flask(__name__)
-CORS(app)  # Permitir CORS para el frontend
+CORS(app, expose_headers=['X-Total-Count', 'X-Archivo-Corte'])  # Permitir CORS para el frontend
+instrumentar_app(app, 'inventario')  # Métricas en /metrics y header Server-Timing
+configurar_registro_consultas(app)  # Log de consultas lentas y redundantes
 
 # Configuración para JWT
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'tu-clave-secreta-super-segura-2024')
@@ -22,9 +47,18 @@ DB_CONFIG = {
     'server': 'DESKTOP-T14SCLD\\SQLEXPRESS',
     'database': 'InventarioDB',
     'trusted_connection': 'yes',
-    'driver': '{ODBC Driver 17 for SQL Server}'
+    'driver': '{ODBC Driver 17 for SQL Server}',
+    'timeout_conexion': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+    'timeout_consulta': int(os.environ.get('DB_QUERY_TIMEOUT', 30))
 }
 
+# Tras varios fallos seguidos deja de intentar conectar por un rato (ver circuit_breaker.py)
+interruptor_db = Interruptor()
+
+@contention.con_aislamiento
+@batch.compartida_en_lote
+@conexion_instrumentada
+@interruptor_db.proteger
 def get_db_connection():
     """Crear conexión a la base de datos"""
     try:
@@ -34,12 +68,53 @@ def get_db_connection():
         DATABASE={DB_CONFIG['database']};
         Trusted_Connection={DB_CONFIG['trusted_connection']};
         """
-        conn = pyodbc.connect(connection_string)
+        conn = pyodbc.connect(connection_string, timeout=DB_CONFIG['timeout_conexion'])
+        conn.timeout = DB_CONFIG['timeout_consulta']
         return conn
     except Exception as e:
         print(f"Error conectando a la base de datos: {e}")
+        interruptor_db.ultimo_error = str(e)
         return None
 
+# Sin base: corte inmediato, lecturas servidas desde la última respuesta buena y GET /salud/db
+configurar_degradacion(app, interruptor_db,
+                       lecturas={'get_categorias', 'get_proveedores', 'get_productos', 'get_producto',
+                                 'get_movimientos', 'get_dashboard_stats', 'get_movimientos_serie',
+                                 'get_valuacion', 'get_reabastecimiento', 'get_stock_bajo', 'get_stock_al'},
+                       sin_base={'root', 'logout', 'get_estado_ingesta', 'buscar_productos',
+                                 'get_producto_por_sku', 'resolver_skus', 'get_reserva', 'liberar_reserva',
+                                 'get_estado_reservas', 'ejecutar_lote', 'iniciar_perfilado',
+                                 'estado_perfilado', 'detener_perfilado', 'descargar_perfilado',
+                                 'crear_trabajo', 'listar_trabajos', 'get_trabajo', 'descargar_trabajo',
+                                 'get_programa_trabajos'})
+
+# Reintentos de POST con la misma Idempotency-Key devuelven la respuesta original
+idempotencia = Idempotencia(get_db_connection)
+
+# Un reintento tras un deadlock vuelve a registrar la respuesta en su propia transacción
+contention.al_reintentar.append(idempotencia.descartar_registro)
+
+# Índice de búsqueda en memoria; sin base se sigue buscando sobre lo ya cargado
+indice_busqueda = IndiceBusqueda(get_db_connection)
+
+# Códigos escaneados: índice SKU -> producto y filtro de Bloom para no consultar códigos inexistentes
+indice_sku = sku_index.IndiceSku(get_db_connection)
+
+# Estado de la valuación a costo, se actualiza con los movimientos nuevos en cada reporte
+valuador = valuation.Valuador()
+
+# Reportes pesados en un pool de procesos y precálculo programado (ver jobs.py)
+trabajos = jobs.Trabajos(app, {
+    'dashboard': ('/reportes/dashboard-stats', 'json'),
+    'valuacion': ('/reportes/valuacion', 'json'),
+    'reabastecimiento': ('/reportes/reabastecimiento', 'json'),
+    'stock_bajo': ('/reportes/stock-bajo', 'json'),
+    'stock_al': ('/reportes/stock-al', 'json'),
+    'movimientos_serie': ('/reportes/movimientos-serie', 'json'),
+    'productos_csv': ('/productos', 'csv'),
+    'movimientos_csv': ('/movimientos', 'csv'),
+})
+
 def init_database():
     """Verificar conexión a la base de datos"""
     conn = get_db_connection()
@@ -57,8 +132,25 @@ def init_database():
             return False
     return False
 
+def init_schema():
+    """Aplicar las migraciones de esquema pendientes (ver migrations.py)"""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
+    try:
+        migrations.migrar(conn)
+        contention.verificar_snapshot(conn)
+        conn.close()
+        return True
+        
+    except Exception as e:
+        print(f"Error aplicando migraciones de esquema: {e}")
+        conn.close()
+        return False
+
 def init_users_table():
-    """Crear tabla de usuarios si no existe y agregar usuario admin por defecto"""
+    """Agregar el usuario admin por defecto si no existe (la tabla la crea la migración 1)"""
     conn = get_db_connection()
     if not conn:
         return False
@@ -66,19 +158,6 @@ def init_users_table():
     try:
         cursor = conn.cursor()
         
-        # Crear tabla de usuarios si no existe
-        cursor.execute("""
-            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='Usuarios' AND xtype='U')
-            CREATE TABLE Usuarios (
-                id INT IDENTITY(1,1) PRIMARY KEY,
-                username NVARCHAR(50) UNIQUE NOT NULL,
-                password_hash NVARCHAR(255) NOT NULL,
-                rol NVARCHAR(20) DEFAULT 'usuario',
-                activo BIT DEFAULT 1,
-                fecha_creacion DATETIME DEFAULT GETDATE()
-            )
-        """)
-        
         # Verificar si existe el usuario admin
         cursor.execute("SELECT COUNT(*) FROM Usuarios WHERE username = 'admin'")
         admin_exists = cursor.fetchone()[0]
@@ -104,6 +183,24 @@ def init_users_table():
         conn.close()
         return False
 
+def init_idempotency_table():
+    """Purgar las claves de idempotencia vencidas"""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
+    try:
+        cursor = conn.cursor()
+        idempotencia.purgar_vencidas(cursor)
+        conn.commit()
+        conn.close()
+        return True
+        
+    except Exception as e:
+        print(f"Error purgando claves de idempotencia: {e}")
+        conn.close()
+        return False
+
 def hash_password(password):
     """Crear hash de contraseña"""
     return hashlib.sha256(password.encode()).hexdigest()
@@ -143,7 +240,8 @@ def require_auth(f):
         if token.startswith('Bearer '):
             token = token[7:]
         
-        payload = verify_token(token)
+        # Dentro de POST /batch el token ya se verificó una vez para todo el lote
+        payload = batch.usuario_del_lote() or verify_token(token)
         if not payload:
             return jsonify({'error': 'Token inválido o expirado'}), 401
         
@@ -152,9 +250,111 @@ def require_auth(f):
     
     return decorated_function
 
+def identidad_peticion():
+    """Usuario del token si la petición trae uno válido; si no, la IP del cliente"""
+    token = request.headers.get('Authorization', '')
+    if token.startswith('Bearer '):
+        token = token[7:]
+    payload = (batch.usuario_del_lote() or verify_token(token)) if token else None
+    return f"usuario:{payload['username']}" if payload else f"ip:{request.remote_addr}"
+
+def es_admin():
+    """True si la petición trae un token válido de un usuario con rol admin"""
+    token = request.headers.get('Authorization', '')
+    if token.startswith('Bearer '):
+        token = token[7:]
+    payload = verify_token(token) if token else None
+    return bool(payload) and payload.get('rol') == 'admin'
+
+def grupo_listado():
+    """Los listados sin paginar cuentan como consulta pesada"""
+    return 'listados' if 'limit' in request.args else 'completos'
+
+# Token buckets por usuario y endpoint y tope de consultas pesadas simultáneas
+limitador = Limitador(identidad_peticion)
+
+# cProfile / tracemalloc bajo demanda para administradores (ver profiling.py)
+configurar_perfilado(app, es_admin)
+
 # Inicializar la base de datos al arrancar
 init_database()
+init_schema()
 init_users_table()
+init_idempotency_table()
+
+# Cola de ingesta diferida (INGEST_ENABLED=1); se inicia con la primera petición
+# para que el proceso padre del reloader no abra el diario
+cola_ingesta = None
+
+@app.before_first_request
+def iniciar_ingesta():
+    """Abrir el diario, reproducir lo pendiente y arrancar el hilo de vaciado"""
+    global cola_ingesta
+    if not ingest.CONFIG['activa'] or cola_ingesta:
+        return
+    try:
+        cola_ingesta = ingest.ColaIngesta(get_db_connection).iniciar()
+        print(f"[OK] Ingesta diferida activa (diario: {cola_ingesta.ruta})")
+    except ingest.DiarioOcupado:
+        print("Ingesta diferida desactivada en este proceso: el diario está en uso por otro proceso")
+    except Exception as e:
+        print(f"Error iniciando la ingesta diferida: {e}")
+
+# Reservas de stock en memoria (RESERVATIONS_ENABLED); como la ingesta, las atiende
+# el proceso que abre el diario
+reservas = None
+
+def confirmacion_grabada(reserva):
+    """Si la SALIDA de una confirmación interrumpida por una caída llegó a la base o a la ingesta"""
+    # Con ingesta diferida la SALIDA puede estar todavía en el diario, sin aplicar
+    if ingest.CONFIG['activa'] and ingest.referencia_en_diario(f"RES-{reserva['id']}"):
+        return True
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError('Sin conexión para verificar confirmaciones de reservas')
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM MovimientosStock WHERE numero_referencia = ?", f"RES-{reserva['id']}")
+        return cursor.fetchone()[0] > 0
+    finally:
+        conn.close()
+
+@app.before_first_request
+def iniciar_reservas():
+    """Abrir el diario de reservas, recuperar las activas y arrancar el vencimiento"""
+    global reservas
+    if not reservations.CONFIG['activas'] or reservas:
+        return
+    try:
+        reservas = reservations.Reservas().iniciar(confirmacion_grabada)
+    except reservations.DiarioOcupado:
+        print("Reservas desactivadas en este proceso: el diario está en uso por otro proceso")
+    except Exception as e:
+        print(f"Error iniciando las reservas: {e}")
+
+@app.before_first_request
+def iniciar_programador():
+    """Tomar el programador de reportes precalculados si ningún otro proceso lo tiene"""
+    if not jobs.CONFIG['activos']:
+        return
+    try:
+        if trabajos.iniciar():
+            print(f"[OK] Programador de reportes activo ({len(trabajos.programa)} programados, "
+                  f"resultados en {trabajos.directorio})")
+    except Exception as e:
+        print(f"Error iniciando el programador de reportes: {e}")
+
+@app.before_first_request
+def iniciar_indice_busqueda():
+    """Construir el índice de búsqueda de productos en segundo plano"""
+    if not indice_busqueda.listo:
+        indice_busqueda.iniciar()
+
+@app.before_first_request
+def iniciar_indice_sku():
+    """Cargar el filtro de Bloom de SKU en segundo plano"""
+    if not indice_sku.listo:
+        indice_sku.iniciar()
 
 # ==================== ENDPOINTS DE AUTENTICACIÓN ====================
 
@@ -299,24 +499,24 @@ def root():
     })
 
 @app.route('/categorias', methods=['GET'])
+@contention.aislamiento()
 def get_categorias():
     """Obtener todas las categorías"""
+    try:
+        campos = fieldsets.nombres_pedidos(fieldsets.CATEGORIAS, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    columnas, _ = fieldsets.seleccionar(fieldsets.CATEGORIAS, campos)
+    
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "Error de conexión a la base de datos"}), 500
     
     try:
         cursor = conn.cursor()
-        cursor.execute("SELECT id, nombre, descripcion, fecha_creacion FROM Categorias ORDER BY nombre")
+        cursor.execute(f"SELECT {columnas} FROM Categorias ORDER BY nombre")
         
-        categorias = []
-        for row in cursor.fetchall():
-            categorias.append({
-                'id': row[0],
-                'nombre': row[1],
-                'descripcion': row[2] or '',
-                'fecha_creacion': row[3].isoformat()
-            })
+        categorias = [fieldsets.a_dict(fieldsets.CATEGORIAS, campos, row) for row in cursor.fetchall()]
         
         conn.close()
         return jsonify(categorias)
@@ -325,6 +525,7 @@ def get_categorias():
         return jsonify({"error": f"Error obteniendo categorías: {str(e)}"}), 500
 
 @app.route('/categorias', methods=['POST'])
+@contention.reintentar()
 def create_categoria():
     """Crear una nueva categoría"""
     data = request.get_json()
@@ -343,8 +544,6 @@ def create_categoria():
             VALUES (?, ?)
         """, data['nombre'], data.get('descripcion', ''))
         
-        conn.commit()
-        
         # Obtener el ID de la categoría insertada usando el nombre
         cursor.execute("""
             SELECT TOP 1 id FROM Categorias 
@@ -365,6 +564,8 @@ def create_categoria():
             'fecha_creacion': row[3].isoformat()
         }
         
+        # Se confirma al final: si @reintentar repite el handler, el INSERT anterior ya se deshizo
+        conn.commit()
         conn.close()
         return jsonify(categoria), 201
     except Exception as e:
@@ -372,6 +573,7 @@ def create_categoria():
         return jsonify({"error": f"Error creando categoría: {str(e)}"}), 500
 
 @app.route('/categorias/<int:categoria_id>', methods=['DELETE'])
+@contention.reintentar()
 def delete_categoria(categoria_id):
     """Eliminar una categoría (marcar como inactiva)"""
     conn = get_db_connection()
@@ -408,27 +610,24 @@ def delete_categoria(categoria_id):
 # ==================== ENDPOINTS DE PROVEEDORES ====================
 
 @app.route('/proveedores', methods=['GET'])
+@contention.aislamiento()
 def get_proveedores():
     """Obtener todos los proveedores"""
+    try:
+        campos = fieldsets.nombres_pedidos(fieldsets.PROVEEDORES, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    columnas, _ = fieldsets.seleccionar(fieldsets.PROVEEDORES, campos)
+    
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "Error de conexión a la base de datos"}), 500
     
     try:
         cursor = conn.cursor()
-        cursor.execute("SELECT id, nombre, contacto, email, telefono, direccion, fecha_creacion FROM Proveedores ORDER BY nombre")
+        cursor.execute(f"SELECT {columnas} FROM Proveedores ORDER BY nombre")
         
-        proveedores = []
-        for row in cursor.fetchall():
-            proveedores.append({
-                'id': row[0],
-                'nombre': row[1],
-                'contacto': row[2] or '',
-                'email': row[3] or '',
-                'telefono': row[4] or '',
-                'direccion': row[5] or '',
-                'fecha_creacion': row[6].isoformat()
-            })
+        proveedores = [fieldsets.a_dict(fieldsets.PROVEEDORES, campos, row) for row in cursor.fetchall()]
         
         conn.close()
         return jsonify(proveedores)
@@ -437,6 +636,7 @@ def get_proveedores():
         return jsonify({"error": f"Error obteniendo proveedores: {str(e)}"}), 500
 
 @app.route('/proveedores', methods=['POST'])
+@contention.reintentar()
 def create_proveedor():
     """Crear un nuevo proveedor"""
     data = request.get_json()
@@ -456,8 +656,6 @@ def create_proveedor():
         """, data['nombre'], data.get('contacto', ''), data.get('email', ''),
              data.get('telefono', ''), data.get('direccion', ''))
         
-        conn.commit()
-        
         # Obtener el ID del proveedor insertado usando el nombre
         cursor.execute("""
             SELECT TOP 1 id FROM Proveedores 
@@ -481,6 +679,8 @@ def create_proveedor():
             'fecha_creacion': row[6].isoformat()
         }
         
+        # Se confirma al final: si @reintentar repite el handler, el INSERT anterior ya se deshizo
+        conn.commit()
         conn.close()
         return jsonify(proveedor), 201
     except Exception as e:
@@ -488,6 +688,7 @@ def create_proveedor():
         return jsonify({"error": f"Error creando proveedor: {str(e)}"}), 500
 
 @app.route('/proveedores/<int:proveedor_id>', methods=['DELETE'])
+@contention.reintentar()
 def delete_proveedor(proveedor_id):
     """Eliminar un proveedor (marcar como inactivo)"""
     conn = get_db_connection()
@@ -523,52 +724,93 @@ def delete_proveedor(proveedor_id):
 
 # ==================== ENDPOINTS DE PRODUCTOS ====================
 
+LIMITE_PAGINA_MAX = 500
+
+def leer_paginacion():
+    """Leer offset y limit de la query string; limit es None si no se pidió paginar"""
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    if offset < 0 or (limit is not None and limit < 1):
+        raise ValueError('offset debe ser >= 0 y limit >= 1')
+    return offset, min(limit, LIMITE_PAGINA_MAX) if limit is not None else None
+
+def patron_like(texto):
+    """Patrón LIKE 'contiene' con los comodines del texto escapados (usar con ESCAPE '\\')"""
+    escapado = texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace('[', '\\[')
+    return f"%{escapado}%"
+
 @app.route('/productos', methods=['GET'])
+@limitador.limitar(grupo_listado)
+@contention.aislamiento()
 def get_productos():
-    """Obtener todos los productos con información de categoría y proveedor"""
+    """Obtener productos con información de categoría y proveedor (con búsqueda y paginación opcionales)"""
+    try:
+        offset, limit = leer_paginacion()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    q = request.args.get('q', '').strip()
+    categoria_id = request.args.get('categoria_id', type=int)
+    estado_stock = request.args.get('estado_stock', '')
+    condiciones_stock = {
+        'normal': "p.deficit_stock < 0",
+        'bajo': "p.deficit_stock >= 0 AND p.cantidad_stock > 0",
+        'critico': "p.cantidad_stock = 0",
+    }
+    if estado_stock and estado_stock not in condiciones_stock:
+        return jsonify({"error": "estado_stock debe ser normal, bajo o critico"}), 400
+    try:
+        campos = fieldsets.nombres_pedidos(fieldsets.PRODUCTOS, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    columnas, joins = fieldsets.seleccionar(fieldsets.PRODUCTOS, campos)
+    
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "Error de conexión a la base de datos"}), 500
     
     try:
+        filtros, params = ["p.activo = 1"], []
+        if q:
+            filtros.append("(p.nombre LIKE ? ESCAPE '\\' OR p.codigo_sku LIKE ? ESCAPE '\\')")
+            params.extend([patron_like(q)] * 2)
+        if categoria_id is not None:
+            filtros.append("p.categoria_id = ?")
+            params.append(categoria_id)
+        if estado_stock:
+            filtros.append(condiciones_stock[estado_stock])
+        donde = ' AND '.join(filtros)
+        
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT p.id, p.nombre, p.descripcion, p.codigo_sku, p.precio,
-                   p.cantidad_stock, p.stock_minimo, p.activo, p.fecha_creacion,
-                   c.nombre as categoria_nombre, pr.nombre as proveedor_nombre,
-                   p.categoria_id, p.proveedor_id
+        total = None
+        pagina = ""
+        if limit is not None:
+            cursor.execute(f"SELECT COUNT(*) FROM Productos p WHERE {donde}", *params)
+            total = cursor.fetchone()[0]
+            pagina = "OFFSET ? ROWS FETCH NEXT ? ROWS ONLY"
+            params.extend([offset, limit])
+        cursor.execute(f"""
+            SELECT {columnas}
             FROM Productos p
-            LEFT JOIN Categorias c ON p.categoria_id = c.id
-            LEFT JOIN Proveedores pr ON p.proveedor_id = pr.id
-            WHERE p.activo = 1
-            ORDER BY p.nombre
-        """)
+            {joins}
+            WHERE {donde}
+            ORDER BY p.nombre, p.id
+            {pagina}
+        """, *params)
         
-        productos = []
-        for row in cursor.fetchall():
-            productos.append({
-                'id': row[0],
-                'nombre': row[1],
-                'descripcion': row[2] or '',
-                'codigo_sku': row[3] or '',
-                'precio': float(row[4]),
-                'cantidad_stock': row[5],
-                'stock_minimo': row[6],
-                'activo': bool(row[7]),
-                'fecha_creacion': row[8].isoformat(),
-                'categoria_nombre': row[9] or '',
-                'proveedor_nombre': row[10] or '',
-                'categoria_id': row[11],
-                'proveedor_id': row[12]
-            })
+        productos = [fieldsets.a_dict(fieldsets.PRODUCTOS, campos, row) for row in cursor.fetchall()]
         
         conn.close()
-        return jsonify(productos)
+        response = jsonify(productos)
+        if total is not None:
+            response.headers['X-Total-Count'] = str(total)
+        return response
     except Exception as e:
         conn.close()
         return jsonify({"error": f"Error obteniendo productos: {str(e)}"}), 500
 
 @app.route('/debug/productos-categorias', methods=['GET'])
+@limitador.limitar('completos')
+@contention.aislamiento()
 def debug_productos_categorias():
     """Debug: Ver productos con sus categorías"""
     conn = get_db_connection()
@@ -599,43 +841,96 @@ def debug_productos_categorias():
         conn.close()
         return jsonify({"error": f"Error: {str(e)}"}), 500
 
+@app.route('/productos/buscar', methods=['GET'])
+@limitador.limitar('listados')
+def buscar_productos():
+    """Búsqueda de productos tolerante a errores de tipeo, con ranking y autocompletado"""
+    q = request.args.get('q', '').strip()
+    limite = request.args.get('limit', 10, type=int)
+    sugerencias = request.args.get('sugerencias', 5, type=int)
+    if not q:
+        return jsonify({"error": "q es requerido"}), 400
+    if not 1 <= limite <= LIMITE_BUSQUEDA or not 0 <= sugerencias <= LIMITE_BUSQUEDA:
+        return jsonify({"error": f"limit y sugerencias deben estar entre 1 y {LIMITE_BUSQUEDA}"}), 400
+    
+    indice_busqueda.refrescar()
+    if not indice_busqueda.listo:
+        response = jsonify({"error": "El índice de búsqueda se está construyendo, reintentar en unos segundos",
+                            "indice": indice_busqueda.resumen()})
+        response.headers['Retry-After'] = '2'
+        return response, 503
+    
+    try:
+        inicio = time.perf_counter()
+        resultado = indice_busqueda.buscar(q, limite, sugerencias)
+        resultado['q'] = q
+        resultado['duracion_ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+        return jsonify(resultado)
+    except Exception as e:
+        return jsonify({"error": f"Error buscando productos: {str(e)}"}), 500
+
+@app.route('/productos/sku/<path:codigo_sku>', methods=['GET'])
+def get_producto_por_sku(codigo_sku):
+    """Producto activo por código SKU o de barras, sin consultar la base si ya está indexado"""
+    try:
+        producto = indice_sku.resolver([codigo_sku])[codigo_sku]
+    except sku_index.SinConexion:
+        return jsonify({"error": "Error de conexión a la base de datos"}), 503
+    except Exception as e:
+        return jsonify({"error": f"Error buscando SKU: {str(e)}"}), 500
+    
+    if not producto:
+        return jsonify({"error": "Producto no encontrado"}), 404
+    return jsonify(producto)
+
+@app.route('/productos/sku', methods=['POST'])
+@limitador.limitar('listados')
+def resolver_skus():
+    """Resolver varios SKU en una sola llamada"""
+    data = request.get_json(silent=True) or {}
+    skus = data.get('skus')
+    if not isinstance(skus, list) or not skus or not all(isinstance(sku, str) for sku in skus):
+        return jsonify({"error": "skus debe ser una lista de códigos"}), 400
+    if len(skus) > sku_index.MAX_LOTE:
+        return jsonify({"error": f"Como máximo {sku_index.MAX_LOTE} SKU por llamada"}), 400
+    
+    try:
+        resueltos = indice_sku.resolver(skus)
+    except sku_index.SinConexion:
+        return jsonify({"error": "Error de conexión a la base de datos"}), 503
+    except Exception as e:
+        return jsonify({"error": f"Error buscando SKU: {str(e)}"}), 500
+    
+    return jsonify({
+        'productos': {sku: producto for sku, producto in resueltos.items() if producto},
+        'no_encontrados': [sku for sku, producto in resueltos.items() if not producto]
+    })
+
 @app.route('/productos/<int:producto_id>', methods=['GET'])
 def get_producto(producto_id):
     """Obtener un producto específico por ID"""
+    try:
+        campos = fieldsets.nombres_pedidos(fieldsets.PRODUCTOS, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    columnas, joins = fieldsets.seleccionar(fieldsets.PRODUCTOS, campos)
+    
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "Error de conexión a la base de datos"}), 500
     
     try:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT p.id, p.nombre, p.descripcion, p.codigo_sku, p.precio,
-                   p.cantidad_stock, p.stock_minimo, p.activo, p.fecha_creacion,
-                   c.nombre as categoria_nombre, pr.nombre as proveedor_nombre,
-                   p.categoria_id, p.proveedor_id
+        cursor.execute(f"""
+            SELECT {columnas}
             FROM Productos p
-            LEFT JOIN Categorias c ON p.categoria_id = c.id
-            LEFT JOIN Proveedores pr ON p.proveedor_id = pr.id
+            {joins}
             WHERE p.id = ? AND p.activo = 1
         """, producto_id)
         row = cursor.fetchone()
         
         if row:
-            producto = {
-                'id': row[0],
-                'nombre': row[1],
-                'descripcion': row[2] or '',
-                'codigo_sku': row[3] or '',
-                'precio': float(row[4]),
-                'cantidad_stock': row[5],
-                'stock_minimo': row[6],
-                'activo': bool(row[7]),
-                'fecha_creacion': row[8].isoformat(),
-                'categoria_nombre': row[9] or '',
-                'proveedor_nombre': row[10] or '',
-                'categoria_id': row[11],
-                'proveedor_id': row[12]
-            }
+            producto = fieldsets.a_dict(fieldsets.PRODUCTOS, campos, row)
             conn.close()
             return jsonify(producto)
         else:
@@ -646,6 +941,8 @@ def get_producto(producto_id):
         return jsonify({"error": f"Error obteniendo producto: {str(e)}"}), 500
 
 @app.route('/productos', methods=['POST'])
+@idempotencia.proteger()
+@contention.reintentar()
 def create_producto():
     """Crear un nuevo producto"""
     data = request.get_json()
@@ -660,23 +957,14 @@ def create_producto():
     try:
         cursor = conn.cursor()
         cursor.execute("""
-            INSERT INTO Productos (nombre, descripcion, codigo_sku, precio,
+            INSERT INTO Productos (nombre, descripcion, codigo_sku, precio, costo,
                                  cantidad_stock, stock_minimo, categoria_id, proveedor_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            OUTPUT INSERTED.id
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, data['nombre'], data.get('descripcion', ''), data.get('codigo_sku', ''),
-             data.get('precio', 0), data.get('cantidad_stock', 0),
+             data.get('precio', 0), data.get('costo'), data.get('cantidad_stock', 0),
              data.get('stock_minimo', 5), data['categoria_id'], data.get('proveedor_id'))
-        
-        conn.commit()
-        
-        # Obtener el ID del producto insertado usando el nombre y SKU
-        cursor.execute("""
-            SELECT TOP 1 id FROM Productos 
-            WHERE nombre = ? AND codigo_sku = ?
-            ORDER BY id DESC
-        """, data['nombre'], data.get('codigo_sku', ''))
-        result = cursor.fetchone()
-        producto_id = result[0] if result else None
+        producto_id = cursor.fetchone()[0]
         
         # Obtener el producto creado con información de categoría y proveedor
         cursor.execute("""
@@ -707,13 +995,19 @@ def create_producto():
             'proveedor_id': row[12]
         }
         
+        # La respuesta se guarda con la clave en la misma transacción que el alta
+        idempotencia.registrar(cursor, producto, 201)
+        conn.commit()
         conn.close()
+        indice_busqueda.marcar_pendiente()
+        indice_sku.registrar(producto)
         return jsonify(producto), 201
     except Exception as e:
         conn.close()
         return jsonify({"error": f"Error creando producto: {str(e)}"}), 500
 
 @app.route('/productos/<int:producto_id>', methods=['PUT'])
+@contention.reintentar()
 def update_producto(producto_id):
     """Actualizar un producto existente"""
     data = request.get_json()
@@ -734,17 +1028,15 @@ def update_producto(producto_id):
         # Actualizar el producto
         cursor.execute("""
             UPDATE Productos 
-            SET nombre = ?, descripcion = ?, codigo_sku = ?, precio = ?,
+            SET nombre = ?, descripcion = ?, codigo_sku = ?, precio = ?, costo = COALESCE(?, costo),
                 cantidad_stock = ?, stock_minimo = ?, categoria_id = ?, proveedor_id = ?,
                 fecha_actualizacion = ?
             WHERE id = ?
         """, data.get('nombre'), data.get('descripcion', ''), data.get('codigo_sku', ''),
-             data.get('precio', 0), data.get('cantidad_stock', 0),
+             data.get('precio', 0), data.get('costo'), data.get('cantidad_stock', 0),
              data.get('stock_minimo', 5), data.get('categoria_id'), data.get('proveedor_id'),
              datetime.now(), producto_id)
         
-        conn.commit()
-        
         # Obtener el producto actualizado
         cursor.execute("""
             SELECT p.id, p.nombre, p.descripcion, p.codigo_sku, p.precio,
@@ -771,13 +1063,18 @@ def update_producto(producto_id):
             'proveedor_nombre': row[10] or ''
         }
         
+        # Se confirma al final: si @reintentar repite el handler, el UPDATE anterior ya se deshizo
+        conn.commit()
         conn.close()
+        indice_busqueda.marcar_pendiente()
+        indice_sku.registrar(producto)
         return jsonify(producto)
     except Exception as e:
         conn.close()
         return jsonify({"error": f"Error actualizando producto: {str(e)}"}), 500
 
 @app.route('/productos/<int:producto_id>', methods=['DELETE'])
+@contention.reintentar()
 def delete_producto(producto_id):
     """Eliminar un producto (marcar como inactivo)"""
     conn = get_db_connection()
@@ -796,6 +1093,8 @@ def delete_producto(producto_id):
         # Marcar como inactivo en lugar de eliminar
         cursor.execute("UPDATE Productos SET activo = 0 WHERE id = ?", producto_id)
         conn.commit()
+        indice_busqueda.marcar_pendiente()
+        indice_sku.olvidar(producto_id)
         
         conn.close()
         return jsonify({"message": "Producto eliminado (marcado como inactivo)"})
@@ -803,51 +1102,204 @@ def delete_producto(producto_id):
         conn.close()
         return jsonify({"error": f"Error eliminando producto: {str(e)}"}), 500
 
+@app.route('/productos/ajuste-masivo', methods=['POST'])
+@idempotencia.proteger()
+@contention.reintentar()
+def ajustar_productos():
+    """Cambiar precio, costo o stock mínimo de los productos filtrados con un solo UPDATE"""
+    try:
+        ajuste = bulk_update.leer_ajuste(request.get_json(silent=True))
+    except bulk_update.AjusteInvalido as e:
+        return jsonify({"error": str(e)}), 400
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Error de conexión a la base de datos"}), 500
+    
+    try:
+        cursor = conn.cursor()
+        if ajuste['dry_run']:
+            resultado = bulk_update.previsualizar(cursor, ajuste)
+            conn.close()
+            return jsonify(resultado)
+        
+        resultado = bulk_update.aplicar(cursor, ajuste, datetime.now())
+        # Un reintento con la misma clave no vuelve a aplicar el porcentaje
+        idempotencia.registrar(cursor, resultado, 200)
+        conn.commit()
+        conn.close()
+        if resultado['afectados']:
+            indice_sku.marcar_pendiente()  # El índice SKU guarda el precio; el de búsqueda solo el texto
+        return jsonify(resultado)
+    except Exception as e:
+        conn.close()
+        return jsonify({"error": f"Error ajustando productos: {str(e)}"}), 500
+
+@app.route('/sync/productos', methods=['GET'])
+@limitador.limitar('listados')
+def sync_productos():
+    """Productos modificados desde un token de sincronización, con las bajas como tombstones"""
+    try:
+        desde = sync.leer_token(request.args.get('since'))
+    except ValueError:
+        return jsonify({"error": "Token de sincronización inválido"}), 400
+    limite = min(request.args.get('limit', sync.LIMITE_POR_DEFECTO, type=int), sync.LIMITE_MAXIMO)
+    if limite < 1:
+        return jsonify({"error": "limit debe ser >= 1"}), 400
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Error de conexión a la base de datos"}), 500
+    
+    try:
+        cursor = conn.cursor()
+        filas, hay_mas, reiniciar = sync.cambios(cursor, desde, limite)
+        conn.close()
+        
+        if reiniciar:
+            return jsonify({'reiniciar': True, 'token': '0', 'productos': [], 'eliminados': [], 'hay_mas': True})
+        
+        productos, eliminados = [], []
+        for row in filas:
+            if not row[1]:
+                eliminados.append(row[2])
+                continue
+            productos.append({
+                'id': row[2],
+                'nombre': row[3],
+                'descripcion': row[4] or '',
+                'codigo_sku': row[5] or '',
+                'precio': float(row[6]),
+                'cantidad_stock': row[7],
+                'stock_minimo': row[8],
+                'activo': True,
+                'fecha_creacion': row[9].isoformat(),
+                'categoria_id': row[10],
+                'proveedor_id': row[11]
+            })
+        
+        return jsonify({
+            'productos': productos,
+            'eliminados': eliminados,
+            'token': str(filas[-1][0] if filas else desde),
+            'hay_mas': hay_mas,
+            'reiniciar': False
+        })
+    except Exception as e:
+        conn.close()
+        return jsonify({"error": f"Error sincronizando productos: {str(e)}"}), 500
+
 # ==================== ENDPOINTS DE MOVIMIENTOS DE STOCK ====================
 
 @app.route('/movimientos', methods=['GET'])
+@limitador.limitar(grupo_listado)
+@contention.aislamiento()
 def get_movimientos():
-    """Obtener todos los movimientos de stock"""
+    """Obtener movimientos de stock (opcionalmente por rango de fechas y producto, y paginados)"""
+    try:
+        desde = datetime.strptime(request.args['desde'], '%Y-%m-%d') if 'desde' in request.args else None
+        hasta = datetime.strptime(request.args['hasta'], '%Y-%m-%d') + timedelta(days=1) \
+            if 'hasta' in request.args else None
+    except ValueError:
+        return jsonify({"error": "Las fechas deben tener formato YYYY-MM-DD"}), 400
+    try:
+        offset, limit = leer_paginacion()
+        campos = fieldsets.nombres_pedidos(fieldsets.MOVIMIENTOS, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    producto_id = request.args.get('producto_id', type=int)
+    
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "Error de conexión a la base de datos"}), 500
     
     try:
+        filtros, params = [], []
+        if desde:
+            filtros.append("m.fecha_movimiento >= ?")
+            params.append(desde)
+        if hasta:
+            filtros.append("m.fecha_movimiento < ?")
+            params.append(hasta)
+        if producto_id is not None:
+            filtros.append("m.producto_id = ?")
+            params.append(producto_id)
+        donde = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+        
+        # Si hay que mezclar con el archivo se pagina en memoria; si no, en la consulta
+        corte = archive.corte_caliente()
+        con_archivo = bool(corte and desde and desde < corte)
+        
+        # Mezclar con el archivo requiere id y fecha de cada fila: se leen todos los campos y se recorta al final
+        campos_consulta = list(fieldsets.MOVIMIENTOS['campos']) if con_archivo else campos
+        columnas, joins = fieldsets.seleccionar(fieldsets.MOVIMIENTOS, campos_consulta)
+        
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT m.id, m.producto_id, p.nombre as producto_nombre, m.tipo_movimiento,
-                   m.cantidad, m.motivo, m.numero_referencia, m.fecha_movimiento
+        total = None
+        pagina = ""
+        if limit is not None and not con_archivo:
+            cursor.execute(f"SELECT COUNT(*) FROM MovimientosStock m {donde}", *params)
+            total = cursor.fetchone()[0]
+            pagina = "OFFSET ? ROWS FETCH NEXT ? ROWS ONLY"
+            params.extend([offset, limit])
+        cursor.execute(f"""
+            SELECT {columnas}
             FROM MovimientosStock m
-            LEFT JOIN Productos p ON m.producto_id = p.id
-            ORDER BY m.fecha_movimiento DESC
-        """)
-        
-        movimientos = []
-        for row in cursor.fetchall():
-            movimientos.append({
-                'id': row[0],
-                'producto_id': row[1],
-                'producto_nombre': row[2] or '',
-                'tipo_movimiento': row[3],
-                'cantidad': row[4],
-                'motivo': row[5] or '',
-                'numero_referencia': row[6] or '',
-                'fecha_movimiento': row[7].isoformat()
-            })
+            {joins}
+            {donde}
+            ORDER BY m.fecha_movimiento DESC, m.id DESC
+            {pagina}
+        """, *params)
+        
+        movimientos = [fieldsets.a_dict(fieldsets.MOVIMIENTOS, campos_consulta, row) for row in cursor.fetchall()]
+        
+        # Solo se lee el archivo si el rango pedido empieza antes de la ventana caliente
+        if con_archivo:
+            archivados = list(archive.leer(desde, min(hasta, corte) if hasta else corte, producto_id))
+            nombres = {}
+            ids = sorted({m['producto_id'] for m in archivados}) if 'producto_nombre' in campos else []
+            for i in range(0, len(ids), 500):
+                lote = ids[i:i + 500]
+                cursor.execute(f"SELECT id, nombre FROM Productos WHERE id IN ({','.join('?' * len(lote))})",
+                               *lote)
+                nombres.update((row[0], row[1]) for row in cursor.fetchall())
+            vivos = {m['id'] for m in movimientos}
+            for movimiento in archivados:
+                if movimiento['id'] not in vivos:
+                    movimiento['producto_nombre'] = nombres.get(movimiento['producto_id']) or ''
+                    movimientos.append(movimiento)
+            movimientos.sort(key=lambda m: (m['fecha_movimiento'], m['id']), reverse=True)
+            if limit is not None:
+                total = len(movimientos)
+                movimientos = movimientos[offset:offset + limit]
+            if campos != campos_consulta:
+                movimientos = [{campo: m[campo] for campo in campos} for m in movimientos]
         
         conn.close()
-        return jsonify(movimientos)
+        response = jsonify(movimientos)
+        if total is not None:
+            response.headers['X-Total-Count'] = str(total)
+        if corte:
+            # Indica al cliente desde cuándo hay que pedir un rango para ver el historial archivado
+            response.headers['X-Archivo-Corte'] = corte.isoformat()
+        return response
     except Exception as e:
         conn.close()
         return jsonify({"error": f"Error obteniendo movimientos: {str(e)}"}), 500
 
 @app.route('/movimientos', methods=['POST'])
+@idempotencia.proteger(respaldo='numero_referencia')
+@contention.reintentar()
 def create_movimiento():
     """Crear un nuevo movimiento de stock"""
     data = request.get_json()
     
     if not data or 'producto_id' not in data or 'tipo_movimiento' not in data or 'cantidad' not in data:
         return jsonify({"error": "Producto, tipo de movimiento y cantidad son requeridos"}), 400
+    try:
+        stock.validar_movimiento(data['producto_id'], data['tipo_movimiento'], data['cantidad'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     conn = get_db_connection()
     if not conn:
@@ -862,23 +1314,30 @@ def create_movimiento():
             conn.close()
             return jsonify({"error": "Producto no encontrado"}), 404
         
-        # Crear el movimiento
-        cursor.execute("""
-            INSERT INTO MovimientosStock (producto_id, tipo_movimiento, cantidad, motivo, numero_referencia)
-            VALUES (?, ?, ?, ?, ?)
-        """, data['producto_id'], data['tipo_movimiento'], data['cantidad'],
-             data.get('motivo', ''), data.get('numero_referencia', ''))
+        if cola_ingesta:
+            # Ingesta diferida: se confirma al quedar en el diario y se aplica en lote
+            conn.close()
+            try:
+                secuencia = cola_ingesta.encolar(data['producto_id'], data['tipo_movimiento'], data['cantidad'],
+                                                 data.get('motivo', ''), data.get('numero_referencia', ''),
+                                                 data.get('costo_unitario'))
+            except ingest.ColaLlena as e:
+                response = jsonify({"error": "Cola de ingesta llena, reintentar más tarde"})
+                response.headers['Retry-After'] = str(e.reintentar_en)
+                return response, 503
+            encolado = {
+                'estado': 'encolado',
+                'secuencia': secuencia,
+                'producto_id': data['producto_id'],
+                'tipo_movimiento': data['tipo_movimiento'],
+                'cantidad': data['cantidad']
+            }
+            idempotencia.registrar(None, encolado, 202)
+            return jsonify(encolado), 202
         
-        # Actualizar el stock del producto
-        if data['tipo_movimiento'] == 'ENTRADA':
-            cursor.execute("UPDATE Productos SET cantidad_stock = cantidad_stock + ? WHERE id = ?", 
-                         data['cantidad'], data['producto_id'])
-        else:  # SALIDA
-            cursor.execute("UPDATE Productos SET cantidad_stock = cantidad_stock - ? WHERE id = ?", 
-                         data['cantidad'], data['producto_id'])
-        
-        conn.commit()
-        movimiento_id = cursor.lastrowid
+        movimiento_id = stock.insertar_movimiento(cursor, data['producto_id'], data['tipo_movimiento'],
+                                                  data['cantidad'], data.get('motivo', ''),
+                                                  data.get('numero_referencia', ''), data.get('costo_unitario'))
         
         # Obtener el movimiento creado
         cursor.execute("""
@@ -901,15 +1360,194 @@ def create_movimiento():
             'fecha_movimiento': row[7].isoformat()
         }
         
+        # La respuesta se guarda con la clave en la misma transacción que el movimiento
+        idempotencia.registrar(cursor, movimiento, 201)
+        conn.commit()
         conn.close()
+        indice_sku.marcar_pendiente()  # Cambió el stock de un producto que puede estar indexado
         return jsonify(movimiento), 201
     except Exception as e:
         conn.close()
         return jsonify({"error": f"Error creando movimiento: {str(e)}"}), 500
 
+@app.route('/productos/<int:producto_id>/stock', methods=['GET'])
+def get_stock_producto(producto_id):
+    """Stock de un producto incluyendo los movimientos de ingesta aún no aplicados y lo reservado"""
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Error de conexión a la base de datos"}), 500
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT cantidad_stock, stock_minimo FROM Productos WHERE id = ? AND activo = 1",
+                       producto_id)
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return jsonify({"error": "Producto no encontrado"}), 404
+        
+        pendiente = cola_ingesta.pendiente(producto_id) if cola_ingesta else 0
+        reservado = reservas.reservado(producto_id) if reservas else 0
+        return jsonify({
+            'producto_id': producto_id,
+            'cantidad_stock': row[0] + pendiente,
+            'stock_confirmado': row[0],
+            'pendiente': pendiente,
+            'reservado': reservado,
+            'disponible': row[0] + pendiente - reservado,
+            'stock_minimo': row[1]
+        })
+    except Exception as e:
+        conn.close()
+        return jsonify({"error": f"Error obteniendo stock: {str(e)}"}), 500
+
+@app.route('/ingesta/estado', methods=['GET'])
+def get_estado_ingesta():
+    """Estado de la cola de ingesta diferida"""
+    if not cola_ingesta:
+        return jsonify({'activa': False})
+    return jsonify({'activa': True, **cola_ingesta.estado()})
+
+# ==================== ENDPOINTS DE RESERVAS ====================
+
+def reservas_no_disponibles():
+    return jsonify({"error": "Reservas no disponibles en este proceso"}), 503
+
+@app.route('/reservas', methods=['POST'])
+@idempotencia.proteger()
+def create_reserva():
+    """Apartar stock de un producto por un tiempo, sin escribir movimientos"""
+    if not reservas:
+        return reservas_no_disponibles()
+    data = request.get_json()
+    
+    if not data or 'producto_id' not in data or 'cantidad' not in data:
+        return jsonify({"error": "Producto y cantidad son requeridos"}), 400
+    # Las reservas se indexan por producto_id: un "5" en texto no sumaría con las de 5
+    if isinstance(data['producto_id'], bool) or not isinstance(data['producto_id'], int):
+        return jsonify({"error": "producto_id debe ser un entero"}), 400
+    if isinstance(data['cantidad'], bool) or not isinstance(data['cantidad'], int) or data['cantidad'] < 1:
+        return jsonify({"error": "cantidad debe ser un entero positivo"}), 400
+    try:
+        ttl = reservas.leer_ttl(data.get('ttl_segundos'))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e) if isinstance(e, ValueError) else "ttl_segundos inválido"}), 400
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Error de conexión a la base de datos"}), 500
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT cantidad_stock FROM Productos WHERE id = ? AND activo = 1", data['producto_id'])
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return jsonify({"error": "Producto no encontrado"}), 404
+        
+        stock_actual = row[0] + (cola_ingesta.pendiente(data['producto_id']) if cola_ingesta else 0)
+        try:
+            reserva, disponible = reservas.reservar(data['producto_id'], data['cantidad'], stock_actual, ttl,
+                                                    data.get('referencia', ''))
+        except reservations.StockInsuficiente as e:
+            return jsonify({"error": "Stock insuficiente", "disponible": e.disponible}), 409
+        
+        reserva['disponible'] = disponible
+        idempotencia.registrar(None, reserva, 201)
+        return jsonify(reserva), 201
+    except Exception as e:
+        conn.close()
+        return jsonify({"error": f"Error creando reserva: {str(e)}"}), 500
+
+@app.route('/reservas/<reserva_id>', methods=['GET'])
+def get_reserva(reserva_id):
+    """Estado de una reserva (activa o terminada recientemente)"""
+    if not reservas:
+        return reservas_no_disponibles()
+    reserva = reservas.obtener(reserva_id)
+    if not reserva:
+        return jsonify({"error": "Reserva no encontrada"}), 404
+    return jsonify(reserva)
+
+@app.route('/reservas/<reserva_id>/confirmar', methods=['POST'])
+@idempotencia.proteger()
+@contention.reintentar()
+def confirmar_reserva(reserva_id):
+    """Convertir la reserva en una SALIDA de stock"""
+    if not reservas:
+        return reservas_no_disponibles()
+    data = request.get_json(silent=True) or {}
+    
+    def registrar_salida(reserva):
+        motivo = data.get('motivo') or 'Venta'
+        referencia = f"RES-{reserva['id']}"
+        if cola_ingesta:
+            secuencia = cola_ingesta.encolar(reserva['producto_id'], 'SALIDA', reserva['cantidad'],
+                                             motivo, referencia)
+            cuerpo = {'reserva': dict(reserva, estado=reservations.CONFIRMADA),
+                      'movimiento': {'estado': 'encolado', 'secuencia': secuencia}}
+            idempotencia.registrar(None, cuerpo, 201)
+            return cuerpo
+        
+        conn = get_db_connection()
+        if not conn:
+            raise ConnectionError("Error de conexión a la base de datos")
+        try:
+            cursor = conn.cursor()
+            movimiento_id = stock.insertar_movimiento(cursor, reserva['producto_id'], 'SALIDA',
+                                                      reserva['cantidad'], motivo, referencia)
+            cuerpo = {'reserva': dict(reserva, estado=reservations.CONFIRMADA),
+                      'movimiento': {'id': movimiento_id, 'producto_id': reserva['producto_id'],
+                                     'tipo_movimiento': 'SALIDA', 'cantidad': reserva['cantidad'],
+                                     'motivo': motivo, 'numero_referencia': referencia}}
+            # La respuesta se guarda con la clave en la misma transacción que el movimiento
+            idempotencia.registrar(cursor, cuerpo, 201)
+            conn.commit()
+            return cuerpo
+        finally:
+            conn.close()
+    
+    try:
+        _, cuerpo = reservas.confirmar(reserva_id, registrar_salida)
+    except reservations.ReservaInexistente:
+        return jsonify({"error": "Reserva no encontrada o ya cerrada"}), 404
+    except reservations.ReservaEnCurso:
+        return jsonify({"error": "La reserva se está confirmando"}), 409
+    except ingest.ColaLlena as e:
+        response = jsonify({"error": "Cola de ingesta llena, reintentar más tarde"})
+        response.headers['Retry-After'] = str(e.reintentar_en)
+        return response, 503
+    except Exception as e:
+        return jsonify({"error": f"Error confirmando reserva: {str(e)}"}), 500
+    
+    indice_sku.marcar_pendiente()
+    return jsonify(cuerpo), 201
+
+@app.route('/reservas/<reserva_id>/liberar', methods=['POST'])
+def liberar_reserva(reserva_id):
+    """Devolver al disponible el stock de una reserva sin confirmarla"""
+    if not reservas:
+        return reservas_no_disponibles()
+    try:
+        return jsonify(reservas.liberar(reserva_id))
+    except reservations.ReservaInexistente:
+        return jsonify({"error": "Reserva no encontrada o ya cerrada"}), 404
+    except reservations.ReservaEnCurso:
+        return jsonify({"error": "La reserva se está confirmando"}), 409
+
+@app.route('/reservas/estado', methods=['GET'])
+def get_estado_reservas():
+    """Resumen de las reservas abiertas en este proceso"""
+    if not reservas:
+        return jsonify({'activas': False})
+    return jsonify({'activas': True, **reservas.estado()})
+
 # ==================== ENDPOINTS DE REPORTES ====================
 
 @app.route('/reportes/dashboard-stats', methods=['GET'])
+@trabajos.precalculado('dashboard')
+@limitador.limitar('reportes')
+@contention.aislamiento()
 def get_dashboard_stats():
     """Obtener estadísticas para el dashboard con gráficos"""
     conn = get_db_connection()
@@ -923,7 +1561,7 @@ def get_dashboard_stats():
         cursor.execute("SELECT COUNT(*) FROM Productos WHERE activo = 1")
         total_productos = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(*) FROM Productos WHERE cantidad_stock <= stock_minimo AND activo = 1")
+        cursor.execute("SELECT COUNT(*) FROM Productos WHERE activo = 1 AND deficit_stock >= 0")
         stock_bajo = cursor.fetchone()[0]
         
         cursor.execute("SELECT COUNT(*) FROM Categorias")
@@ -962,14 +1600,14 @@ def get_dashboard_stats():
                 'stock': row[1] or 0
             })
         
-        # Movimientos recientes (últimos 7 días)
+        # Movimientos recientes (últimos 7 días), leídos del resumen diario
         cursor.execute("""
-            SELECT CAST(fecha_movimiento AS DATE) as fecha, 
-                   SUM(CASE WHEN tipo_movimiento = 'ENTRADA' THEN cantidad ELSE 0 END) as entradas,
-                   SUM(CASE WHEN tipo_movimiento = 'SALIDA' THEN cantidad ELSE 0 END) as salidas
-            FROM MovimientosStock
-            WHERE fecha_movimiento >= DATEADD(day, -7, GETDATE())
-            GROUP BY CAST(fecha_movimiento AS DATE)
+            SELECT fecha, 
+                   SUM(CASE WHEN tipo_movimiento = 'ENTRADA' THEN cantidad_total ELSE 0 END) as entradas,
+                   SUM(CASE WHEN tipo_movimiento = 'SALIDA' THEN cantidad_total ELSE 0 END) as salidas
+            FROM MovimientosDiarios
+            WHERE fecha >= CAST(DATEADD(day, -7, GETDATE()) AS DATE)
+            GROUP BY fecha
             ORDER BY fecha
         """)
         movimientos_recientes = []
@@ -1032,7 +1670,142 @@ def get_dashboard_stats():
         conn.close()
         return jsonify({"error": f"Error obteniendo estadísticas: {str(e)}"}), 500
 
+@app.route('/reportes/movimientos-serie', methods=['GET'])
+@limitador.limitar('reportes')
+@contention.aislamiento()
+def get_movimientos_serie():
+    """Serie temporal de movimientos desde el resumen diario"""
+    granularidad = rollups.GRANULARIDADES.get(request.args.get('granularidad', 'dia'))
+    agrupar = rollups.AGRUPACIONES.get(request.args.get('agrupar', 'total'))
+    if not granularidad:
+        return jsonify({"error": "granularidad debe ser dia, semana o mes"}), 400
+    if not agrupar:
+        return jsonify({"error": "agrupar debe ser total, producto o categoria"}), 400
+    
+    try:
+        hasta = datetime.strptime(request.args['hasta'], '%Y-%m-%d').date() if 'hasta' in request.args \
+            else datetime.now().date()
+        desde = datetime.strptime(request.args['desde'], '%Y-%m-%d').date() if 'desde' in request.args \
+            else hasta - timedelta(days=request.args.get('dias', 30, type=int) - 1)
+    except ValueError:
+        return jsonify({"error": "Las fechas deben tener formato YYYY-MM-DD"}), 400
+    if desde > hasta:
+        return jsonify({"error": "desde no puede ser posterior a hasta"}), 400
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Error de conexión a la base de datos"}), 500
+    
+    try:
+        cursor = conn.cursor()
+        series = rollups.serie(cursor, desde, hasta, granularidad, agrupar,
+                               limite=request.args.get('limite', 20, type=int),
+                               producto_id=request.args.get('producto_id', type=int),
+                               categoria_id=request.args.get('categoria_id', type=int))
+        conn.close()
+        return jsonify({
+            'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(),
+            'granularidad': granularidad,
+            'agrupar': agrupar,
+            'series': series
+        })
+    except Exception as e:
+        conn.close()
+        return jsonify({"error": f"Error obteniendo serie de movimientos: {str(e)}"}), 500
+
+@app.route('/reportes/valuacion', methods=['GET'])
+@trabajos.precalculado('valuacion')
+@limitador.limitar('reportes')
+def get_valuacion():
+    """Valor del inventario a costo (FIFO y promedio ponderado) por categoría y proveedor"""
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Error de conexión a la base de datos"}), 500
+    
+    try:
+        inicio = time.perf_counter()
+        valuador.actualizar(conn, recalcular=request.args.get('recalcular') == '1')
+        resultado = valuador.valuar(conn.cursor())
+        conn.close()
+        resultado['duracion_ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+        return jsonify(resultado)
+    except Exception as e:
+        conn.close()
+        return jsonify({"error": f"Error calculando valuación: {str(e)}"}), 500
+
+@app.route('/reportes/reabastecimiento', methods=['GET'])
+@trabajos.precalculado('reabastecimiento')
+@limitador.limitar('reportes')
+@contention.aislamiento()
+def get_reabastecimiento():
+    """Sugerencias de compra por proveedor según los puntos de reorden calculados"""
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Error de conexión a la base de datos"}), 500
+    
+    try:
+        filtros = ["p.activo = 1"]
+        params = []
+        if request.args.get('todos') != '1':
+            filtros.append("p.cantidad_stock <= r.punto_reorden")
+        proveedor_id = request.args.get('proveedor_id', type=int)
+        if proveedor_id is not None:
+            filtros.append("p.proveedor_id = ?")
+            params.append(proveedor_id)
+        
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT p.proveedor_id, pr.nombre as proveedor_nombre, p.id, p.nombre, p.codigo_sku,
+                   p.cantidad_stock, p.costo, r.demanda_diaria, r.stock_seguridad, r.punto_reorden,
+                   r.nivel_objetivo, r.metodo, r.fecha_calculo
+            FROM PuntosReorden r
+            INNER JOIN Productos p ON r.producto_id = p.id
+            LEFT JOIN Proveedores pr ON p.proveedor_id = pr.id
+            WHERE {' AND '.join(filtros)}
+            ORDER BY p.proveedor_id, (p.cantidad_stock - r.punto_reorden) ASC
+        """, *params)
+        
+        proveedores = {}
+        fecha_calculo = None
+        for row in cursor.fetchall():
+            grupo = proveedores.setdefault(row[0], {
+                'proveedor_id': row[0],
+                'proveedor_nombre': row[1] or 'Sin proveedor',
+                'productos': [],
+                'unidades_sugeridas': 0,
+                'costo_estimado': 0.0
+            })
+            sugerida = max(0, row[10] - row[5])
+            grupo['productos'].append({
+                'id': row[2],
+                'nombre': row[3],
+                'codigo_sku': row[4] or '',
+                'cantidad_stock': row[5],
+                'demanda_diaria': round(float(row[7]), 4),
+                'stock_seguridad': row[8],
+                'punto_reorden': row[9],
+                'nivel_objetivo': row[10],
+                'cantidad_sugerida': sugerida
+            })
+            grupo['unidades_sugeridas'] += sugerida
+            grupo['costo_estimado'] += sugerida * float(row[6] or 0)
+            fecha_calculo = fecha_calculo or (row[12].isoformat() if row[12] else None)
+        
+        conn.close()
+        for grupo in proveedores.values():
+            grupo['costo_estimado'] = round(grupo['costo_estimado'], 2)
+        return jsonify({
+            'fecha_calculo': fecha_calculo,
+            'proveedores': sorted(proveedores.values(), key=lambda g: g['costo_estimado'], reverse=True)
+        })
+    except Exception as e:
+        conn.close()
+        return jsonify({"error": f"Error obteniendo reabastecimiento: {str(e)}"}), 500
+
 @app.route('/reportes/stock-bajo', methods=['GET'])
+@limitador.limitar('reportes')
+@contention.aislamiento()
 def get_stock_bajo():
     """Obtener productos con stock bajo"""
     conn = get_db_connection()
@@ -1041,18 +1814,31 @@ def get_stock_bajo():
     
     try:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT p.id, p.nombre, p.codigo_sku, p.cantidad_stock, p.stock_minimo,
-                   c.nombre as categoria_nombre
-            FROM Productos p
-            LEFT JOIN Categorias c ON p.categoria_id = c.id
-            WHERE p.cantidad_stock <= p.stock_minimo AND p.activo = 1
-            ORDER BY (p.cantidad_stock - p.stock_minimo) ASC
-        """)
+        pronostico = request.args.get('criterio') == 'pronostico'
+        if pronostico:
+            # Umbral calculado por forecast.py; sin cálculo para el producto se usa stock_minimo
+            cursor.execute("""
+                SELECT p.id, p.nombre, p.codigo_sku, p.cantidad_stock, p.stock_minimo,
+                       c.nombre as categoria_nombre, r.punto_reorden
+                FROM Productos p
+                LEFT JOIN Categorias c ON p.categoria_id = c.id
+                LEFT JOIN PuntosReorden r ON r.producto_id = p.id
+                WHERE p.cantidad_stock <= COALESCE(r.punto_reorden, p.stock_minimo) AND p.activo = 1
+                ORDER BY (p.cantidad_stock - COALESCE(r.punto_reorden, p.stock_minimo)) ASC
+            """)
+        else:
+            cursor.execute("""
+                SELECT p.id, p.nombre, p.codigo_sku, p.cantidad_stock, p.stock_minimo,
+                       c.nombre as categoria_nombre
+                FROM Productos p
+                LEFT JOIN Categorias c ON p.categoria_id = c.id
+                WHERE p.activo = 1 AND p.deficit_stock >= 0
+                ORDER BY p.deficit_stock DESC
+            """)
         
         productos = []
         for row in cursor.fetchall():
-            productos.append({
+            producto = {
                 'id': row[0],
                 'nombre': row[1],
                 'codigo_sku': row[2] or '',
@@ -1060,7 +1846,12 @@ def get_stock_bajo():
                 'stock_minimo': row[4],
                 'categoria_nombre': row[5] or '',
                 'diferencia': row[3] - row[4]
-            })
+            }
+            if pronostico:
+                # stock_minimo sigue siendo el configurado; la diferencia es contra el umbral usado
+                umbral = row[6] if row[6] is not None else row[4]
+                producto.update(punto_reorden=row[6], umbral=umbral, diferencia=row[3] - umbral)
+            productos.append(producto)
         
         conn.close()
         return jsonify(productos)
@@ -1068,6 +1859,137 @@ def get_stock_bajo():
         conn.close()
         return jsonify({"error": f"Error obteniendo stock bajo: {str(e)}"}), 500
 
+@app.route('/reportes/stock-al', methods=['GET'])
+@limitador.limitar('reportes')
+@contention.aislamiento()
+def get_stock_al():
+    """Stock de cada producto al cierre de una fecha pasada, desde la foto más cercana"""
+    try:
+        fecha = datetime.strptime(request.args.get('fecha', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({"error": "fecha es requerida con formato YYYY-MM-DD"}), 400
+    producto_id = request.args.get('producto_id', type=int)
+    categoria_id = request.args.get('categoria_id', type=int)
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Error de conexión a la base de datos"}), 500
+    
+    try:
+        resultado = snapshots.stock_al(conn.cursor(), fecha, producto_id, categoria_id)
+        conn.close()
+        return jsonify(resultado)
+    except ValueError as e:
+        conn.close()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        conn.close()
+        return jsonify({"error": f"Error obteniendo stock a la fecha: {str(e)}"}), 500
+
+# ==================== ENDPOINTS DE TRABAJOS ====================
+
+def trabajos_no_disponibles():
+    return jsonify({"error": "Los trabajos de reportes están desactivados (JOBS_ENABLED=0)"}), 503
+
+def url_trabajo(trabajo):
+    """Estado del trabajo con los enlaces para seguirlo"""
+    enlaces = {'url_estado': f"/trabajos/{trabajo['id']}"}
+    if trabajo['estado'] == jobs.TERMINADO:
+        enlaces['url_resultado'] = f"/trabajos/{trabajo['id']}/resultado"
+    return dict(trabajo, **enlaces)
+
+@app.route('/trabajos', methods=['POST'])
+@limitador.limitar('trabajos')
+def crear_trabajo():
+    """Encolar un reporte pesado; se consulta después con el id devuelto"""
+    if not jobs.CONFIG['activos']:
+        return trabajos_no_disponibles()
+    data = request.get_json(silent=True) or {}
+    try:
+        trabajo = trabajos.enviar(data.get('tipo'), data.get('parametros'))
+    except jobs.TrabajoInvalido as e:
+        return jsonify({"error": str(e)}), 400
+    except jobs.ColaLlena:
+        response = jsonify({"error": "Demasiados trabajos en curso, reintentar más tarde"})
+        response.headers['Retry-After'] = '10'
+        return response, 503
+    except Exception as e:
+        return jsonify({"error": f"Error encolando el trabajo: {str(e)}"}), 500
+    
+    response = jsonify(url_trabajo(trabajo))
+    response.headers['Location'] = f"/trabajos/{trabajo['id']}"
+    return response, 202
+
+@app.route('/trabajos', methods=['GET'])
+def listar_trabajos():
+    """Últimos trabajos (de cualquier worker), opcionalmente de un tipo"""
+    if not jobs.CONFIG['activos']:
+        return trabajos_no_disponibles()
+    tipo = request.args.get('tipo')
+    limite = min(request.args.get('limit', 50, type=int), 500)
+    lista = trabajos.listar(limite if not tipo else 500)
+    if tipo:
+        lista = [t for t in lista if t['tipo'] == tipo][:limite]
+    return jsonify([url_trabajo(t) for t in lista])
+
+@app.route('/trabajos/programa', methods=['GET'])
+def get_programa_trabajos():
+    """Reportes precalculados: cuándo corren y de cuándo es el resultado vigente"""
+    if not jobs.CONFIG['activos']:
+        return trabajos_no_disponibles()
+    programa = []
+    for tipo, (expresion, proxima) in trabajos.proximas().items():
+        vigente = trabajos.vigente(tipo)
+        programa.append({'tipo': tipo, 'cron': expresion, 'proxima_ejecucion': proxima.isoformat(),
+                         'generado': vigente['generado'] if vigente else None,
+                         'vence': vigente['vence'] if vigente else None})
+    return jsonify({'programa': programa, 'pendientes_en_este_proceso': trabajos.pendientes()})
+
+@app.route('/trabajos/<trabajo_id>', methods=['GET'])
+def get_trabajo(trabajo_id):
+    """Estado de un trabajo: pendiente, ejecutando, terminado o error"""
+    if not jobs.CONFIG['activos']:
+        return trabajos_no_disponibles()
+    trabajo = trabajos.obtener(trabajo_id)
+    if not trabajo:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(url_trabajo(trabajo))
+
+@app.route('/trabajos/<trabajo_id>/resultado', methods=['GET'])
+def descargar_trabajo(trabajo_id):
+    """Resultado de un trabajo terminado (JSON, o CSV como descarga)"""
+    if not jobs.CONFIG['activos']:
+        return trabajos_no_disponibles()
+    trabajo = trabajos.obtener(trabajo_id)
+    if not trabajo:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    if trabajo['estado'] != jobs.TERMINADO:
+        return jsonify(url_trabajo(trabajo)), 409
+    try:
+        response = send_file(trabajos.ruta_resultado(trabajo), mimetype=jobs.FORMATOS[trabajo['formato']],
+                             as_attachment=trabajo['formato'] == 'csv',
+                             attachment_filename=f"{trabajo['tipo']}-{trabajo['terminado'][:10]}.{trabajo['formato']}")
+    except FileNotFoundError:
+        return jsonify({"error": "El resultado ya no está disponible"}), 410
+    return response
+
+# ==================== ENDPOINTS DE LOTES ====================
+
+@app.route('/batch', methods=['POST'])
+@require_auth
+def ejecutar_lote():
+    """Ejecutar varias llamadas a la API en un solo round trip y con una sola conexión"""
+    try:
+        peticiones = batch.leer_peticiones(request.get_json(silent=True))
+    except batch.PeticionInvalida as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        respuestas = batch.ejecutar(app, peticiones, request.current_user)
+        return jsonify({"respuestas": respuestas})
+    except Exception as e:
+        return jsonify({"error": f"Error ejecutando el lote: {str(e)}"}), 500
+
 if __name__ == '__main__':
     print("Iniciando Sistema de Gestion de Inventario...")
     print("API disponible en: http://localhost:5000")
@@ -0,0 +1,511 @@
+"""
+Reportes en segundo plano y precálculo programado.
+
+Un reporte pesado (dashboard completo, valuación, exportaciones) calculado
+dentro de la petición ocupa un worker de Flask mientras dura y el navegador
+corta antes. Con POST /trabajos el cliente pide el reporte y recibe un id al
+instante; el cálculo corre en un pool acotado de procesos y el resultado queda
+en disco para consultar el estado (GET /trabajos/<id>) y descargarlo
+(GET /trabajos/<id>/resultado).
+
+- Cada tipo de trabajo es un endpoint GET de la app: el proceso del pool
+  importa la app y llama a la vista con los parámetros del trabajo como query
+  string, así el reporte en segundo plano es exactamente el interactivo. Los
+  tipos "csv" convierten la lista JSON del endpoint a CSV.
+- Estado y resultados viven en JOBS_DIR (<id>.json y <id>.resultado.json|csv),
+  no en memoria: cualquier worker responde por un trabajo enviado a otro.
+- Un programador estilo cron (minuto hora día mes día_semana) precalcula los
+  reportes fuera de hora. El último resultado programado de cada tipo se
+  publica en JOBS_DIR/precalculados y las vistas con @precalculado(tipo) lo
+  devuelven sin consultar la base mientras no pase la ejecución siguiente
+  (más JOBS_GRACE_SECONDS). Con parámetros o ?fresco=1 se calcula en el momento.
+- El programador y la purga de resultados viejos corren en un solo proceso:
+  el primero que bloquea JOBS_DIR/programador.lock.
+
+Configuración (variables de entorno):
+    JOBS_ENABLED          0 para desactivar los trabajos y el precálculo (1)
+    JOBS_DIR              directorio de estados y resultados (trabajos)
+    JOBS_WORKERS          procesos del pool por worker web (2)
+    JOBS_MAX_PENDING      trabajos sin terminar por worker web; con más se responde 503 (20)
+    JOBS_RETENTION_HOURS  horas que se guardan los trabajos terminados (24)
+    JOBS_SCHEDULE         tipo=cron separados por ';' (vacío = sin precálculo), p. ej.
+                          "dashboard=0 * * * *;valuacion=30 2 * * *"
+    JOBS_GRACE_SECONDS    margen de validez de un precalculado después de su próxima ejecución (900)
+"""
+import csv
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import Response, request
+
+from instrumentation import Contador, Histograma, registrar_metrica
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos, programa cada worker
+    fcntl = None
+
+PROGRAMA_POR_DEFECTO = 'dashboard=0 * * * *;valuacion=30 2 * * *;reabastecimiento=0 3 * * *'
+
+CONFIG = {
+    'activos': os.environ.get('JOBS_ENABLED', '1') == '1',
+    'directorio': os.environ.get('JOBS_DIR', 'trabajos'),
+    'procesos': int(os.environ.get('JOBS_WORKERS', 2)),
+    'max_pendientes': int(os.environ.get('JOBS_MAX_PENDING', 20)),
+    'retencion_h': float(os.environ.get('JOBS_RETENTION_HOURS', 24)),
+    'programa': os.environ.get('JOBS_SCHEDULE', PROGRAMA_POR_DEFECTO),
+    'gracia_s': int(os.environ.get('JOBS_GRACE_SECONDS', 900)),
+    'revision_s': 30,
+    'purga_s': 600,
+}
+
+PENDIENTE, EJECUTANDO, TERMINADO, ERROR = 'pendiente', 'ejecutando', 'terminado', 'error'
+FORMATOS = {'json': 'application/json', 'csv': 'text/csv; charset=utf-8'}
+
+_ID = re.compile(r'^[0-9a-f]{32}$')
+
+TRABAJOS = registrar_metrica(Contador('report_jobs_total', 'Trabajos de reportes terminados',
+                                      ('tipo', 'origen', 'estado')))
+DURACION = registrar_metrica(Histograma('report_job_duration_seconds', 'Duración de los trabajos de reportes',
+                                        ('tipo',)))
+PRECALCULADOS = registrar_metrica(Contador('report_precomputed_requests_total',
+                                           'Peticiones de reportes con precálculo programado',
+                                           ('tipo', 'resultado')))
+
+
+class ColaLlena(Exception):
+    """Demasiados trabajos sin terminar en este worker"""
+
+
+class TrabajoInvalido(ValueError):
+    """Tipo o parámetros de un trabajo que no se pueden ejecutar"""
+
+
+def _ahora():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _escribir(ruta, datos):
+    """Escribir un archivo entero o nada: los lectores nunca ven uno a medias"""
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporal, 'wb') as f:
+        f.write(datos)
+    os.replace(temporal, ruta)
+
+
+def _ruta_resultado(directorio, trabajo):
+    return os.path.join(directorio, f"{trabajo['id']}.resultado.{trabajo['formato']}")
+
+
+def _guardar(directorio, trabajo):
+    _escribir(os.path.join(directorio, f"{trabajo['id']}.json"),
+              json.dumps(trabajo, ensure_ascii=False).encode('utf-8'))
+
+
+# ==================== CRON ====================
+
+_ALIAS = {'@hourly': '0 * * * *', '@daily': '0 0 * * *', '@nightly': '0 0 * * *', '@weekly': '0 0 * * 0'}
+_RANGOS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _campo(texto, minimo, maximo):
+    valores = set()
+    for parte in texto.split(','):
+        rango, _, paso = parte.partition('/')
+        if rango == '*':
+            inicio, fin = minimo, maximo
+        elif '-' in rango:
+            inicio, fin = (int(v) for v in rango.split('-', 1))
+        else:
+            inicio = fin = int(rango)
+        if not minimo <= inicio <= fin <= maximo:
+            raise ValueError(f"'{parte}' fuera de {minimo}-{maximo}")
+        valores.update(range(inicio, fin + 1, int(paso) if paso else 1))
+    return valores
+
+
+class Cron:
+    """Expresión cron de cinco campos (minuto hora día mes día_semana, 0 = domingo)"""
+
+    def __init__(self, expresion):
+        self.expresion = expresion.strip()
+        campos = _ALIAS.get(self.expresion, self.expresion).split()
+        if len(campos) != 5:
+            raise ValueError(f"cron '{expresion}': se esperan 5 campos (minuto hora día mes día_semana)")
+        try:
+            self.minutos, self.horas, self.dias, self.meses, semana = (
+                _campo(c, *r) for c, r in zip(campos, _RANGOS))
+        except ValueError as e:
+            raise ValueError(f"cron '{expresion}': {e}")
+        self.dias_semana = {d % 7 for d in semana}
+        # Como en cron: si se restringen día del mes y de la semana, alcanza con uno
+        self._cualquier_dia = campos[2] != '*' and campos[4] != '*'
+
+    def _dia_valido(self, instante):
+        dia = instante.day in self.dias
+        semana = instante.isoweekday() % 7 in self.dias_semana
+        return (dia or semana) if self._cualquier_dia else (dia and semana)
+
+    def siguiente(self, desde):
+        """Primer minuto posterior a desde que cumple la expresión"""
+        instante = desde.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = instante + timedelta(days=366 * 5)
+        while instante < limite:
+            if instante.month not in self.meses:
+                instante = (instante.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._dia_valido(instante):
+                instante = (instante + timedelta(days=1)).replace(hour=0, minute=0)
+            elif instante.hour not in self.horas:
+                instante = (instante + timedelta(hours=1)).replace(minute=0)
+            elif instante.minute not in self.minutos:
+                instante += timedelta(minutes=1)
+            else:
+                return instante
+        raise ValueError(f"cron '{self.expresion}' no se cumple nunca")
+
+
+def leer_programa(texto, tipos):
+    """'tipo=cron;tipo=cron' -> {tipo: Cron}"""
+    programa = {}
+    for entrada in filter(None, (e.strip() for e in texto.split(';'))):
+        tipo, _, expresion = entrada.partition('=')
+        tipo = tipo.strip()
+        if tipo not in tipos:
+            raise ValueError(f"JOBS_SCHEDULE: tipo de trabajo desconocido ({tipo}); usar uno de {', '.join(tipos)}")
+        programa[tipo] = Cron(expresion)
+    return programa
+
+
+# ==================== PROCESOS DEL POOL ====================
+
+# App que ejecuta los trabajos; solo se asigna en los procesos del pool
+_app = None
+
+
+def _iniciar_proceso(modulo_app, inicializadores):
+    """Inicializador de cada proceso del pool: importar la app"""
+    global _app
+    for funcion, args in inicializadores:
+        funcion(*args)
+    # Con "python inventory_api.py" la app ya se importó como __mp_main__ al arrancar el proceso
+    modulo = sys.modules['__mp_main__'] if modulo_app == '__main__' else importlib.import_module(modulo_app)
+    # El pool ya acota la concurrencia; las cuotas por cliente son de las peticiones HTTP
+    import rate_limit
+    rate_limit.CONFIG['activo'] = False
+    _app = modulo.app
+
+
+def _a_csv(filas):
+    if not isinstance(filas, list):
+        raise TrabajoInvalido('El endpoint no devolvió una lista: no se puede exportar a CSV')
+    salida = io.StringIO()
+    if filas:
+        escritor = csv.DictWriter(salida, fieldnames=list(filas[0]), extrasaction='ignore')
+        escritor.writeheader()
+        escritor.writerows(filas)
+    # BOM para que Excel abra los acentos bien
+    return ('\ufeff' + salida.getvalue()).encode('utf-8')
+
+
+def _ejecutar(trabajo, ruta, directorio):
+    """Correr la vista del trabajo en este proceso y guardar el resultado en disco"""
+    trabajo = dict(trabajo, estado=EJECUTANDO, iniciado=_ahora(), pid=os.getpid())
+    _guardar(directorio, trabajo)
+    inicio = time.perf_counter()
+    with _app.test_request_context(ruta, query_string=trabajo['parametros']):
+        vista = _app.view_functions[request.url_rule.endpoint]
+        respuesta = _app.make_response(vista(**request.view_args))
+        trabajo['estado_http'] = respuesta.status_code
+        if respuesta.status_code >= 400:
+            cuerpo = respuesta.get_json(silent=True) or {}
+            trabajo.update(estado=ERROR, error=cuerpo.get('error') or f"HTTP {respuesta.status_code}")
+        else:
+            datos = respuesta.get_data() if trabajo['formato'] == 'json' else _a_csv(respuesta.get_json())
+            _escribir(_ruta_resultado(directorio, trabajo), datos)
+            trabajo.update(estado=TERMINADO, bytes=len(datos))
+    trabajo.update(terminado=_ahora(), duracion_ms=round((time.perf_counter() - inicio) * 1000, 1))
+    _guardar(directorio, trabajo)
+    return trabajo
+
+
+# ==================== TRABAJOS ====================
+
+class Trabajos:
+    """Pool de procesos, estado en disco y programador de los trabajos de reportes
+
+    app: la app Flask cuyas vistas se ejecutan.
+    tipos: {tipo: (ruta GET de la app, 'json' | 'csv')}.
+    """
+
+    def __init__(self, app, tipos, directorio=None, procesos=None, programa=None):
+        self.app = app
+        self.tipos = tipos
+        self.directorio = directorio or CONFIG['directorio']
+        self.procesos = procesos or CONFIG['procesos']
+        self.programa = leer_programa(CONFIG['programa'] if programa is None else programa, tipos)
+        # (función, argumentos) a llamar en cada proceso del pool antes de importar la app
+        self.inicializadores = []
+        self._pool = None
+        self._futuros = {}
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        self._archivo_lock = None
+        self._cache = {}
+        os.makedirs(os.path.join(self.directorio, 'precalculados'), exist_ok=True)
+
+    # ---------- envío y ejecución ----------
+
+    def _crear_pool(self):
+        return ProcessPoolExecutor(max_workers=self.procesos,
+                                   # spawn: un fork heredaría los hilos y locks del worker web
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_iniciar_proceso,
+                                   initargs=(self.app.import_name, list(self.inicializadores)))
+
+    def enviar(self, tipo, parametros=None, origen='api'):
+        """Encolar un trabajo; devuelve su estado inicial"""
+        if tipo not in self.tipos:
+            raise TrabajoInvalido(f"Tipo de trabajo desconocido: {tipo} (disponibles: {', '.join(self.tipos)})")
+        parametros = parametros or {}
+        if not isinstance(parametros, dict) or any(
+                isinstance(v, (dict, list)) for v in parametros.values()):
+            raise TrabajoInvalido('"parametros" debe ser un objeto con valores simples')
+        ruta, formato = self.tipos[tipo]
+        trabajo = {'id': uuid.uuid4().hex, 'tipo': tipo, 'parametros': {k: str(v) for k, v in parametros.items()},
+                   'origen': origen, 'formato': formato, 'estado': PENDIENTE, 'creado': _ahora()}
+        with self._lock:
+            if len(self._futuros) >= CONFIG['max_pendientes']:
+                raise ColaLlena()
+            _guardar(self.directorio, trabajo)
+            if self._pool is None:
+                self._pool = self._crear_pool()
+            try:
+                futuro = self._pool.submit(_ejecutar, trabajo, ruta, self.directorio)
+            except BrokenProcessPool:
+                # Un proceso del pool murió (p. ej. por memoria): se descarta el pool entero
+                self._pool = self._crear_pool()
+                futuro = self._pool.submit(_ejecutar, trabajo, ruta, self.directorio)
+            self._futuros[trabajo['id']] = futuro
+        futuro.add_done_callback(lambda f: self._al_terminar(trabajo, f))
+        return trabajo
+
+    def _al_terminar(self, trabajo, futuro):
+        with self._lock:
+            self._futuros.pop(trabajo['id'], None)
+        try:
+            trabajo = futuro.result()
+        except Exception as e:
+            trabajo = dict(trabajo, estado=ERROR, error=str(e) or type(e).__name__, terminado=_ahora())
+            _guardar(self.directorio, trabajo)
+        TRABAJOS.incrementar(trabajo['tipo'], trabajo['origen'], trabajo['estado'])
+        if 'duracion_ms' in trabajo:
+            DURACION.observar(trabajo['duracion_ms'] / 1000, trabajo['tipo'])
+        if trabajo['estado'] == TERMINADO and trabajo['origen'] == 'programado':
+            self._publicar(trabajo)
+        elif trabajo['estado'] == ERROR:
+            print(f"Trabajo {trabajo['id']} ({trabajo['tipo']}) terminó con error: {trabajo.get('error')}")
+
+    def esperar(self, trabajo_id, timeout=None):
+        """Bloquear hasta que termine un trabajo enviado por este proceso; devuelve su estado"""
+        futuro = self._futuros.get(trabajo_id)
+        if futuro is not None:
+            try:
+                futuro.result(timeout)
+            except Exception:
+                pass
+            # El callback que guarda el estado final corre justo después
+            limite = time.monotonic() + 5
+            while trabajo_id in self._futuros and time.monotonic() < limite:
+                time.sleep(0.01)
+        return self.obtener(trabajo_id)
+
+    # ---------- consulta ----------
+
+    def obtener(self, trabajo_id):
+        """Estado de un trabajo o None si no existe (o ya se purgó)"""
+        if not _ID.match(trabajo_id or ''):
+            return None
+        try:
+            with open(os.path.join(self.directorio, f"{trabajo_id}.json"), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def listar(self, limite=50):
+        """Los últimos trabajos, del más reciente al más viejo"""
+        archivos = []
+        for nombre in os.listdir(self.directorio):
+            if nombre.endswith('.json') and _ID.match(nombre[:-5]):
+                try:
+                    archivos.append((os.path.getmtime(os.path.join(self.directorio, nombre)), nombre[:-5]))
+                except OSError:
+                    continue
+        archivos.sort(reverse=True)
+        return [t for t in (self.obtener(i) for _, i in archivos[:limite]) if t]
+
+    def ruta_resultado(self, trabajo):
+        return _ruta_resultado(self.directorio, trabajo)
+
+    def pendientes(self):
+        return len(self._futuros)
+
+    # ---------- precálculo ----------
+
+    def _ruta_precalculado(self, tipo, extension):
+        return os.path.join(self.directorio, 'precalculados', f"{tipo}.{extension}")
+
+    def _publicar(self, trabajo):
+        """Dejar el resultado de un trabajo programado como el precalculado de su tipo"""
+        tipo = trabajo['tipo']
+        generado = datetime.fromisoformat(trabajo['terminado'])
+        cron = self.programa.get(tipo)
+        vence = (cron.siguiente(generado) if cron else generado) + timedelta(seconds=CONFIG['gracia_s'])
+        try:
+            with open(self.ruta_resultado(trabajo), 'rb') as f:
+                datos = f.read()
+            _escribir(self._ruta_precalculado(tipo, trabajo['formato']), datos)
+            _escribir(self._ruta_precalculado(tipo, 'meta'), json.dumps(
+                {'id': trabajo['id'], 'formato': trabajo['formato'], 'generado': trabajo['terminado'],
+                 'vence': vence.isoformat(timespec='seconds')}).encode('utf-8'))
+        except OSError as e:
+            print(f"No se pudo publicar el precalculado de {tipo}: {e}")
+
+    def _leer_precalculado(self, tipo):
+        """(meta, datos) vigentes del tipo o None; el contenido se cachea por mtime del meta"""
+        ruta = self._ruta_precalculado(tipo, 'meta')
+        try:
+            mtime = os.stat(ruta).st_mtime_ns
+            cache = self._cache.get(tipo)
+            if cache is None or cache[0] != mtime:
+                with open(ruta, encoding='utf-8') as f:
+                    meta = json.load(f)
+                with open(self._ruta_precalculado(tipo, meta['formato']), 'rb') as f:
+                    cache = self._cache[tipo] = (mtime, meta, f.read())
+        except (OSError, ValueError, KeyError):
+            return None
+        return cache[1], cache[2]
+
+    def vigente(self, tipo):
+        """Meta del precalculado del tipo si todavía no venció"""
+        leido = self._leer_precalculado(tipo)
+        if leido and datetime.fromisoformat(leido[0]['vence']) > datetime.now():
+            return leido[0]
+        return None
+
+    def precalculado(self, tipo):
+        """Decorador de vistas GET: responder con el precalculado vigente del tipo, si hay"""
+        def decorador(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                # En el pool se está calculando justamente el precalculado
+                if _app is not None or not CONFIG['activos'] or tipo not in self.programa or \
+                        request.args.get('fresco') == '1' or any(k != 'fresco' for k in request.args):
+                    return f(*args, **kwargs)
+                leido = self._leer_precalculado(tipo)
+                if leido is None:
+                    PRECALCULADOS.incrementar(tipo, 'ausente')
+                    return f(*args, **kwargs)
+                meta, datos = leido
+                generado = datetime.fromisoformat(meta['generado'])
+                if datetime.fromisoformat(meta['vence']) <= datetime.now():
+                    PRECALCULADOS.incrementar(tipo, 'vencido')
+                    return f(*args, **kwargs)
+                PRECALCULADOS.incrementar(tipo, 'servido')
+                response = Response(datos, mimetype=FORMATOS[meta['formato']])
+                response.headers['X-Precalculado'] = meta['generado']
+                response.headers['Age'] = str(max(0, int((datetime.now() - generado).total_seconds())))
+                return response
+            return wrapper
+        return decorador
+
+    # ---------- programador ----------
+
+    def iniciar(self):
+        """Tomar el programador si ningún otro proceso lo tiene; devuelve True si quedó en este"""
+        if self._hilo:
+            return True
+        archivo = open(os.path.join(self.directorio, 'programador.lock'), 'a')
+        if fcntl:
+            try:
+                fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                archivo.close()
+                return False
+        self._archivo_lock = archivo
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._programar, name='trabajos-programador', daemon=True)
+        self._hilo.start()
+        return True
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout=5)
+            self._hilo = None
+        if self._archivo_lock:
+            self._archivo_lock.close()
+            self._archivo_lock = None
+        with self._lock:
+            if self._pool:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def proximas(self):
+        """{tipo: (expresión cron, próxima ejecución)}"""
+        ahora = datetime.now()
+        return {tipo: (cron.expresion, cron.siguiente(ahora)) for tipo, cron in self.programa.items()}
+
+    def _enviar_programado(self, tipo):
+        try:
+            self.enviar(tipo, origen='programado')
+        except Exception as e:
+            print(f"No se pudo programar el trabajo {tipo}: {e}")
+
+    def _programar(self):
+        # Al arrancar se calcula lo que no tenga un precalculado vigente (deploy, servidor apagado de noche)
+        for tipo in self.programa:
+            if self.vigente(tipo) is None:
+                self._enviar_programado(tipo)
+        proximas = {tipo: cron.siguiente(datetime.now()) for tipo, cron in self.programa.items()}
+        ultima_purga = 0
+        while not self._detener.is_set():
+            ahora = datetime.now()
+            for tipo, cuando in proximas.items():
+                if cuando <= ahora:
+                    self._enviar_programado(tipo)
+                    proximas[tipo] = self.programa[tipo].siguiente(ahora)
+            if time.monotonic() - ultima_purga >= CONFIG['purga_s']:
+                self.purgar()
+                ultima_purga = time.monotonic()
+            espera = min([CONFIG['revision_s']] + [(c - ahora).total_seconds() for c in proximas.values()])
+            self._detener.wait(max(1, espera))
+
+    def purgar(self):
+        """Borrar los trabajos terminados hace más de JOBS_RETENTION_HOURS; devuelve cuántos"""
+        limite = time.time() - CONFIG['retencion_h'] * 3600
+        borrados = 0
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            identificador = nombre.split('.', 1)[0]
+            if not _ID.match(identificador) or identificador in self._futuros:
+                continue
+            try:
+                if os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+                    borrados += nombre == f'{identificador}.json'
+            except OSError:
+                continue
+        return borrados
@@ -0,0 +1,169 @@
+"""
+Migraciones versionadas del esquema de InventarioDB.
+
+Cada migración tiene un número de versión y se aplica una sola vez, en orden y
+en su propia transacción; SchemaMigrations registra las aplicadas. Reemplaza
+los IF NOT EXISTS sueltos de los init_* de inventory_api.py: las versiones 1 a
+7 son esos mismos pasos (idempotentes, porque las bases anteriores a este
+registro ya los tienen) y las siguientes se escriben sin comprobaciones.
+
+Si dos procesos arrancan a la vez, el segundo falla al crear lo que el primero
+ya creó (o al registrar la misma versión), deshace y la encuentra aplicada.
+
+Para cambiar el esquema se agrega una entrada al final de MIGRACIONES con la
+versión siguiente; una migración ya publicada no se edita.
+"""
+import time
+
+import forecast
+import idempotency
+import ingest
+import rollups
+import snapshots
+import stock
+import sync
+
+SQL_CREAR_TABLA = """
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='SchemaMigrations' AND xtype='U')
+    CREATE TABLE SchemaMigrations (
+        version INT PRIMARY KEY,
+        nombre NVARCHAR(200) NOT NULL,
+        duracion_ms INT NOT NULL,
+        fecha_aplicada DATETIME DEFAULT GETDATE()
+    )
+"""
+
+SQL_USUARIOS = """
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='Usuarios' AND xtype='U')
+    CREATE TABLE Usuarios (
+        id INT IDENTITY(1,1) PRIMARY KEY,
+        username NVARCHAR(50) UNIQUE NOT NULL,
+        password_hash NVARCHAR(255) NOT NULL,
+        rol NVARCHAR(20) DEFAULT 'usuario',
+        activo BIT DEFAULT 1,
+        fecha_creacion DATETIME DEFAULT GETDATE()
+    )
+"""
+
+# Listados de productos: casi todas las consultas filtran activo = 1 y ordenan por
+# nombre (con o sin categoría). Los índices filtrados solo guardan los activos e
+# incluyen las columnas del listado (activo también: el listado la devuelve) para
+# no volver a la tabla; descripcion queda afuera (NVARCHAR(MAX)) y se busca solo
+# para las filas de la página.
+SQL_INDICES_ACTIVOS = [
+    """
+    CREATE NONCLUSTERED INDEX IX_Productos_Activos_Nombre ON Productos (nombre, id)
+        INCLUDE (codigo_sku, precio, cantidad_stock, stock_minimo, activo, categoria_id, proveedor_id, fecha_creacion)
+        WHERE activo = 1
+    """,
+    """
+    CREATE NONCLUSTERED INDEX IX_Productos_Activos_Categoria ON Productos (categoria_id, nombre, id)
+        INCLUDE (codigo_sku, precio, cantidad_stock, stock_minimo, activo, proveedor_id, fecha_creacion)
+        WHERE activo = 1
+    """,
+]
+
+# Stock bajo: cantidad_stock <= stock_minimo compara dos columnas, así que no sirve
+# como filtro de un índice ni para buscar en uno. La diferencia persistida sí:
+# deficit_stock >= 0 es "stock bajo" y el índice la devuelve ya ordenada. Va como
+# primera columna (y no activo) para que los listados no elijan este índice.
+SQL_DEFICIT = [
+    "ALTER TABLE Productos ADD deficit_stock AS (stock_minimo - cantidad_stock) PERSISTED",
+    """
+    CREATE NONCLUSTERED INDEX IX_Productos_Deficit ON Productos (deficit_stock)
+        INCLUDE (activo, nombre, codigo_sku, cantidad_stock, stock_minimo, categoria_id)
+    """,
+]
+
+
+def _resumen_diario(cursor):
+    """Crear MovimientosDiarios con el historial ya resumido: los reportes solo leen el resumen"""
+    rollups.crear_tabla(cursor)
+    rollups.completar_historial(cursor)
+
+
+def _permitir_snapshot(cursor):
+    """Intentar habilitar SNAPSHOT para las lecturas de contention.py (ALTER DATABASE no admite transacción)
+
+    Necesita permiso ALTER sobre la base, que el usuario de la aplicación no suele tener: sin él
+    la migración se registra igual y queda como paso del DBA (ver README). Al arrancar,
+    contention.verificar_snapshot consulta el estado real y, si está desactivado, las lecturas
+    van en READ COMMITTED.
+    """
+    conn = cursor.connection
+    conn.commit()
+    conn.autocommit = True
+    try:
+        cursor.execute("ALTER DATABASE CURRENT SET ALLOW_SNAPSHOT_ISOLATION ON")
+    except Exception as e:
+        print(f"[WARN] No se pudo habilitar ALLOW_SNAPSHOT_ISOLATION ({e}); "
+              "debe hacerlo un DBA: ALTER DATABASE InventarioDB SET ALLOW_SNAPSHOT_ISOLATION ON")
+    finally:
+        conn.autocommit = False
+
+
+# (versión, nombre, sentencias SQL o función que recibe el cursor)
+MIGRACIONES = [
+    (1, 'usuarios', [SQL_USUARIOS]),
+    (2, 'resumen_diario_movimientos', _resumen_diario),
+    (3, 'costo_unitario_movimientos', stock.crear_columnas),
+    (4, 'claves_idempotencia', [idempotency.SQL_CREAR_TABLA]),
+    (5, 'puntos_reorden', forecast.crear_tabla),
+    (6, 'version_fila_productos', sync.crear_columnas),
+    (7, 'fotos_stock', snapshots.crear_tabla),
+    (8, 'indices_productos_activos', SQL_INDICES_ACTIVOS),
+    (9, 'deficit_stock', SQL_DEFICIT),
+    (10, 'aislamiento_snapshot', _permitir_snapshot),
+    # Bases que aplicaron la versión 2 cuando solo creaba la tabla vacía
+    (11, 'historial_resumen_diario', rollups.completar_historial),
+    # Antes la creaba ingest.py al reproducir el diario: conserva el IF NOT EXISTS
+    (12, 'checkpoint_ingesta', [ingest.SQL_CREAR_TABLA]),
+]
+
+# Último paso de los init_* anteriores al registro de migraciones
+VERSION_BASE = 7
+
+
+def crear_tabla(cursor):
+    """Crear la tabla de migraciones aplicadas si no existe"""
+    cursor.execute(SQL_CREAR_TABLA)
+
+
+def aplicadas(cursor):
+    """Versiones ya registradas en SchemaMigrations"""
+    cursor.execute("SELECT version FROM SchemaMigrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _ejecutar(cursor, pasos):
+    if callable(pasos):
+        pasos(cursor)
+        return
+    for sql in pasos:
+        cursor.execute(sql)
+
+
+def migrar(conn, hasta=None):
+    """Aplicar las migraciones pendientes (hasta una versión, si se indica); devuelve las aplicadas"""
+    cursor = conn.cursor()
+    crear_tabla(cursor)
+    conn.commit()
+    hechas = aplicadas(cursor)
+    nuevas = []
+    for version, nombre, pasos in MIGRACIONES:
+        if version in hechas or (hasta is not None and version > hasta):
+            continue
+        inicio = time.perf_counter()
+        try:
+            _ejecutar(cursor, pasos)
+            cursor.execute("INSERT INTO SchemaMigrations (version, nombre, duracion_ms) VALUES (?, ?, ?)",
+                           version, nombre, int((time.perf_counter() - inicio) * 1000))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if version in aplicadas(cursor):
+                continue  # La aplicó otro proceso mientras tanto
+            raise
+        print(f"[OK] Migración {version:03d} {nombre} aplicada")
+        nuevas.append(version)
+    return nuevas
@@ -0,0 +1,355 @@
+"""
+Perfilado bajo demanda de un worker en producción.
+
+Cuando un worker se pone caliente no hace falta reiniciarlo bajo un profiler:
+un administrador abre una sesión de perfilado por un rato y este módulo
+
+- corre cProfile sobre un porcentaje de las peticiones, o solo sobre las de un
+  endpoint, y acumula las estadísticas (pstats) de todas las muestreadas;
+- opcionalmente arranca tracemalloc y compara snapshots contra el del inicio
+  para mostrar dónde crece la memoria;
+- deja descargar lo acumulado: un .prof para snakeviz / pstats o el snapshot
+  de tracemalloc.
+
+Sin sesión activa los hooks no están registrados en la app: el costo es cero.
+El estado es del proceso que atiende la petición; con varios workers cada uno
+se perfila por separado.
+
+Endpoints (solo administradores):
+    POST   /admin/perfilado            {"porcentaje", "endpoint"?, "duracion_s"?, "memoria"?}
+    GET    /admin/perfilado            estado y funciones/asignaciones más costosas
+    DELETE /admin/perfilado            terminar la sesión (se conservan los resultados)
+    GET    /admin/perfilado/descarga   ?tipo=cpu (.prof) | texto | memoria (snapshot de tracemalloc)
+
+Configuración (variables de entorno):
+    PROFILING_ADMIN_TOKEN     token del header X-Admin-Token que habilita los endpoints (vacío = solo
+                              la verificación propia de la app, si la hay)
+    PROFILING_MAX_SECONDS     duración máxima de una sesión (600)
+    PROFILING_TRACE_FRAMES    frames guardados por asignación en tracemalloc (10)
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from flask import Response, g, jsonify, request
+
+CONFIG = {
+    'token': os.environ.get('PROFILING_ADMIN_TOKEN', ''),
+    'max_duracion_s': float(os.environ.get('PROFILING_MAX_SECONDS', 600)),
+    'frames': int(os.environ.get('PROFILING_TRACE_FRAMES', 10)),
+}
+
+DURACION_POR_DEFECTO = 60
+TOP = 25
+
+# Endpoints que nunca se perfilan
+_EXENTOS = {'estado_perfilado', 'iniciar_perfilado', 'detener_perfilado', 'descargar_perfilado', 'metrics',
+            'static'}
+
+
+class SesionPerfilado:
+    """Una ventana de muestreo: qué peticiones perfilar y lo acumulado"""
+
+    def __init__(self, porcentaje, endpoint, duracion_s, memoria):
+        self.porcentaje = porcentaje
+        self.endpoint = endpoint
+        self.duracion_s = duracion_s
+        self.memoria = memoria
+        self.inicio = time.time()
+        self.fin = self.inicio + duracion_s
+        self.activa = True
+        self.muestreadas = 0
+        self.omitidas = 0  # Elegidas pero con otra petición ya bajo cProfile
+        self.segundos_perfilados = 0.0
+        self.estadisticas = None
+        self.snapshot_inicial = None
+        self.snapshot_final = None
+        self.tracemalloc_propio = False  # Si ya estaba activo (PYTHONTRACEMALLOC) no se detiene al terminar
+
+    def elegir(self, endpoint):
+        if self.endpoint and endpoint != self.endpoint:
+            return False
+        return random.random() * 100 < self.porcentaje
+
+    def resumen(self):
+        return {
+            'activa': self.activa,
+            'porcentaje': self.porcentaje,
+            'endpoint': self.endpoint,
+            'memoria': self.memoria,
+            'inicio': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.inicio)),
+            'restante_s': round(max(0.0, self.fin - time.time()), 1) if self.activa else 0,
+            'peticiones_muestreadas': self.muestreadas,
+            'peticiones_omitidas': self.omitidas,
+            'segundos_perfilados': round(self.segundos_perfilados, 3),
+        }
+
+
+class Perfilador:
+    """Hooks de cProfile y tracemalloc que se instalan en la app solo mientras hay una sesión"""
+
+    def __init__(self, app):
+        self.app = app
+        self.sesion = None
+        self._lock = threading.Lock()
+        self._cpu = threading.Lock()  # cProfile: una petición a la vez (3.12+ no admite perfiles simultáneos)
+        self._temporizador = None
+        self._teardown_instalado = False
+
+    # ---------- hooks ----------
+
+    def _antes(self):
+        sesion = self.sesion
+        if sesion is None or not sesion.activa or request.endpoint in _EXENTOS \
+                or not sesion.elegir(request.endpoint):
+            return None
+        if not self._cpu.acquire(blocking=False):
+            sesion.omitidas += 1
+            return None
+        perfil = cProfile.Profile()
+        g._perfil = (sesion, perfil, time.perf_counter())
+        perfil.enable()
+        return None
+
+    def _despues(self, error=None):
+        datos = g.pop('_perfil', None)
+        if datos is None:
+            return
+        sesion, perfil, inicio = datos
+        perfil.disable()
+        self._cpu.release()
+        with self._lock:
+            sesion.muestreadas += 1
+            sesion.segundos_perfilados += time.perf_counter() - inicio
+            if sesion.estadisticas is None:
+                sesion.estadisticas = pstats.Stats(perfil)
+            else:
+                sesion.estadisticas.add(perfil)
+            if self.sesion is None or not self.sesion.activa:
+                self._quitar_teardown()
+
+    def _instalar(self):
+        # Se reemplazan las listas en lugar de mutarlas: otras peticiones pueden estar recorriéndolas
+        antes = self.app.before_request_funcs.get(None, [])
+        self.app.before_request_funcs[None] = antes + [self._antes]
+        if not self._teardown_instalado:
+            despues = self.app.teardown_request_funcs.get(None, [])
+            self.app.teardown_request_funcs[None] = despues + [self._despues]
+            self._teardown_instalado = True
+
+    def _quitar_antes(self):
+        antes = self.app.before_request_funcs.get(None, [])
+        self.app.before_request_funcs[None] = [f for f in antes if f != self._antes]
+
+    def _quitar_teardown(self):
+        despues = self.app.teardown_request_funcs.get(None, [])
+        self.app.teardown_request_funcs[None] = [f for f in despues if f != self._despues]
+        self._teardown_instalado = False
+
+    # ---------- sesión ----------
+
+    def iniciar(self, porcentaje, endpoint=None, duracion_s=DURACION_POR_DEFECTO, memoria=False):
+        with self._lock:
+            if self.sesion and self.sesion.activa:
+                raise RuntimeError('Ya hay una sesión de perfilado activa')
+            sesion = SesionPerfilado(porcentaje, endpoint, duracion_s, memoria)
+            if memoria:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(CONFIG['frames'])
+                    sesion.tracemalloc_propio = True
+                sesion.snapshot_inicial = tracemalloc.take_snapshot()
+            self.sesion = sesion
+            self._instalar()
+            self._temporizador = threading.Timer(duracion_s, self.detener)
+            self._temporizador.daemon = True
+            self._temporizador.start()
+        print(f"Perfilado iniciado: {porcentaje}% de {endpoint or 'todas las peticiones'} por {duracion_s} s"
+              f"{' con tracemalloc' if memoria else ''}")
+        return sesion
+
+    def detener(self):
+        with self._lock:
+            sesion = self.sesion
+            if sesion is None or not sesion.activa:
+                return sesion
+            sesion.activa = False
+            sesion.fin = time.time()
+            self._quitar_antes()
+            # El teardown sigue hasta que termine la petición que esté bajo cProfile
+            if not self._cpu.locked():
+                self._quitar_teardown()
+            if sesion.memoria and tracemalloc.is_tracing():
+                sesion.snapshot_final = tracemalloc.take_snapshot()
+                if sesion.tracemalloc_propio:
+                    tracemalloc.stop()
+            if self._temporizador:
+                self._temporizador.cancel()
+                self._temporizador = None
+        print(f"Perfilado terminado: {sesion.muestreadas} peticiones muestreadas")
+        return sesion
+
+    # ---------- resultados ----------
+
+    def funciones(self, orden='cumulative', top=TOP):
+        """Funciones más costosas de lo acumulado"""
+        sesion = self.sesion
+        if sesion is None or sesion.estadisticas is None:
+            return []
+        with self._lock:
+            stats = sesion.estadisticas
+            filas = sorted(stats.stats.items(), key=lambda item: item[1][3 if orden == 'cumulative' else 2],
+                           reverse=True)[:top]
+        return [{'funcion': f"{archivo}:{linea}({nombre})", 'llamadas': llamadas,
+                 'tiempo_propio_s': round(propio, 6), 'tiempo_acumulado_s': round(acumulado, 6)}
+                for (archivo, linea, nombre), (_, llamadas, propio, acumulado, _) in filas]
+
+    def _snapshot_actual(self):
+        sesion = self.sesion
+        if sesion is None or not sesion.memoria:
+            return None
+        if sesion.snapshot_final is not None:
+            return sesion.snapshot_final
+        return tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+    def asignaciones(self, top=TOP):
+        """Líneas que más memoria sumaron desde el inicio de la sesión"""
+        snapshot = self._snapshot_actual()
+        if snapshot is None:
+            return []
+        diferencias = snapshot.compare_to(self.sesion.snapshot_inicial, 'lineno')[:top]
+        return [{'linea': str(d.traceback), 'kb': round(d.size / 1024, 1),
+                 'kb_diferencia': round(d.size_diff / 1024, 1), 'bloques': d.count,
+                 'bloques_diferencia': d.count_diff} for d in diferencias]
+
+    def texto(self, orden='cumulative'):
+        salida = io.StringIO()
+        sesion = self.sesion
+        if sesion is not None and sesion.estadisticas is not None:
+            with self._lock:
+                sesion.estadisticas.stream = salida
+                sesion.estadisticas.sort_stats(orden).print_stats(100)
+        return salida.getvalue()
+
+    def volcar(self, tipo):
+        """Bytes del archivo descargable: estadísticas de cProfile o snapshot de tracemalloc"""
+        if tipo == 'memoria':
+            snapshot = self._snapshot_actual()
+            if snapshot is None:
+                return None
+            volcar = snapshot.dump
+        else:
+            sesion = self.sesion
+            if sesion is None or sesion.estadisticas is None:
+                return None
+            volcar = sesion.estadisticas.dump_stats
+        descriptor, ruta = tempfile.mkstemp(suffix='.perfil')
+        os.close(descriptor)
+        try:
+            with self._lock:
+                volcar(ruta)
+            with open(ruta, 'rb') as f:
+                return f.read()
+        finally:
+            os.remove(ruta)
+
+    def resumen(self):
+        sesion = self.sesion
+        if sesion is None:
+            return {'activa': False}
+        estado = sesion.resumen()
+        estado['funciones'] = self.funciones()
+        if sesion.memoria:
+            estado['asignaciones'] = self.asignaciones()
+        return estado
+
+
+def _token_valido():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(CONFIG['token']) and hmac.compare_digest(token, CONFIG['token'])
+
+
+def configurar_perfilado(app, es_admin=None):
+    """Registrar los endpoints /admin/perfilado en una app Flask
+
+    es_admin: función sin argumentos que decide si la petición es de un administrador,
+    además del header X-Admin-Token contra PROFILING_ADMIN_TOKEN.
+    """
+    perfilador = Perfilador(app)
+
+    def _autorizado():
+        return _token_valido() or bool(es_admin and es_admin())
+
+    def _denegado():
+        return jsonify({'error': 'Se requiere un administrador para perfilar el servidor'}), 403
+
+    @app.route('/admin/perfilado', methods=['POST'])
+    def iniciar_perfilado():
+        """Abrir una sesión de perfilado en este worker"""
+        if not _autorizado():
+            return _denegado()
+        data = request.get_json(silent=True) or {}
+        try:
+            porcentaje = float(data.get('porcentaje', 100 if data.get('endpoint') else 10))
+            duracion = float(data.get('duracion_s', DURACION_POR_DEFECTO))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'porcentaje y duracion_s deben ser números'}), 400
+        if not 0 < porcentaje <= 100:
+            return jsonify({'error': 'porcentaje debe estar entre 0 y 100'}), 400
+        if not 0 < duracion <= CONFIG['max_duracion_s']:
+            return jsonify({'error': f"duracion_s debe estar entre 0 y {CONFIG['max_duracion_s']:g}"}), 400
+        endpoint = data.get('endpoint') or None
+        if endpoint and endpoint not in app.view_functions:
+            return jsonify({'error': f'Endpoint desconocido: {endpoint}'}), 400
+        try:
+            sesion = perfilador.iniciar(porcentaje, endpoint, duracion, bool(data.get('memoria')))
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 409
+        return jsonify(sesion.resumen()), 201
+
+    @app.route('/admin/perfilado', methods=['GET'])
+    def estado_perfilado():
+        """Estado de la sesión y lo más costoso acumulado"""
+        if not _autorizado():
+            return _denegado()
+        return jsonify(perfilador.resumen())
+
+    @app.route('/admin/perfilado', methods=['DELETE'])
+    def detener_perfilado():
+        """Terminar la sesión antes de tiempo"""
+        if not _autorizado():
+            return _denegado()
+        sesion = perfilador.detener()
+        if sesion is None:
+            return jsonify({'error': 'No hay sesión de perfilado'}), 404
+        return jsonify(perfilador.resumen())
+
+    @app.route('/admin/perfilado/descarga', methods=['GET'])
+    def descargar_perfilado():
+        """Descargar lo acumulado: .prof de cProfile, su texto o el snapshot de tracemalloc"""
+        if not _autorizado():
+            return _denegado()
+        tipo = request.args.get('tipo', 'cpu')
+        marca = time.strftime('%Y%m%d-%H%M%S')
+        if tipo == 'texto':
+            contenido, nombre, mimetype = perfilador.texto(request.args.get('orden', 'cumulative')), \
+                f'perfil-{marca}.txt', 'text/plain'
+        elif tipo in ('cpu', 'memoria'):
+            contenido = perfilador.volcar(tipo)
+            nombre = f"perfil-{marca}.prof" if tipo == 'cpu' else f"memoria-{marca}.tracemalloc"
+            mimetype = 'application/octet-stream'
+        else:
+            return jsonify({'error': 'tipo debe ser cpu, texto o memoria'}), 400
+        if not contenido:
+            return jsonify({'error': 'No hay datos de perfilado para descargar'}), 404
+        response = Response(contenido, mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{nombre}"'
+        return response
+
+    return perfilador
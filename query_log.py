@@ -0,0 +1,161 @@
+"""
+Registro de consultas lentas y detector de consultas redundantes / N+1.
+
+Se apoya en el cursor instrumentado de instrumentation.py: cada sentencia
+que supera el umbral se escribe con sus parámetros y su duración, y al final
+de cada petición se marcan las sentencias idénticas repetidas, las que se
+ejecutan muchas veces con distintos parámetros (patrón N+1), las lecturas
+cuyo resultado ya se conocía (releer la fila recién escrita, o un COUNT de
+existencia seguido de una escritura sobre la misma clave) y las peticiones
+que superan el presupuesto de consultas.
+
+La salida es un log rotativo con una línea JSON por evento.
+
+Configuración (variables de entorno):
+    SLOW_QUERY_MS        umbral de consulta lenta en milisegundos (200)
+    QUERY_BUDGET         máximo de sentencias por petición (10)
+    QUERY_N1_THRESHOLD   repeticiones de la misma sentencia para sospechar N+1 (5)
+    QUERY_LOG_PATH       archivo de log (logs/consultas.log)
+"""
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import g, has_request_context, request
+
+from instrumentation import observadores_consulta
+
+CONFIG = {
+    'umbral_lenta_ms': float(os.environ.get('SLOW_QUERY_MS', 200)),
+    'presupuesto': int(os.environ.get('QUERY_BUDGET', 10)),
+    'umbral_n1': int(os.environ.get('QUERY_N1_THRESHOLD', 5)),
+    'ruta': os.environ.get('QUERY_LOG_PATH', os.path.join('logs', 'consultas.log')),
+    'max_bytes': 10 * 1024 * 1024,
+    'respaldos': 5,
+}
+
+logger = logging.getLogger('consultas')
+
+_ESPACIOS = re.compile(r'\s+')
+
+
+def _normalizar(sql):
+    """Colapsar espacios para agrupar la misma sentencia escrita en varias líneas"""
+    return _ESPACIOS.sub(' ', sql).strip()
+
+
+def _params_serializables(params, limite=20):
+    """Parámetros como lista JSON, recortando lotes y textos largos"""
+    valores = []
+    for valor in list(params)[:limite]:
+        if isinstance(valor, (list, tuple)):
+            valor = _params_serializables(valor, limite=5)
+        elif isinstance(valor, str) and len(valor) > 200:
+            valor = valor[:200] + '...'
+        elif not isinstance(valor, (int, float, bool, type(None), str, list)):
+            valor = str(valor)
+        valores.append(valor)
+    return valores
+
+
+def _escribir(evento, **datos):
+    registro = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'evento': evento}
+    if has_request_context():
+        registro['endpoint'] = request.endpoint
+        registro['metodo'] = request.method
+        registro['ruta'] = request.path
+    registro.update(datos)
+    logger.warning(json.dumps(registro, ensure_ascii=False, default=str))
+
+
+def _observar(sql, params, duracion, error):
+    """Observador del cursor: consultas lentas y acumulado por petición"""
+    duracion_ms = duracion * 1000
+    if duracion_ms >= CONFIG['umbral_lenta_ms']:
+        _escribir('consulta_lenta', sql=_normalizar(sql), params=_params_serializables(params),
+                  duracion_ms=round(duracion_ms, 3), error=str(error) if error else None)
+
+    if has_request_context():
+        sentencias = g.get('_sentencias_sql')
+        if sentencias is None:
+            sentencias = g._sentencias_sql = []
+        valores = _params_serializables(params)
+        sentencias.append((_normalizar(sql), json.dumps(valores, default=str), duracion_ms, valores))
+
+
+def _es_escritura(sql):
+    return sql.split(' ', 1)[0].upper() in ('INSERT', 'UPDATE', 'DELETE', 'MERGE')
+
+
+def _contenidos(pequenos, grandes):
+    """True si todos los parámetros escalares de pequenos aparecen en grandes"""
+    escalares = [v for v in pequenos if not isinstance(v, list)]
+    return bool(escalares) and all(v in grandes for v in escalares)
+
+
+def _detectar_lecturas_predecibles(sentencias):
+    """Lecturas cuyos parámetros ya estaban en una escritura de la misma petición"""
+    for i, (sql, _, _, valores) in enumerate(sentencias):
+        if _es_escritura(sql) or not sql.upper().startswith('SELECT'):
+            continue
+        anteriores = [s for s in sentencias[:i] if _es_escritura(s[0]) and _contenidos(valores, s[3])]
+        if anteriores:
+            _escribir('relectura_tras_escritura', sql=sql, params=valores, escritura=anteriores[-1][0])
+            continue
+        if 'COUNT(' in sql.upper():
+            posteriores = [s for s in sentencias[i + 1:] if _es_escritura(s[0]) and _contenidos(valores, s[3])]
+            if posteriores:
+                _escribir('verificacion_previa', sql=sql, params=valores, escritura=posteriores[0][0])
+
+
+def _analizar_peticion(response):
+    """Marcar sentencias repetidas, patrones N+1 y presupuesto excedido"""
+    sentencias = g.pop('_sentencias_sql', None)
+    if not sentencias:
+        return response
+
+    por_sentencia = {}
+    for sql, params, duracion_ms, _ in sentencias:
+        datos = por_sentencia.setdefault(sql, {'total': 0, 'params': {}, 'duracion_ms': 0.0})
+        datos['total'] += 1
+        datos['params'][params] = datos['params'].get(params, 0) + 1
+        datos['duracion_ms'] += duracion_ms
+
+    for sql, datos in por_sentencia.items():
+        repetidas = {p: n for p, n in datos['params'].items() if n > 1}
+        if repetidas:
+            _escribir('consulta_repetida', sql=sql,
+                      repeticiones=[{'params': json.loads(p), 'veces': n} for p, n in repetidas.items()])
+        if len(datos['params']) >= CONFIG['umbral_n1']:
+            _escribir('posible_n_mas_1', sql=sql, ejecuciones=datos['total'],
+                      params_distintos=len(datos['params']), duracion_ms=round(datos['duracion_ms'], 3))
+
+    _detectar_lecturas_predecibles(sentencias)
+
+    if len(sentencias) > CONFIG['presupuesto']:
+        _escribir('presupuesto_excedido', sentencias=len(sentencias), presupuesto=CONFIG['presupuesto'],
+                  estado=response.status_code,
+                  resumen=[{'sql': sql, 'veces': datos['total']} for sql, datos in por_sentencia.items()])
+    return response
+
+
+def configurar_registro_consultas(app):
+    """Activar el log rotativo y el análisis por petición en una app Flask"""
+    if not logger.handlers:
+        directorio = os.path.dirname(CONFIG['ruta'])
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        handler = RotatingFileHandler(CONFIG['ruta'], maxBytes=CONFIG['max_bytes'],
+                                      backupCount=CONFIG['respaldos'], encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    if _observar not in observadores_consulta:
+        observadores_consulta.append(_observar)
+    app.after_request(_analizar_peticion)
+    return app
@@ -0,0 +1,181 @@
+"""
+Control de admisión para los endpoints caros.
+
+- Token bucket por usuario (o IP si la petición no trae token) y por endpoint:
+  cada grupo de endpoints tiene una capacidad de ráfaga y una reposición por
+  minuto. Sin fichas se responde 429 con Retry-After.
+- Tope global de peticiones pesadas simultáneas (reportes y listados
+  completos) por proceso: si está lleno se responde 503 con Retry-After en
+  lugar de encolar la petición hasta que venza el timeout.
+
+El estado de los buckets vive en memoria del proceso; con RATE_LIMIT_STORE
+apuntando a un archivo se comparte entre workers en una base SQLite local.
+
+Configuración (variables de entorno):
+    RATE_LIMIT_ENABLED      0 para desactivar el control (1)
+    RATE_LIMIT_STORE        archivo SQLite compartido entre workers (vacío = memoria)
+    RATE_LIMIT_<GRUPO>      capacidad/por_minuto de un grupo, p. ej. RATE_LIMIT_REPORTES=10/30
+    HEAVY_MAX_CONCURRENT    peticiones pesadas simultáneas por proceso (4)
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify, request
+
+from instrumentation import Contador, registrar_metrica
+
+# grupo -> capacidad (ráfaga), fichas repuestas por minuto y si cuenta para el tope de pesadas
+GRUPOS = {
+    'reportes': {'capacidad': 10, 'por_minuto': 30, 'pesado': True},
+    'completos': {'capacidad': 5, 'por_minuto': 12, 'pesado': True},
+    'listados': {'capacidad': 60, 'por_minuto': 600, 'pesado': False},
+    # Encolar un reporte es barato; la cuota evita llenar el pool de trabajos
+    'trabajos': {'capacidad': 10, 'por_minuto': 30, 'pesado': False},
+}
+
+for _grupo, _limites in GRUPOS.items():
+    _valor = os.environ.get(f'RATE_LIMIT_{_grupo.upper()}')
+    if _valor:
+        _capacidad, _, _por_minuto = _valor.partition('/')
+        _limites['capacidad'] = int(_capacidad)
+        _limites['por_minuto'] = float(_por_minuto or _capacidad)
+
+CONFIG = {
+    'activo': os.environ.get('RATE_LIMIT_ENABLED', '1') == '1',
+    'almacen': os.environ.get('RATE_LIMIT_STORE', ''),
+    'max_pesadas': int(os.environ.get('HEAVY_MAX_CONCURRENT', 4)),
+}
+
+RECHAZOS = registrar_metrica(Contador('rate_limit_rejections_total',
+                                      'Peticiones rechazadas por el control de admisión', ('grupo', 'motivo')))
+
+
+# ==================== ALMACENES DE BUCKETS ====================
+
+def _reponer(tokens, ultimo, ahora, capacidad, por_segundo):
+    return min(capacidad, tokens + (ahora - ultimo) * por_segundo)
+
+
+class BucketsMemoria:
+    """Buckets en un dict del proceso"""
+
+    def __init__(self, max_claves=50000):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.max_claves = max_claves
+
+    def consumir(self, clave, capacidad, por_segundo):
+        """Tomar una ficha; devuelve 0 si se pudo o los segundos hasta la próxima"""
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, ultimo = self._buckets.get(clave, (capacidad, ahora))
+            tokens = _reponer(tokens, ultimo, ahora, capacidad, por_segundo)
+            if tokens >= 1:
+                self._buckets[clave] = (tokens - 1, ahora)
+                espera = 0
+            else:
+                self._buckets[clave] = (tokens, ahora)
+                espera = (1 - tokens) / por_segundo
+            if len(self._buckets) > self.max_claves:
+                self._buckets.pop(next(iter(self._buckets)))
+            return espera
+
+
+class BucketsSQLite:
+    """Buckets en una base SQLite local, compartidos por todos los workers de la máquina"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._consumos = 0
+        conn = self._conexion()
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (clave TEXT PRIMARY KEY, tokens REAL, ultimo REAL)")
+
+    def _conexion(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directorio = os.path.dirname(self.ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            conn = sqlite3.connect(self.ruta, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # Perder fichas en un corte no importa
+            self._local.conn = conn
+        return conn
+
+    def consumir(self, clave, capacidad, por_segundo):
+        """Tomar una ficha; devuelve 0 si se pudo o los segundos hasta la próxima"""
+        ahora = time.time()  # Reloj de pared: lo comparten procesos distintos
+        conn = self._conexion()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fila = conn.execute("SELECT tokens, ultimo FROM buckets WHERE clave = ?", (clave,)).fetchone()
+            tokens = _reponer(*fila, ahora, capacidad, por_segundo) if fila else capacidad
+            espera = 0 if tokens >= 1 else (1 - tokens) / por_segundo
+            conn.execute("INSERT OR REPLACE INTO buckets (clave, tokens, ultimo) VALUES (?, ?, ?)",
+                         (clave, tokens - 1 if tokens >= 1 else tokens, ahora))
+            self._consumos += 1
+            if self._consumos % 1000 == 0:
+                # Un bucket sin uso por una hora ya está lleno: se puede olvidar
+                conn.execute("DELETE FROM buckets WHERE ultimo < ?", (ahora - 3600,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return espera
+
+
+# ==================== LIMITADOR ====================
+
+class Limitador:
+    """Decorador de rutas con token bucket por usuario y endpoint y tope de pesadas simultáneas"""
+
+    def __init__(self, identificar, almacen=None, max_pesadas=None):
+        self.identificar = identificar
+        ruta = almacen if almacen is not None else CONFIG['almacen']
+        self.buckets = BucketsSQLite(ruta) if ruta else BucketsMemoria()
+        self.max_pesadas = max_pesadas or CONFIG['max_pesadas']
+        self._pesadas = threading.BoundedSemaphore(self.max_pesadas)
+        self._duracion_pesada = 1.0  # Promedio móvil en segundos, para estimar Retry-After
+
+    def _rechazar(self, grupo, motivo, estado, mensaje, espera):
+        RECHAZOS.incrementar(grupo, motivo)
+        response = jsonify({"error": mensaje, "reintentar_en": math.ceil(espera)})
+        response.headers['Retry-After'] = str(max(1, math.ceil(espera)))
+        return response, estado
+
+    def limitar(self, grupo):
+        """grupo: nombre en GRUPOS o función sin argumentos que lo elige según la petición"""
+        def decorador(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if not CONFIG['activo']:
+                    return f(*args, **kwargs)
+                nombre = grupo() if callable(grupo) else grupo
+                limites = GRUPOS[nombre]
+
+                pesada = limites['pesado']
+                if pesada and not self._pesadas.acquire(blocking=False):
+                    return self._rechazar(nombre, 'concurrencia', 503,
+                                          'Servidor ocupado con otras consultas pesadas', self._duracion_pesada)
+                try:
+                    clave = f"{self.identificar()}|{request.endpoint}|{nombre}"
+                    espera = self.buckets.consumir(clave, limites['capacidad'], limites['por_minuto'] / 60)
+                    if espera:
+                        return self._rechazar(nombre, 'cuota', 429, 'Demasiadas peticiones', espera)
+                    inicio = time.perf_counter()
+                    try:
+                        return f(*args, **kwargs)
+                    finally:
+                        if pesada:
+                            self._duracion_pesada = 0.8 * self._duracion_pesada + \
+                                0.2 * (time.perf_counter() - inicio)
+                finally:
+                    if pesada:
+                        self._pesadas.release()
+            return wrapper
+        return decorador
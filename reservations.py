@@ -0,0 +1,392 @@
+"""
+Reservas de stock con vencimiento, en memoria.
+
+Mientras un cliente termina la compra su mercadería queda apartada sin tocar
+la base: la reserva vive en memoria y el disponible de un producto es
+cantidad_stock - reservado. Solo la confirmación escribe, como una SALIDA por
+el mismo camino que POST /movimientos; liberar o dejar vencer una reserva no
+deja rastro en MovimientosStock.
+
+- Los vencimientos se llevan en una rueda de temporizadores (ranuras de un
+  segundo): programar y cancelar son O(1) y un hilo avanza la rueda cada tick.
+- Cada operación se escribe (con fsync) en un diario local antes de
+  responder. Al arrancar se reproduce el diario: las reservas que vencieron
+  con el proceso caído se descartan y el resto vuelve a la rueda. El diario se
+  reescribe solo con las activas al arrancar y cada tanto.
+- Una confirmación queda marcada en el diario antes de escribir el
+  movimiento; si el proceso cae en el medio, al arrancar se verifica en la base
+  si el movimiento llegó a grabarse.
+
+El diario se bloquea por proceso: con varios workers las reservas las atiende
+el primero que lo abre y los demás responden 503.
+
+Configuración (variables de entorno):
+    RESERVATIONS_ENABLED       0 para desactivar las reservas (1)
+    RESERVATIONS_JOURNAL_PATH  diario local (reservas/reservas.jsonl)
+    RESERVATION_TTL_SECONDS    vencimiento por defecto (900)
+    RESERVATION_MAX_TTL_SECONDS  vencimiento máximo que se puede pedir (3600)
+"""
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo del diario entre procesos
+    fcntl = None
+
+CONFIG = {
+    'activas': os.environ.get('RESERVATIONS_ENABLED', '1') == '1',
+    'ruta': os.environ.get('RESERVATIONS_JOURNAL_PATH', os.path.join('reservas', 'reservas.jsonl')),
+    'ttl_s': int(os.environ.get('RESERVATION_TTL_SECONDS', 900)),
+    'ttl_max_s': int(os.environ.get('RESERVATION_MAX_TTL_SECONDS', 3600)),
+    'operaciones_por_compactacion': 50000,
+    'terminadas_recordadas': 10000,
+}
+
+ACTIVA, CONFIRMANDO = 'activa', 'confirmando'
+CONFIRMADA, LIBERADA, VENCIDA = 'confirmada', 'liberada', 'vencida'
+
+
+class DiarioOcupado(Exception):
+    """Otro proceso ya tiene abierto el diario de reservas"""
+
+
+class ReservaInexistente(Exception):
+    """No hay una reserva activa con ese id"""
+
+
+class ReservaEnCurso(Exception):
+    """La reserva se está confirmando en otra petición"""
+
+
+class StockInsuficiente(Exception):
+    """No alcanza el disponible para reservar"""
+
+    def __init__(self, disponible):
+        super().__init__('Stock insuficiente')
+        self.disponible = disponible
+
+
+def _iso(instante):
+    return datetime.fromtimestamp(instante).isoformat()
+
+
+# ==================== RUEDA DE TEMPORIZADORES ====================
+
+class RuedaTemporizadores:
+    """Rueda de temporizadores con ranuras de `tick` segundos; programar y cancelar son O(1)
+
+    Un vencimiento más lejano que una vuelta entera queda en su ranura y se
+    revisa en cada vuelta hasta que le llega el momento.
+    """
+
+    def __init__(self, ranuras=4096, tick=1.0):
+        self.tick = tick
+        self._ranuras = [{} for _ in range(ranuras)]  # clave -> instante de vencimiento
+        self._ubicacion = {}                          # clave -> índice de ranura
+        self._actual = int(time.time() // tick)       # último tick procesado
+
+    def __len__(self):
+        return len(self._ubicacion)
+
+    def programar(self, clave, vence):
+        self.cancelar(clave)
+        # La ranura del primer tick en o después del vencimiento; lo ya vencido va a la
+        # siguiente porque las anteriores ya se procesaron
+        tick = max(math.ceil(vence / self.tick), self._actual + 1)
+        indice = tick % len(self._ranuras)
+        self._ranuras[indice][clave] = vence
+        self._ubicacion[clave] = indice
+
+    def cancelar(self, clave):
+        indice = self._ubicacion.pop(clave, None)
+        if indice is not None:
+            del self._ranuras[indice][clave]
+
+    def avanzar(self, ahora):
+        """Quitar y devolver las claves vencidas hasta `ahora`"""
+        objetivo = int(ahora // self.tick)
+        # Tras una pausa de más de una vuelta alcanza con recorrer cada ranura una vez
+        desde = max(self._actual + 1, objetivo - len(self._ranuras) + 1)
+        vencidas = []
+        for tick in range(desde, objetivo + 1):
+            ranura = self._ranuras[tick % len(self._ranuras)]
+            if not ranura:
+                continue
+            for clave, vence in list(ranura.items()):
+                if vence <= ahora:
+                    del ranura[clave]
+                    del self._ubicacion[clave]
+                    vencidas.append(clave)
+        self._actual = max(self._actual, objetivo)
+        return vencidas
+
+
+# ==================== RESERVAS ====================
+
+class Reservas:
+    """Reservas activas en memoria, diario durable y vencimiento por rueda de temporizadores"""
+
+    def __init__(self, ruta=None, ttl_s=None, ttl_max_s=None):
+        self.ruta = ruta or CONFIG['ruta']
+        self.ttl_s = ttl_s or CONFIG['ttl_s']
+        self.ttl_max_s = ttl_max_s or CONFIG['ttl_max_s']
+        self._activas = {}                 # id -> reserva
+        self._reservado = {}               # producto_id -> unidades reservadas
+        self._terminadas = OrderedDict()   # id -> reserva ya cerrada, para consultar cómo terminó
+        self._rueda = RuedaTemporizadores()
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        self._candado = None
+        self._diario = None
+        self._operaciones = 0
+        self.vencidas = 0
+
+    # ---------- diario ----------
+
+    def _bloquear(self):
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        # El candado va en un archivo aparte porque el diario se reemplaza al compactar
+        self._candado = open(self.ruta + '.lock', 'a')
+        if fcntl:
+            try:
+                fcntl.flock(self._candado.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._candado.close()
+                self._candado = None
+                raise DiarioOcupado(self.ruta)
+
+    def _escribir(self, entrada):
+        """Agregar una operación al diario con fsync (con el lock tomado)"""
+        self._diario.write((json.dumps(entrada, ensure_ascii=False) + '\n').encode('utf-8'))
+        self._diario.flush()
+        os.fsync(self._diario.fileno())
+        self._operaciones += 1
+
+    def _compactar(self):
+        """Reescribir el diario solo con las reservas abiertas (con el lock tomado)"""
+        temporal = self.ruta + '.tmp'
+        with open(temporal, 'wb') as f:
+            for reserva in self._activas.values():
+                f.write((json.dumps(dict(reserva, op='crear'), ensure_ascii=False) + '\n').encode('utf-8'))
+                if reserva['estado'] == CONFIRMANDO:
+                    f.write((json.dumps({'op': 'confirmando', 'id': reserva['id']}) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        if self._diario:
+            self._diario.close()
+        os.replace(temporal, self.ruta)
+        self._diario = open(self.ruta, 'ab')
+        self._operaciones = 0
+
+    def reproducir(self, verificar_confirmacion):
+        """Recuperar las reservas abiertas del diario; devuelve cuántas quedaron activas
+
+        verificar_confirmacion(reserva) dice si el movimiento de una confirmación
+        interrumpida llegó a la base.
+        """
+        abiertas = {}
+        if os.path.exists(self.ruta):
+            with open(self.ruta, 'rb') as f:
+                for linea in f:
+                    try:
+                        entrada = json.loads(linea)
+                    except ValueError:
+                        break  # Última línea cortada por una caída: nunca se confirmó al cliente
+                    op = entrada.pop('op')
+                    if op == 'crear':
+                        abiertas[entrada['id']] = dict(entrada, estado=ACTIVA)
+                    elif entrada['id'] in abiertas:
+                        if op == 'confirmando':
+                            abiertas[entrada['id']]['estado'] = CONFIRMANDO
+                        elif op == 'revertir':
+                            abiertas[entrada['id']]['estado'] = ACTIVA
+                        else:
+                            del abiertas[entrada['id']]
+
+        ahora = time.time()
+        for reserva in abiertas.values():
+            if reserva['estado'] == CONFIRMANDO:
+                if verificar_confirmacion(reserva):
+                    continue
+                reserva['estado'] = ACTIVA
+            if reserva['vence'] <= ahora:
+                self.vencidas += 1
+                continue
+            self._abrir(reserva)
+        with self._lock:
+            self._compactar()
+        return len(self._activas)
+
+    # ---------- ciclo de vida ----------
+
+    def iniciar(self, verificar_confirmacion):
+        self._bloquear()
+        try:
+            recuperadas = self.reproducir(verificar_confirmacion)
+        except Exception:
+            self._candado.close()
+            self._candado = None
+            raise
+        if recuperadas:
+            print(f"[OK] Reservas: {recuperadas} reservas activas recuperadas del diario")
+        self._hilo = threading.Thread(target=self._bucle, name='reservas-vencimiento', daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join()
+        with self._lock:
+            if self._diario:
+                self._diario.close()
+                self._diario = None
+        if self._candado:
+            self._candado.close()
+            self._candado = None
+
+    def _bucle(self):
+        while not self._detener.wait(self._rueda.tick):
+            try:
+                self.vencer(time.time())
+            except Exception as e:
+                print(f"Error venciendo reservas: {e}")
+
+    def vencer(self, ahora):
+        """Liberar las reservas cuyo plazo pasó; devuelve cuántas"""
+        with self._lock:
+            vencidas = self._rueda.avanzar(ahora)
+            for reserva_id in vencidas:
+                self._escribir({'op': 'vencer', 'id': reserva_id})
+                self._cerrar(reserva_id, VENCIDA)
+            self.vencidas += len(vencidas)
+            if self._operaciones >= CONFIG['operaciones_por_compactacion']:
+                self._compactar()
+        return len(vencidas)
+
+    # ---------- estado en memoria ----------
+
+    def _abrir(self, reserva):
+        self._activas[reserva['id']] = reserva
+        self._reservado[reserva['producto_id']] = self._reservado.get(reserva['producto_id'], 0) + \
+            reserva['cantidad']
+        self._rueda.programar(reserva['id'], reserva['vence'])
+
+    def _cerrar(self, reserva_id, estado):
+        reserva = self._activas.pop(reserva_id)
+        self._rueda.cancelar(reserva_id)
+        producto_id = reserva['producto_id']
+        self._reservado[producto_id] -= reserva['cantidad']
+        if not self._reservado[producto_id]:
+            del self._reservado[producto_id]
+        reserva['estado'] = estado
+        reserva['cerrada'] = time.time()
+        self._terminadas[reserva_id] = reserva
+        while len(self._terminadas) > CONFIG['terminadas_recordadas']:
+            self._terminadas.popitem(last=False)
+        if not self._activas:
+            # Nada abierto: el diario ya no hace falta para recuperar nada
+            self._diario.truncate(0)
+            self._operaciones = 0
+        return reserva
+
+    def reservado(self, producto_id):
+        """Unidades de un producto apartadas por reservas abiertas"""
+        return self._reservado.get(producto_id, 0)
+
+    def a_dict(self, reserva):
+        return {
+            'id': reserva['id'],
+            'producto_id': reserva['producto_id'],
+            'cantidad': reserva['cantidad'],
+            'referencia': reserva.get('referencia') or '',
+            'estado': reserva['estado'],
+            'creada': _iso(reserva['creada']),
+            'vence': _iso(reserva['vence']),
+        }
+
+    # ---------- API ----------
+
+    def leer_ttl(self, valor):
+        """Segundos de vida pedidos (o el valor por defecto); ValueError si están fuera de rango"""
+        if valor is None:
+            return self.ttl_s
+        ttl = int(valor)
+        if not 1 <= ttl <= self.ttl_max_s:
+            raise ValueError(f"ttl_segundos debe estar entre 1 y {self.ttl_max_s}")
+        return ttl
+
+    def reservar(self, producto_id, cantidad, stock_actual, ttl_s, referencia=''):
+        """Apartar `cantidad` si alcanza el disponible (stock_actual - reservado); StockInsuficiente si no"""
+        ahora = time.time()
+        with self._lock:
+            disponible = stock_actual - self.reservado(producto_id)
+            if cantidad > disponible:
+                raise StockInsuficiente(disponible)
+            reserva = {'id': uuid.uuid4().hex, 'producto_id': producto_id, 'cantidad': cantidad,
+                       'referencia': referencia, 'creada': ahora, 'vence': ahora + ttl_s}
+            self._escribir(dict(reserva, op='crear'))
+            reserva['estado'] = ACTIVA
+            self._abrir(reserva)
+            return self.a_dict(reserva), disponible - cantidad
+
+    def obtener(self, reserva_id):
+        with self._lock:
+            reserva = self._activas.get(reserva_id) or self._terminadas.get(reserva_id)
+            return self.a_dict(reserva) if reserva else None
+
+    def liberar(self, reserva_id):
+        """Devolver al disponible las unidades de una reserva activa"""
+        with self._lock:
+            reserva = self._activas.get(reserva_id)
+            if not reserva:
+                raise ReservaInexistente(reserva_id)
+            if reserva['estado'] == CONFIRMANDO:
+                raise ReservaEnCurso(reserva_id)
+            self._escribir({'op': 'liberar', 'id': reserva_id})
+            return self.a_dict(self._cerrar(reserva_id, LIBERADA))
+
+    def confirmar(self, reserva_id, registrar_salida):
+        """Convertir la reserva en una SALIDA; registrar_salida(reserva) escribe el movimiento
+
+        La reserva sigue contando como reservada hasta que el movimiento se
+        grabó, así el disponible nunca cuenta dos veces las mismas unidades.
+        """
+        with self._lock:
+            reserva = self._activas.get(reserva_id)
+            if not reserva:
+                raise ReservaInexistente(reserva_id)
+            if reserva['estado'] == CONFIRMANDO:
+                raise ReservaEnCurso(reserva_id)
+            self._escribir({'op': 'confirmando', 'id': reserva_id})
+            reserva['estado'] = CONFIRMANDO
+            self._rueda.cancelar(reserva_id)
+
+        try:
+            resultado = registrar_salida(self.a_dict(reserva))
+        except Exception:
+            with self._lock:
+                self._escribir({'op': 'revertir', 'id': reserva_id})
+                reserva['estado'] = ACTIVA
+                self._rueda.programar(reserva_id, reserva['vence'])
+            raise
+
+        with self._lock:
+            self._escribir({'op': 'confirmar', 'id': reserva_id})
+            return self.a_dict(self._cerrar(reserva_id, CONFIRMADA)), resultado
+
+    def estado(self):
+        with self._lock:
+            return {'activas': len(self._activas), 'unidades_reservadas': sum(self._reservado.values()),
+                    'productos_con_reservas': len(self._reservado), 'vencidas': self.vencidas,
+                    'temporizadores': len(self._rueda), 'operaciones_en_diario': self._operaciones}
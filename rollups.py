@@ -0,0 +1,259 @@
+"""
+Resúmenes diarios de movimientos de stock (MovimientosDiarios).
+
+Una fila por día, producto y tipo de movimiento con la cantidad total y la
+cantidad de movimientos. create_movimiento la mantiene al día dentro de la
+misma transacción, y backfill() la reconstruye a partir del historial: la
+tabla viva y, para los días anteriores al corte de archive.py, los segmentos
+archivados (que ya no están en MovimientosStock).
+
+Reconstruir el resumen completo:
+    python rollups.py --backfill
+    python rollups.py --backfill --desde 2025-01-01
+"""
+import argparse
+from datetime import date, datetime, timedelta
+
+import archive
+
+SQL_CREAR_TABLA = """
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='MovimientosDiarios' AND xtype='U')
+    CREATE TABLE MovimientosDiarios (
+        fecha DATE NOT NULL,
+        producto_id INT NOT NULL,
+        tipo_movimiento NVARCHAR(20) NOT NULL,
+        cantidad_total INT NOT NULL DEFAULT 0,
+        movimientos INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (fecha, producto_id, tipo_movimiento)
+    )
+"""
+
+GRANULARIDADES = {
+    'dia': 'dia', 'day': 'dia',
+    'semana': 'semana', 'week': 'semana',
+    'mes': 'mes', 'month': 'mes',
+}
+
+AGRUPACIONES = {
+    'total': 'total', None: 'total', '': 'total',
+    'producto': 'producto', 'product': 'producto',
+    'categoria': 'categoria', 'category': 'categoria',
+}
+
+
+def crear_tabla(cursor):
+    """Crear la tabla de resúmenes si no existe"""
+    cursor.execute(SQL_CREAR_TABLA)
+
+
+def registrar_movimiento(cursor, producto_id, tipo_movimiento, cantidad, movimientos=1):
+    """Sumar un movimiento (o un lote del mismo producto y tipo) al resumen de hoy"""
+    # UPDLOCK/HOLDLOCK evita que dos transacciones inserten la misma fila a la vez
+    cursor.execute("""
+        UPDATE MovimientosDiarios WITH (UPDLOCK, HOLDLOCK)
+        SET cantidad_total = cantidad_total + ?, movimientos = movimientos + ?
+        WHERE fecha = CAST(GETDATE() AS DATE) AND producto_id = ? AND tipo_movimiento = ?
+    """, cantidad, movimientos, producto_id, tipo_movimiento)
+    if cursor.rowcount == 0:
+        cursor.execute("""
+            INSERT INTO MovimientosDiarios (fecha, producto_id, tipo_movimiento, cantidad_total, movimientos)
+            VALUES (CAST(GETDATE() AS DATE), ?, ?, ?, ?)
+        """, producto_id, tipo_movimiento, cantidad, movimientos)
+
+
+def _medianoche(dia):
+    return datetime.combine(dia, datetime.min.time()) if dia else None
+
+
+def _resumir(cursor, desde=None, hasta=None):
+    """Insertar el resumen de los días en [desde, hasta) (fechas; None = sin límite); devuelve las filas"""
+    corte = archive.corte_caliente()
+    corte_dia = corte.date() if corte else None
+
+    # Días desde el corte: solo están en la tabla viva y se resumen en la base
+    inicio = max(filter(None, (desde, corte_dia)), default=None)
+    filtros, params = [], []
+    if inicio:
+        filtros.append("fecha_movimiento >= ?")
+        params.append(_medianoche(inicio))
+    if hasta:
+        filtros.append("fecha_movimiento < ?")
+        params.append(_medianoche(hasta))
+    cursor.execute(f"""
+        INSERT INTO MovimientosDiarios (fecha, producto_id, tipo_movimiento, cantidad_total, movimientos)
+        SELECT CAST(fecha_movimiento AS DATE), producto_id, tipo_movimiento, SUM(cantidad), COUNT(*)
+        FROM MovimientosStock
+        {'WHERE ' + ' AND '.join(filtros) if filtros else ''}
+        GROUP BY CAST(fecha_movimiento AS DATE), producto_id, tipo_movimiento
+    """, *params)
+    filas = max(cursor.rowcount, 0)
+    fin = min(hasta, corte_dia) if hasta and corte_dia else corte_dia
+    if fin is None or (desde and desde >= fin):
+        return filas
+
+    # Días anteriores al corte: los segmentos archivados más lo que siga en la tabla viva
+    # (cargado después con fecha vieja, o de un archivado interrumpido antes de borrar)
+    resumen = {}
+
+    def sumar(dia, producto_id, tipo, cantidad):
+        total = resumen.setdefault((dia, producto_id, tipo), [0, 0])
+        total[0] += cantidad
+        total[1] += 1
+
+    filtros, params = ["fecha_movimiento < ?"], [_medianoche(fin)]
+    if desde:
+        filtros.append("fecha_movimiento >= ?")
+        params.append(_medianoche(desde))
+    cursor.execute(f"""
+        SELECT id, producto_id, tipo_movimiento, cantidad, fecha_movimiento
+        FROM MovimientosStock
+        WHERE {' AND '.join(filtros)}
+    """, *params)
+    vivos = set()
+    for row in cursor.fetchall():
+        vivos.add(row[0])
+        sumar(_como_fecha(row[4]), row[1], row[2], row[3])
+    for movimiento in archive.leer(_medianoche(desde), _medianoche(fin)):
+        if movimiento['id'] not in vivos:
+            sumar(_como_fecha(movimiento['fecha_movimiento']), movimiento['producto_id'],
+                  movimiento['tipo_movimiento'], movimiento['cantidad'])
+    if resumen:
+        cursor.executemany("""
+            INSERT INTO MovimientosDiarios (fecha, producto_id, tipo_movimiento, cantidad_total, movimientos)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(dia, producto_id, tipo, cantidad, veces)
+              for (dia, producto_id, tipo), (cantidad, veces) in sorted(resumen.items())])
+    return filas + len(resumen)
+
+
+def backfill(conn, desde=None):
+    """Reconstruir el resumen desde el historial (todo, o a partir de una fecha)"""
+    if isinstance(desde, str):
+        desde = date.fromisoformat(desde)
+    cursor = conn.cursor()
+    if desde:
+        cursor.execute("DELETE FROM MovimientosDiarios WHERE fecha >= ?", desde)
+    else:
+        cursor.execute("DELETE FROM MovimientosDiarios")
+    filas = _resumir(cursor, desde)
+    conn.commit()
+    return filas
+
+
+def completar_historial(cursor):
+    """Resumir los días anteriores al primero de MovimientosDiarios (todos si está vacía)
+
+    Para bases que ya tenían movimientos cuando se creó el resumen; el commit queda a
+    cargo de quien llama (la migración).
+    """
+    cursor.execute("SELECT MIN(fecha) FROM MovimientosDiarios")
+    primero = cursor.fetchone()[0]
+    return _resumir(cursor, hasta=_como_fecha(primero) if primero else None)
+
+
+def _periodo(fecha, granularidad):
+    """Inicio del período (día, semana ISO o mes) al que pertenece la fecha"""
+    if granularidad == 'semana':
+        return fecha - timedelta(days=fecha.weekday())
+    if granularidad == 'mes':
+        return fecha.replace(day=1)
+    return fecha
+
+
+def _como_fecha(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+def serie(cursor, desde, hasta, granularidad='dia', agrupar='total', limite=20,
+          producto_id=None, categoria_id=None):
+    """Serie temporal de entradas y salidas leída del resumen diario"""
+    filtros = ["r.fecha >= ?", "r.fecha <= ?"]
+    params = [desde, hasta]
+    if producto_id is not None:
+        filtros.append("r.producto_id = ?")
+        params.append(producto_id)
+    if categoria_id is not None:
+        filtros.append("p.categoria_id = ?")
+        params.append(categoria_id)
+    donde = ' AND '.join(filtros)
+
+    if agrupar == 'producto':
+        clave_sql, nombre_sql, join_sql = "r.producto_id", "p.nombre", ""
+        agrupar_sql = f"r.fecha, {clave_sql}, {nombre_sql}"
+    elif agrupar == 'categoria':
+        clave_sql, nombre_sql, join_sql = "p.categoria_id", "c.nombre", \
+            "LEFT JOIN Categorias c ON p.categoria_id = c.id"
+        agrupar_sql = f"r.fecha, {clave_sql}, {nombre_sql}"
+    else:
+        # SQL Server no admite constantes en el GROUP BY
+        clave_sql, nombre_sql, join_sql = "0", "'Total'", ""
+        agrupar_sql = "r.fecha"
+
+    cursor.execute(f"""
+        SELECT r.fecha, {clave_sql} as clave, {nombre_sql} as nombre,
+               SUM(CASE WHEN r.tipo_movimiento = 'ENTRADA' THEN r.cantidad_total ELSE 0 END) as entradas,
+               SUM(CASE WHEN r.tipo_movimiento = 'SALIDA' THEN r.cantidad_total ELSE 0 END) as salidas,
+               SUM(r.movimientos) as movimientos
+        FROM MovimientosDiarios r
+        LEFT JOIN Productos p ON r.producto_id = p.id
+        {join_sql}
+        WHERE {donde}
+        GROUP BY {agrupar_sql}
+    """, *params)
+
+    series = {}
+    for row in cursor.fetchall():
+        clave = row[1]
+        datos = series.setdefault(clave, {'id': clave, 'nombre': row[2] or '', 'total': 0, 'puntos': {}})
+        periodo = _periodo(_como_fecha(row[0]), granularidad)
+        punto = datos['puntos'].setdefault(periodo, {'entradas': 0, 'salidas': 0, 'movimientos': 0})
+        punto['entradas'] += row[3] or 0
+        punto['salidas'] += row[4] or 0
+        punto['movimientos'] += row[5] or 0
+        datos['total'] += (row[3] or 0) + (row[4] or 0)
+
+    # Las series con más volumen primero; se recortan para no devolver miles de productos
+    ordenadas = sorted(series.values(), key=lambda s: s['total'], reverse=True)
+    if agrupar != 'total' and limite:
+        ordenadas = ordenadas[:limite]
+
+    resultado = []
+    for datos in ordenadas:
+        resultado.append({
+            'id': datos['id'] if agrupar != 'total' else None,
+            'nombre': datos['nombre'],
+            'puntos': [
+                {'periodo': periodo.isoformat(), **valores}
+                for periodo, valores in sorted(datos['puntos'].items())
+            ]
+        })
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resúmenes diarios de movimientos de stock')
+    parser.add_argument('--backfill', action='store_true', help='Reconstruir MovimientosDiarios')
+    parser.add_argument('--desde', help='Reconstruir solo desde esta fecha (YYYY-MM-DD)')
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.print_help()
+        return
+
+    from inventory_api import get_db_connection
+    conn = get_db_connection()
+    if not conn:
+        print("No se pudo conectar a la base de datos")
+        return
+    try:
+        filas = backfill(conn, args.desde)
+        print(f"[OK] MovimientosDiarios reconstruida ({filas} filas)")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,415 @@
+"""
+Índice de búsqueda de productos en memoria, tolerante a errores de tipeo.
+
+Los textos (nombre, codigo_sku, descripcion) se pasan a minúsculas sin
+acentos y se parten en términos. El índice guarda:
+
+- listas invertidas término -> slots de producto, una por campo, para puntuar
+  distinto una coincidencia en el nombre que en la descripción;
+- el vocabulario ordenado, para completar el último término como prefijo
+  (autocompletado) con bisect;
+- trigramas de los términos alfabéticos, para encontrar términos a una o dos
+  ediciones de distancia cuando el término buscado no existe.
+
+La puntuación es tf-idf simplificado por campo, sumada con NumPy (bincount
+sobre los slots) en lugar de recorrer productos, y los mejores se eligen con
+argpartition. Un producto modificado ocupa un slot nuevo y el viejo queda
+marcado como muerto; con muchos muertos el índice se reconstruye.
+
+El índice se mantiene al día con la versión de fila de Productos (ver
+sync.py): cada búsqueda aplica los cambios pendientes si pasó
+SEARCH_REFRESH_MS desde la última revisión o si este proceso modificó un
+producto (marcar_pendiente). Así también ve lo escrito por otros workers.
+
+Configuración (variables de entorno):
+    SEARCH_REFRESH_MS    intervalo mínimo entre revisiones de cambios (1000)
+"""
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+import numpy as np
+
+import sync
+
+CONFIG = {
+    'refresco_s': float(os.environ.get('SEARCH_REFRESH_MS', 1000)) / 1000,
+}
+
+# Campos indexados y su peso en la puntuación
+CAMPOS = ('nombre', 'codigo_sku', 'descripcion')
+PESOS_CAMPO = (3.0, 2.0, 1.0)
+
+# Calidad de la coincidencia según cómo se encontró el término
+CALIDAD_EXACTA = 1.0
+CALIDAD_PREFIJO = 0.8
+CALIDAD_EDICION = (1.0, 0.6, 0.4)  # Por distancia de edición 0, 1 y 2
+
+MIN_PREFIJO = 2
+MAX_PREFIJOS = 30       # Términos que expande un prefijo (los más frecuentes)
+MAX_ESCANEO_PREFIJO = 2000
+MAX_CORRECCIONES = 8    # Términos que expande un término mal escrito
+LIMITE_MAXIMO = 100
+LOTE_CARGA = 5000
+
+_TERMINO = re.compile(r'[a-z0-9]+')
+
+
+def normalizar(texto):
+    """Minúsculas sin acentos ni diacríticos"""
+    if not texto:
+        return ''
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def terminos(texto):
+    return _TERMINO.findall(normalizar(texto))
+
+
+def trigramas(termino):
+    relleno = f"  {termino} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+def distancia_edicion(a, b, maximo):
+    """Levenshtein entre a y b, o maximo + 1 si supera maximo"""
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    anterior = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            actual.append(min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (ca != cb)))
+        if min(actual) > maximo:
+            return maximo + 1
+        anterior = actual
+    return anterior[-1]
+
+
+def _ediciones_permitidas(termino):
+    return 0 if len(termino) < 4 else 1 if len(termino) < 8 else 2
+
+
+class _Estado:
+    """Estructuras del índice; se reemplazan enteras al reconstruir"""
+
+    def __init__(self):
+        self.listas = tuple({} for _ in CAMPOS)  # campo -> término -> slot (int) o array('i') de slots
+        self.frecuencia = Counter()              # término -> documentos que lo contienen (con muertos)
+        self.vocabulario = []                    # términos ordenados, para los prefijos
+        self.trigramas = {}                      # trigrama -> términos alfabéticos que lo contienen
+        self.slots = {}                          # producto_id -> slot vivo
+        self.documentos = []                     # slot -> (id, nombre, codigo_sku, categoria_id)
+        self.categorias = {}                     # categoria_id -> nombre, releído en cada refresco
+        self.huellas = {}                        # producto_id -> hash del texto indexado
+        self.vivos = np.zeros(1024, dtype=bool)
+        self.muertos = 0
+        self.version = 0
+
+    def _nuevo_termino(self, termino, ordenar):
+        if ordenar:
+            posicion = bisect_left(self.vocabulario, termino)
+            self.vocabulario.insert(posicion, termino)
+        else:
+            self.vocabulario.append(termino)
+        if termino.isalpha():
+            for trigrama in trigramas(termino):
+                self.trigramas.setdefault(trigrama, set()).add(termino)
+
+    def agregar(self, producto_id, nombre, sku, descripcion, categoria_id, ordenar=True):
+        huella = hash((nombre, sku, descripcion, categoria_id))
+        if self.huellas.get(producto_id) == huella and producto_id in self.slots:
+            return  # Cambió el stock o el precio, no el texto
+        self.quitar(producto_id)
+        slot = len(self.documentos)
+        self.documentos.append((producto_id, nombre, sku or '', categoria_id))
+        if slot >= len(self.vivos):
+            self.vivos = np.concatenate([self.vivos, np.zeros(len(self.vivos), dtype=bool)])
+        self.vivos[slot] = True
+        self.slots[producto_id] = slot
+        self.huellas[producto_id] = huella
+
+        vistos = set()
+        for campo, lista in enumerate((terminos(nombre), terminos(sku), terminos(descripcion))):
+            listas = self.listas[campo]
+            for termino in set(lista):
+                actual = listas.get(termino)
+                if actual is None:
+                    listas[termino] = slot  # La mayoría de los términos de SKU aparecen una sola vez
+                elif isinstance(actual, int):
+                    listas[termino] = array('i', (actual, slot))
+                else:
+                    actual.append(slot)
+                if termino not in vistos:
+                    vistos.add(termino)
+                    if termino not in self.frecuencia:
+                        self._nuevo_termino(termino, ordenar)
+                    self.frecuencia[termino] += 1
+
+    def quitar(self, producto_id):
+        slot = self.slots.pop(producto_id, None)
+        self.huellas.pop(producto_id, None)
+        if slot is not None:
+            self.vivos[slot] = False
+            self.documentos[slot] = None
+            self.muertos += 1
+
+    # ---------- búsqueda ----------
+
+    def expandir(self, termino, como_prefijo):
+        """Términos del vocabulario que cuentan como coincidencia de `termino`, con su calidad"""
+        expansiones = {}
+        if termino in self.frecuencia:
+            expansiones[termino] = CALIDAD_EXACTA
+        if como_prefijo and len(termino) >= MIN_PREFIJO:
+            inicio = bisect_left(self.vocabulario, termino)
+            candidatos = []
+            for candidato in self.vocabulario[inicio:inicio + MAX_ESCANEO_PREFIJO]:
+                if not candidato.startswith(termino):
+                    break
+                if candidato != termino:
+                    candidatos.append(candidato)
+            for candidato in sorted(candidatos, key=self.frecuencia.__getitem__, reverse=True)[:MAX_PREFIJOS]:
+                expansiones[candidato] = CALIDAD_PREFIJO
+        if not expansiones:
+            expansiones.update(self.corregir(termino))
+        return expansiones
+
+    def corregir(self, termino):
+        """Términos alfabéticos a pocas ediciones de distancia, para errores de tipeo"""
+        maximo = _ediciones_permitidas(termino)
+        if not maximo or not termino.isalpha():
+            return {}
+        propios = trigramas(termino)
+        comunes = Counter()
+        for trigrama in propios:
+            comunes.update(self.trigramas.get(trigrama, ()))
+        # Cada edición cambia a lo sumo 3 trigramas
+        minimo = len(propios) - 3 * maximo
+        correcciones = []
+        for candidato, compartidos in comunes.most_common(200):
+            if compartidos < minimo:
+                break
+            distancia = distancia_edicion(termino, candidato, maximo)
+            if distancia <= maximo:
+                correcciones.append((distancia, -self.frecuencia[candidato], candidato))
+        return {c: CALIDAD_EDICION[d] for d, _, c in sorted(correcciones)[:MAX_CORRECCIONES]}
+
+    def puntajes(self, expansiones):
+        """Puntaje por slot de un término de la consulta (suma de campos y expansiones)"""
+        vivos = len(self.slots) or 1
+        slots, pesos = [], []
+        for termino, calidad in expansiones.items():
+            idf = math.log(1 + vivos / self.frecuencia[termino])
+            for campo, peso_campo in enumerate(PESOS_CAMPO):
+                lista = self.listas[campo].get(termino)
+                if lista is None:
+                    continue
+                if isinstance(lista, int):
+                    lista = np.array((lista,), dtype=np.int32)
+                else:
+                    lista = np.frombuffer(lista, dtype=np.int32)
+                slots.append(lista)
+                pesos.append(np.full(len(lista), calidad * peso_campo * idf))
+        if not slots:
+            return None
+        return np.bincount(np.concatenate(slots), weights=np.concatenate(pesos), minlength=len(self.documentos))
+
+    def sugerencias(self, anteriores, ultimo, limite):
+        """Consultas completadas con los términos más frecuentes que empiezan con el último"""
+        inicio = bisect_left(self.vocabulario, ultimo)
+        candidatos = []
+        for candidato in self.vocabulario[inicio:inicio + MAX_ESCANEO_PREFIJO]:
+            if not candidato.startswith(ultimo):
+                break
+            if candidato != ultimo and not candidato.isdigit():
+                candidatos.append(candidato)
+        candidatos.sort(key=self.frecuencia.__getitem__, reverse=True)
+        prefijo = ' '.join(anteriores)
+        return [f"{prefijo} {c}".strip() for c in candidatos[:limite]]
+
+
+class IndiceBusqueda:
+    """Índice de búsqueda sobre Productos, construido en segundo plano y refrescado por versión de fila"""
+
+    def __init__(self, obtener_conexion):
+        self.obtener_conexion = obtener_conexion
+        self._estado = None
+        self._lock = threading.Lock()
+        self._construyendo = False
+        self._pendiente = False
+        self._ultima_revision = 0.0
+        self.ultima_construccion_s = None
+        self.ultimo_error = None
+
+    @property
+    def listo(self):
+        return self._estado is not None
+
+    # ---------- carga y refresco ----------
+
+    def _leer(self, cursor, estado, desde, ordenar):
+        """Aplicar a `estado` las filas cambiadas desde la versión `desde`; devuelve la última versión"""
+        # Las filas de sync traen categoria_id: renombrar una categoría no cambia la versión del producto
+        cursor.execute("SELECT id, nombre FROM Categorias")
+        estado.categorias = {row[0]: row[1] for row in cursor.fetchall()}
+        while True:
+            filas, hay_mas, reiniciar = sync.cambios(cursor, desde, LOTE_CARGA)
+            if reiniciar:
+                raise RuntimeError("La versión del índice es posterior a la de la base")
+            for row in filas:
+                if row[1]:
+                    estado.agregar(row[2], row[3], row[5], row[4], row[10], ordenar)
+                else:
+                    estado.quitar(row[2])
+            if filas:
+                desde = filas[-1][0]
+            if not hay_mas:
+                return desde
+
+    def construir(self):
+        """Cargar el índice completo desde la base (se llama en un hilo)"""
+        inicio = time.perf_counter()
+        conn = self.obtener_conexion()
+        if not conn:
+            self.ultimo_error = "Sin conexión a la base de datos"
+            self._construyendo = False
+            return
+        try:
+            estado = _Estado()
+            cursor = conn.cursor()
+            estado.version = self._leer(cursor, estado, 0, ordenar=False)
+            estado.vocabulario.sort()
+            with self._lock:
+                # Lo cambiado mientras se construía se aplica antes de publicar el estado nuevo
+                estado.version = self._leer(cursor, estado, estado.version, ordenar=True)
+                self._estado = estado
+                self._ultima_revision = time.monotonic()
+            conn.close()
+            self.ultima_construccion_s = round(time.perf_counter() - inicio, 3)
+            self.ultimo_error = None
+            print(f"[OK] Índice de búsqueda: {len(estado.slots)} productos, "
+                  f"{len(estado.vocabulario)} términos en {self.ultima_construccion_s} s")
+        except Exception as e:
+            conn.close()
+            self.ultimo_error = str(e)
+            print(f"Error construyendo el índice de búsqueda: {e}")
+        finally:
+            self._construyendo = False
+
+    def iniciar(self):
+        """Construir el índice en segundo plano si no existe ni se está construyendo"""
+        with self._lock:
+            if self._construyendo:
+                return
+            self._construyendo = True
+        threading.Thread(target=self.construir, name='indice-busqueda', daemon=True).start()
+
+    def marcar_pendiente(self):
+        """Este proceso modificó productos: la próxima búsqueda revisa los cambios sin esperar"""
+        self._pendiente = True
+
+    def refrescar(self):
+        """Aplicar los cambios de Productos si corresponde; reconstruir si hay demasiados slots muertos"""
+        estado = self._estado
+        if estado is None:
+            self.iniciar()
+            return
+        ahora = time.monotonic()
+        if not self._pendiente and ahora - self._ultima_revision < CONFIG['refresco_s']:
+            return
+        conn = self.obtener_conexion()
+        if not conn:
+            return  # Se busca sobre lo que ya hay
+        try:
+            with self._lock:
+                self._pendiente = False
+                self._ultima_revision = ahora
+                estado.version = self._leer(conn.cursor(), estado, estado.version, ordenar=True)
+            conn.close()
+        except Exception as e:
+            conn.close()
+            self.ultimo_error = str(e)
+            print(f"Error refrescando el índice de búsqueda: {e}")
+            self.iniciar()
+            return
+        if estado.muertos > 10000 and estado.muertos > len(estado.slots) // 2:
+            self.iniciar()
+
+    # ---------- consulta ----------
+
+    def buscar(self, consulta, limite=10, sugerencias=5):
+        """Productos mejor puntuados para la consulta y sugerencias para completarla
+
+        Todos los términos deben coincidir (exactos, como prefijo el último, o
+        corregidos); con tres o más términos, si ningún producto los tiene a
+        todos se aceptan los que tienen todos menos uno.
+        """
+        consulta_terminos = terminos(consulta)
+        resultado = {'resultados': [], 'total': 0, 'sugerencias': [], 'correcciones': {}}
+        if not consulta_terminos:
+            return resultado
+        with self._lock:
+            estado = self._estado
+            ultimo = len(consulta_terminos) - 1
+            por_termino = []
+            for i, termino in enumerate(consulta_terminos):
+                expansiones = estado.expandir(termino, como_prefijo=(i == ultimo))
+                if expansiones and termino not in expansiones and i != ultimo:
+                    resultado['correcciones'][termino] = max(expansiones, key=expansiones.get)
+                por_termino.append(expansiones)
+            # Términos presentes en más de la mitad del catálogo ("sku", "de") no discriminan:
+            # si la consulta tiene otros, no se exigen ni se puntúan
+            umbral = len(estado.slots) // 2
+            discriminan = [e for e in por_termino if not e or min(estado.frecuencia[t] for t in e) <= umbral]
+            if discriminan:
+                por_termino = discriminan
+
+            total = None
+            coincidencias = np.zeros(len(estado.documentos), dtype=np.int8)
+            for expansiones in por_termino:
+                puntaje = estado.puntajes(expansiones)
+                if puntaje is None:
+                    continue
+                coincidencias += puntaje > 0
+                if total is None:
+                    total = puntaje
+                else:
+                    total += puntaje
+            if sugerencias:
+                resultado['sugerencias'] = estado.sugerencias(consulta_terminos[:-1], consulta_terminos[-1],
+                                                              sugerencias)
+            if total is None:
+                return resultado
+
+            requeridas = len(por_termino)
+            candidatos = np.flatnonzero((coincidencias >= requeridas) & estado.vivos[:len(total)])
+            if not len(candidatos) and requeridas > 2:
+                candidatos = np.flatnonzero((coincidencias >= requeridas - 1) & estado.vivos[:len(total)])
+            resultado['total'] = int(len(candidatos))
+            puntajes = total[candidatos]
+            if len(candidatos) > limite:
+                mejores = np.argpartition(-puntajes, limite - 1)[:limite]
+                candidatos, puntajes = candidatos[mejores], puntajes[mejores]
+            orden = np.lexsort((candidatos, -puntajes))
+            for slot, puntaje in zip(candidatos[orden].tolist(), puntajes[orden].tolist()):
+                producto_id, nombre, sku, categoria_id = estado.documentos[slot]
+                resultado['resultados'].append({'id': producto_id, 'nombre': nombre, 'codigo_sku': sku,
+                                                'categoria_nombre': estado.categorias.get(categoria_id, ''),
+                                                'puntaje': round(puntaje, 3)})
+        return resultado
+
+    def resumen(self):
+        estado = self._estado
+        if estado is None:
+            return {'listo': False, 'construyendo': self._construyendo, 'ultimo_error': self.ultimo_error}
+        return {'listo': True, 'productos': len(estado.slots), 'terminos': len(estado.vocabulario),
+                'slots_muertos': estado.muertos, 'version': estado.version,
+                'construccion_s': self.ultima_construccion_s, 'ultimo_error': self.ultimo_error}
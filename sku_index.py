@@ -0,0 +1,313 @@
+"""
+Búsqueda de productos por código SKU / código de barras sin ir a la base.
+
+Las cajas y la recepción resuelven códigos escaneados todo el tiempo. Este
+módulo mantiene en el proceso:
+
+- un índice hash SKU -> producto (id, nombre, precio, stock) con los SKU ya
+  resueltos, acotado a SKU_CACHE_SIZE entradas (LRU);
+- un filtro de Bloom con todos los SKU de productos activos, cargado al
+  iniciar leyendo solo esa columna. Un código que el filtro no conoce no
+  existe: se responde 404 sin consultar la base. Solo los que el filtro dice
+  "quizás" y no están en el índice se buscan en la base, y quedan indexados.
+
+Los handlers de escritura de productos actualizan el índice y el filtro en el
+momento. Los cambios de otros workers y los de stock llegan por la versión de
+fila de Productos (ver sync.py), revisada como mucho cada SKU_REFRESH_MS o al
+instante si este proceso registró movimientos (marcar_pendiente).
+
+Configuración (variables de entorno):
+    SKU_CACHE_SIZE       productos resueltos que se guardan (200000)
+    SKU_REFRESH_MS       intervalo mínimo entre revisiones de cambios (1000)
+    SKU_BLOOM_FP         tasa de falsos positivos del filtro de Bloom (0.01)
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentation import Contador, registrar_metrica
+
+CONFIG = {
+    'max_entradas': int(os.environ.get('SKU_CACHE_SIZE', 200000)),
+    'refresco_s': float(os.environ.get('SKU_REFRESH_MS', 1000)) / 1000,
+    'falsos_positivos': float(os.environ.get('SKU_BLOOM_FP', 0.01)),
+}
+
+MAX_LOTE = 500
+_BLOQUE_CONSULTA = 100  # Parámetros por consulta IN (...)
+
+CONSULTAS = registrar_metrica(Contador('sku_lookups_total',
+                                       'Búsquedas por SKU según cómo se resolvieron', ('resultado',)))
+
+_COLUMNAS = """CAST(version_fila AS BIGINT) as version, id, codigo_sku, activo, nombre, precio,
+               cantidad_stock, stock_minimo"""
+
+
+def normalizar(sku):
+    """Clave del índice: sin espacios alrededor y en mayúsculas (la collation de la base no distingue)"""
+    return (sku or '').strip().upper()
+
+
+def _registro(row):
+    return {'id': row[1], 'codigo_sku': row[2], 'nombre': row[4], 'precio': float(row[5]),
+            'cantidad_stock': row[6], 'stock_minimo': row[7]}
+
+
+class FiltroBloom:
+    """Filtro de Bloom sobre un bytearray con doble hashing de un blake2b de 128 bits"""
+
+    def __init__(self, capacidad, falsos_positivos):
+        self.capacidad = max(int(capacidad), 1000)
+        self.bits = max(8, int(-self.capacidad * math.log(falsos_positivos) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / self.capacidad * math.log(2)))
+        self._tabla = bytearray((self.bits + 7) // 8)
+        self.elementos = 0
+
+    def _posiciones(self, clave):
+        digest = hashlib.blake2b(clave.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def agregar(self, clave):
+        posiciones = list(self._posiciones(clave))
+        if all(self._tabla[p >> 3] & (1 << (p & 7)) for p in posiciones):
+            return  # Ya estaba (o es un falso positivo): no cuenta para la capacidad
+        for posicion in posiciones:
+            self._tabla[posicion >> 3] |= 1 << (posicion & 7)
+        self.elementos += 1
+
+    def __contains__(self, clave):
+        return all(self._tabla[p >> 3] & (1 << (p & 7)) for p in self._posiciones(clave))
+
+    def saturado(self):
+        return self.elementos > self.capacidad
+
+
+class SinConexion(Exception):
+    """Hacía falta la base para resolver un SKU y no hubo conexión"""
+
+
+class IndiceSku:
+    """Índice SKU -> producto con filtro de Bloom de negativos, al día por versión de fila"""
+
+    def __init__(self, obtener_conexion, max_entradas=None):
+        self.obtener_conexion = obtener_conexion
+        self.max_entradas = max_entradas or CONFIG['max_entradas']
+        self._entradas = OrderedDict()  # sku normalizado -> registro
+        self._sku_de = {}               # producto_id -> sku normalizado en el índice
+        self._bloom = None
+        self._lock = threading.Lock()
+        self._cargando = False
+        self._pendiente = False
+        self._ultima_revision = 0.0
+        self.version = 0
+        self.ultimo_error = None
+
+    # ---------- filtro de Bloom ----------
+
+    def cargar(self):
+        """Armar el filtro con los SKU de productos activos (se llama en un hilo)"""
+        conn = self.obtener_conexion()
+        if not conn:
+            self.ultimo_error = "Sin conexión a la base de datos"
+            self._cargando = False
+            return
+        try:
+            cursor = conn.cursor()
+            # La versión se toma antes de leer: lo que cambie durante la carga se vuelve a aplicar
+            cursor.execute("SELECT CAST(MIN_ACTIVE_ROWVERSION() AS BIGINT) - 1, COUNT(*) FROM Productos")
+            version, total = cursor.fetchone()
+            bloom = FiltroBloom(total * 2, CONFIG['falsos_positivos'])
+            cursor.execute("SELECT codigo_sku FROM Productos WHERE activo = 1 AND codigo_sku IS NOT NULL")
+            while True:
+                filas = cursor.fetchmany(10000)
+                if not filas:
+                    break
+                for (sku,) in filas:
+                    if sku:
+                        bloom.agregar(normalizar(sku))
+            conn.close()
+            with self._lock:
+                if self._bloom is None:
+                    # Lo resuelto antes de tener versión no recibió cambios: se vuelve a leer al escanearlo
+                    self._entradas.clear()
+                    self._sku_de.clear()
+                # Los cambios desde la versión leída se reaplican, también sobre el filtro nuevo
+                self.version = version or 0
+                self._bloom = bloom
+            self.ultimo_error = None
+            print(f"[OK] Índice de SKU: filtro de Bloom con {bloom.elementos} códigos "
+                  f"({bloom.bits // 8 // 1024} KB, {bloom.hashes} hashes)")
+        except Exception as e:
+            conn.close()
+            self.ultimo_error = str(e)
+            print(f"Error cargando el filtro de SKU: {e}")
+        finally:
+            self._cargando = False
+
+    def iniciar(self):
+        """Cargar el filtro en segundo plano si no se está cargando"""
+        with self._lock:
+            if self._cargando:
+                return
+            self._cargando = True
+        threading.Thread(target=self.cargar, name='indice-sku', daemon=True).start()
+
+    @property
+    def listo(self):
+        return self._bloom is not None
+
+    # ---------- mantenimiento ----------
+
+    def _guardar(self, registro):
+        """Indexar un producto activo (con el lock tomado)"""
+        clave = normalizar(registro['codigo_sku'])
+        anterior = self._sku_de.pop(registro['id'], None)
+        if anterior and anterior != clave:
+            self._entradas.pop(anterior, None)
+        if not clave:
+            return
+        if self._bloom is not None:
+            self._bloom.agregar(clave)
+        self._entradas[clave] = registro
+        self._entradas.move_to_end(clave)
+        self._sku_de[registro['id']] = clave
+        while len(self._entradas) > self.max_entradas:
+            _, viejo = self._entradas.popitem(last=False)
+            self._sku_de.pop(viejo['id'], None)
+
+    def _olvidar(self, producto_id):
+        clave = self._sku_de.pop(producto_id, None)
+        if clave:
+            self._entradas.pop(clave, None)
+
+    def registrar(self, producto):
+        """Alta o modificación hecha por este proceso (dict de la respuesta del handler)"""
+        with self._lock:
+            if producto.get('activo', True):
+                self._guardar({c: producto[c] for c in ('id', 'codigo_sku', 'nombre', 'precio',
+                                                        'cantidad_stock', 'stock_minimo')})
+            else:
+                self._olvidar(producto['id'])
+
+    def olvidar(self, producto_id):
+        """Baja hecha por este proceso"""
+        with self._lock:
+            self._olvidar(producto_id)
+
+    def marcar_pendiente(self):
+        """Este proceso cambió stock: la próxima búsqueda revisa los cambios sin esperar"""
+        self._pendiente = True
+
+    def _aplicar_cambios(self, cursor):
+        """Actualizar lo indexado con las filas cambiadas desde la última versión vista"""
+        while True:
+            cursor.execute(f"""
+                SELECT TOP (1000) {_COLUMNAS}
+                FROM Productos
+                WHERE version_fila > CAST(? AS BINARY(8)) AND version_fila < MIN_ACTIVE_ROWVERSION()
+                ORDER BY version_fila
+            """, self.version)
+            filas = cursor.fetchall()
+            for row in filas:
+                if row[3]:
+                    clave = normalizar(row[2])
+                    if self._bloom is not None and clave:
+                        self._bloom.agregar(clave)
+                    # Solo se actualiza lo ya indexado; el resto se lee cuando se escanee
+                    if row[1] in self._sku_de:
+                        self._guardar(_registro(row))
+                else:
+                    self._olvidar(row[1])
+            if filas:
+                self.version = filas[-1][0]
+            if len(filas) < 1000:
+                return
+
+    def _refrescar(self, cursor):
+        ahora = time.monotonic()
+        if not self._pendiente and ahora - self._ultima_revision < CONFIG['refresco_s']:
+            return
+        with self._lock:
+            self._pendiente = False
+            self._ultima_revision = ahora
+            self._aplicar_cambios(cursor)
+        if self._bloom is not None and self._bloom.saturado():
+            self.iniciar()  # Muchos códigos nuevos: rearmar el filtro con más capacidad
+
+    # ---------- consulta ----------
+
+    def resolver(self, skus):
+        """Productos activos de cada SKU (None si no existe); SinConexion si hizo falta la base y no hubo"""
+        claves = {sku: normalizar(sku) for sku in skus}
+        resultado = {}
+        conn = None
+        try:
+            if self.listo and (self._pendiente or
+                               time.monotonic() - self._ultima_revision >= CONFIG['refresco_s']):
+                conn = self.obtener_conexion()
+                if conn:
+                    self._refrescar(conn.cursor())
+
+            faltan = []
+            with self._lock:
+                for sku, clave in claves.items():
+                    registro = self._entradas.get(clave)
+                    if registro:
+                        self._entradas.move_to_end(clave)
+                        resultado[sku] = dict(registro)
+                        CONSULTAS.incrementar('indice')
+                    elif not clave or (self._bloom is not None and clave not in self._bloom):
+                        resultado[sku] = None
+                        CONSULTAS.incrementar('bloom')
+                    else:
+                        faltan.append(sku)
+            if not faltan:
+                return resultado
+
+            if conn is None:
+                conn = self.obtener_conexion()
+            if not conn:
+                raise SinConexion()
+            encontrados = self._leer(conn.cursor(), {claves[sku] for sku in faltan})
+            for sku in faltan:
+                registro = encontrados.get(claves[sku])
+                resultado[sku] = dict(registro) if registro else None
+                CONSULTAS.incrementar('base' if registro else 'no_encontrado')
+            return resultado
+        finally:
+            if conn:
+                conn.close()
+
+    def _leer(self, cursor, claves):
+        """Buscar en la base los SKU que no están indexados e indexar los encontrados"""
+        encontrados = {}
+        claves = list(claves)
+        for i in range(0, len(claves), _BLOQUE_CONSULTA):
+            bloque = claves[i:i + _BLOQUE_CONSULTA]
+            cursor.execute(f"""
+                SELECT {_COLUMNAS}
+                FROM Productos
+                WHERE activo = 1 AND codigo_sku IN ({', '.join('?' * len(bloque))})
+            """, *bloque)
+            for row in cursor.fetchall():
+                encontrados[normalizar(row[2])] = _registro(row)
+        with self._lock:
+            for registro in encontrados.values():
+                self._guardar(registro)
+        return encontrados
+
+    def resumen(self):
+        bloom = self._bloom
+        return {
+            'listo': bloom is not None,
+            'indexados': len(self._entradas),
+            'max_entradas': self.max_entradas,
+            'version': self.version,
+            'bloom': {'codigos': bloom.elementos, 'capacidad': bloom.capacidad, 'bytes': len(bloom._tabla),
+                      'hashes': bloom.hashes} if bloom else None,
+            'ultimo_error': self.ultimo_error,
+        }
@@ -0,0 +1,343 @@
+"""
+Fotos periódicas del stock por producto y stock a una fecha pasada.
+
+SnapshotsStock guarda el stock de cada producto al cierre de un día. Para
+responder "cuánto stock había el día X" se parte de la foto más cercana (o
+del stock actual, si está más cerca) y se reproducen solo los días entre esa
+foto y X usando MovimientosDiarios, que resume el historial completo (también
+lo ya archivado por archive.py).
+
+La conciliación recalcula el stock de cada producto desde la última foto más
+los movimientos posteriores de MovimientosStock, en bloques de ids repartidos
+entre varios hilos con su propia conexión, y reporta los productos cuyo
+cantidad_stock no coincide (por ejemplo, editado con PUT /productos/<id>).
+
+Uso (conviene programar la foto una vez por día o por semana):
+    python snapshots.py --tomar                     # cierre de ayer
+    python snapshots.py --tomar --fecha 2025-12-31
+    python snapshots.py --conciliar --hilos 8 --salida deriva.json
+
+Configuración (variables de entorno):
+    SNAPSHOT_RECONCILE_THREADS   hilos de la conciliación (4)
+    SNAPSHOT_RECONCILE_CHUNK     productos por bloque de la conciliación (5000)
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import archive
+from rollups import _como_fecha
+
+CONFIG = {
+    'hilos': int(os.environ.get('SNAPSHOT_RECONCILE_THREADS', 4)),
+    'productos_por_bloque': int(os.environ.get('SNAPSHOT_RECONCILE_CHUNK', 5000)),
+}
+
+SQL_CREAR_TABLA = """
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='SnapshotsStock' AND xtype='U')
+    CREATE TABLE SnapshotsStock (
+        fecha DATE NOT NULL,
+        producto_id INT NOT NULL,
+        cantidad_stock INT NOT NULL,
+        PRIMARY KEY (fecha, producto_id)
+    )
+"""
+
+# Variación de stock de una fila de MovimientosDiarios (igual que stock.delta_stock)
+_NETO_DIARIO = "SUM(CASE WHEN d.tipo_movimiento = 'ENTRADA' THEN d.cantidad_total ELSE -d.cantidad_total END)"
+_NETO_MOVIMIENTOS = "SUM(CASE WHEN tipo_movimiento = 'ENTRADA' THEN cantidad ELSE -cantidad END)"
+
+_BLOQUE_IN = 500
+MAX_DESVIOS = 1000
+
+
+def crear_tabla(cursor):
+    """Crear la tabla de fotos de stock si no existe"""
+    cursor.execute(SQL_CREAR_TABLA)
+
+
+def tomar(conn, fecha=None):
+    """Guardar el stock de cada producto al cierre de fecha (por defecto ayer)"""
+    fecha = fecha or date.today() - timedelta(days=1)
+    if fecha >= date.today():
+        raise ValueError('Solo se puede fotografiar un día ya cerrado')
+    siguiente = fecha + timedelta(days=1)
+    cursor = conn.cursor()
+
+    # El bloqueo compartido sobre MovimientosStock espera a los movimientos en curso y frena los
+    # nuevos hasta el commit: el stock leído y lo que se descuenta corresponden al mismo instante.
+    # Los movimientos insertan antes de tocar Productos, así que se toma en el mismo orden.
+    cursor.execute("SELECT COUNT(*) FROM MovimientosStock WITH (HOLDLOCK, TABLOCK) WHERE fecha_movimiento >= ?",
+                   siguiente)
+    cursor.fetchone()
+    cursor.execute("DELETE FROM SnapshotsStock WHERE fecha = ?", fecha)
+    # Stock del cierre = stock actual menos lo movido desde el día siguiente
+    cursor.execute(f"""
+        INSERT INTO SnapshotsStock (fecha, producto_id, cantidad_stock)
+        SELECT ?, p.id, p.cantidad_stock - COALESCE(d.neto, 0)
+        FROM Productos p
+        LEFT JOIN (
+            SELECT d.producto_id, {_NETO_DIARIO} as neto
+            FROM MovimientosDiarios d
+            WHERE d.fecha >= ?
+            GROUP BY d.producto_id
+        ) d ON d.producto_id = p.id
+        WHERE p.fecha_creacion < ?
+    """, fecha, siguiente, siguiente)
+    productos = cursor.rowcount
+    conn.commit()
+    return {'fecha': fecha.isoformat(), 'productos': productos}
+
+
+# ==================== STOCK A UNA FECHA ====================
+
+def _elegir_base(cursor, fecha):
+    """Foto desde la que se reproducen menos días: (fecha de la foto o None para el stock actual, días)"""
+    cursor.execute("SELECT TOP 1 fecha FROM SnapshotsStock WHERE fecha <= ? ORDER BY fecha DESC", fecha)
+    row = cursor.fetchone()
+    anterior = _como_fecha(row[0]) if row else None
+    cursor.execute("SELECT TOP 1 fecha FROM SnapshotsStock WHERE fecha > ? ORDER BY fecha", fecha)
+    row = cursor.fetchone()
+    posterior = _como_fecha(row[0]) if row else None
+
+    # El stock actual equivale a una foto del cierre de hoy; a igual distancia se prefiere la foto
+    candidatos = [((date.today() - fecha).days, None)]
+    for foto in (anterior, posterior):
+        if foto:
+            candidatos.append((abs((foto - fecha).days), foto))
+    dias, base = min(candidatos, key=lambda candidato: (candidato[0], candidato[1] is None))
+    return base, dias
+
+
+def _netos(cursor, desde, hasta, producto_id=None, categoria_id=None, ids=None):
+    """Variación de stock por producto de los días en (desde, hasta] según MovimientosDiarios"""
+    filtros, params = ["d.fecha > ?"], [desde]
+    if hasta is not None:
+        filtros.append("d.fecha <= ?")
+        params.append(hasta)
+    if producto_id is not None:
+        filtros.append("d.producto_id = ?")
+        params.append(producto_id)
+    if categoria_id is not None:
+        filtros.append("d.producto_id IN (SELECT id FROM Productos WHERE categoria_id = ?)")
+        params.append(categoria_id)
+    bloques = [ids[i:i + _BLOQUE_IN] for i in range(0, len(ids), _BLOQUE_IN)] if ids is not None else [None]
+    netos = {}
+    for bloque in bloques:
+        filtro_ids = f" AND d.producto_id IN ({', '.join('?' * len(bloque))})" if bloque else ''
+        cursor.execute(f"""
+            SELECT d.producto_id, {_NETO_DIARIO}
+            FROM MovimientosDiarios d
+            WHERE {' AND '.join(filtros)}{filtro_ids}
+            GROUP BY d.producto_id
+        """, *params, *(bloque or []))
+        netos.update((row[0], row[1] or 0) for row in cursor.fetchall())
+    return netos
+
+
+def stock_al(cursor, fecha, producto_id=None, categoria_id=None):
+    """Stock de cada producto al cierre de fecha, desde la foto más cercana"""
+    hoy = date.today()
+    if fecha > hoy:
+        raise ValueError('La fecha no puede ser futura')
+    base, dias = _elegir_base(cursor, fecha)
+    siguiente = fecha + timedelta(days=1)
+
+    filtros, params = ["p.fecha_creacion < ?"], [siguiente]
+    if producto_id is not None:
+        filtros.append("p.id = ?")
+        params.append(producto_id)
+    if categoria_id is not None:
+        filtros.append("p.categoria_id = ?")
+        params.append(categoria_id)
+    cursor.execute(f"""
+        SELECT p.id, p.nombre, p.codigo_sku, c.nombre as categoria_nombre, p.cantidad_stock, s.cantidad_stock
+        FROM Productos p
+        LEFT JOIN Categorias c ON p.categoria_id = c.id
+        LEFT JOIN SnapshotsStock s ON s.producto_id = p.id AND s.fecha = ?
+        WHERE {' AND '.join(filtros)}
+        ORDER BY p.id
+    """, base, *params)
+    filas = cursor.fetchall()
+
+    # Desde una foto se reproduce el tramo hacia adelante (foto anterior) o hacia atrás (posterior)
+    tramo = {}
+    if base is not None and base != fecha:
+        tramo = _netos(cursor, min(base, fecha), max(base, fecha), producto_id, categoria_id)
+    signo = 1 if base is not None and base <= fecha else -1
+    # Productos sin fila en la foto (o sin foto): hacia atrás desde el stock actual
+    sin_foto = [row[0] for row in filas if row[5] is None]
+    if sin_foto or signo < 0:
+        # Hacia atrás se descuentan los días posteriores a fecha: el resumen tiene que cubrirlos
+        cursor.execute("SELECT MIN(fecha) FROM MovimientosDiarios")
+        row = cursor.fetchone()
+        primero = _como_fecha(row[0]) if row and row[0] is not None else None
+        if primero and fecha < primero:
+            raise ValueError(f'El resumen diario de movimientos empieza el {primero.isoformat()}; '
+                             f'no se puede reconstruir el stock al {fecha.isoformat()}')
+    posteriores = {}
+    if sin_foto:
+        posteriores = _netos(cursor, fecha, None, producto_id, categoria_id,
+                             ids=None if base is None else sin_foto)
+
+    productos = []
+    for row in filas:
+        if row[5] is not None:
+            cantidad = row[5] + signo * tramo.get(row[0], 0)
+        else:
+            cantidad = row[4] - posteriores.get(row[0], 0)
+        productos.append({'id': row[0], 'nombre': row[1], 'codigo_sku': row[2] or '',
+                          'categoria_nombre': row[3] or '', 'cantidad_stock': cantidad})
+    return {
+        'fecha': fecha.isoformat(),
+        'base': {'tipo': 'foto' if base is not None else 'actual',
+                 'fecha': (base or hoy).isoformat(), 'dias_reproducidos': dias},
+        'total_productos': len(productos),
+        'total_unidades': sum(p['cantidad_stock'] for p in productos),
+        'productos': productos,
+    }
+
+
+# ==================== CONCILIACIÓN ====================
+
+def _conciliar_bloque(obtener_conexion, foto, desde_id, hasta_id, ids=None):
+    """Comparar cantidad_stock con foto + movimientos posteriores para un rango de ids"""
+    conn = obtener_conexion()
+    if not conn:
+        raise RuntimeError('Sin conexión a la base de datos')
+    try:
+        filtro_ids = f" AND p.id IN ({', '.join('?' * len(ids))})" if ids else ''
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT p.id, p.nombre, p.codigo_sku, p.cantidad_stock, s.cantidad_stock, COALESCE(m.neto, 0)
+            FROM Productos p
+            LEFT JOIN SnapshotsStock s ON s.producto_id = p.id AND s.fecha = ?
+            LEFT JOIN (
+                SELECT producto_id, {_NETO_MOVIMIENTOS} as neto
+                FROM MovimientosStock
+                WHERE fecha_movimiento >= ? AND producto_id >= ? AND producto_id < ?
+                GROUP BY producto_id
+            ) m ON m.producto_id = p.id
+            WHERE p.id >= ? AND p.id < ?{filtro_ids}
+        """, foto, foto + timedelta(days=1), desde_id, hasta_id, desde_id, hasta_id, *(ids or []))
+        revisados, sin_foto, desvios = 0, 0, []
+        for row in cursor.fetchall():
+            if row[4] is None:
+                sin_foto += 1
+                continue
+            revisados += 1
+            esperado = row[4] + row[5]
+            if row[3] != esperado:
+                desvios.append({'producto_id': row[0], 'nombre': row[1], 'codigo_sku': row[2] or '',
+                                'cantidad_stock': row[3], 'esperado': esperado, 'diferencia': row[3] - esperado})
+        conn.close()
+        return revisados, sin_foto, desvios
+    except Exception:
+        conn.close()
+        raise
+
+
+def conciliar(obtener_conexion, foto=None, hilos=None, productos_por_bloque=None):
+    """Recalcular el stock desde la última foto en bloques paralelos y reportar la deriva"""
+    hilos = hilos or CONFIG['hilos']
+    por_bloque = productos_por_bloque or CONFIG['productos_por_bloque']
+    inicio = time.perf_counter()
+
+    conn = obtener_conexion()
+    if not conn:
+        raise RuntimeError('Sin conexión a la base de datos')
+    try:
+        cursor = conn.cursor()
+        if foto is None:
+            cursor.execute("SELECT MAX(fecha) FROM SnapshotsStock")
+            row = cursor.fetchone()
+            foto = _como_fecha(row[0]) if row and row[0] else None
+        cursor.execute("SELECT MIN(id), MAX(id) FROM Productos")
+        id_min, id_max = cursor.fetchone()
+        conn.commit()
+        conn.close()
+    except Exception:
+        conn.close()
+        raise
+    if foto is None:
+        raise ValueError('No hay fotos de stock: correr primero python snapshots.py --tomar')
+    corte = archive.corte_caliente()
+    if corte and foto + timedelta(days=1) < corte.date():
+        raise ValueError(f'La foto del {foto.isoformat()} es anterior al archivo de movimientos '
+                         f'({corte.date().isoformat()}); tomar una foto más reciente')
+
+    rangos = [(desde, min(desde + por_bloque, id_max + 1))
+              for desde in range(id_min or 0, (id_max or -1) + 1, por_bloque)]
+    revisados, sin_foto, desvios = 0, 0, []
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='conciliacion') as ejecutor:
+        for r, s, d in ejecutor.map(lambda rango: _conciliar_bloque(obtener_conexion, foto, *rango), rangos):
+            revisados += r
+            sin_foto += s
+            desvios.extend(d)
+
+    # Un movimiento que entra mientras se lee un bloque puede dar una deriva falsa: se confirma
+    confirmados = []
+    for i in range(0, len(desvios), _BLOQUE_IN):
+        ids = [d['producto_id'] for d in desvios[i:i + _BLOQUE_IN]]
+        confirmados.extend(_conciliar_bloque(obtener_conexion, foto, min(ids), max(ids) + 1, ids)[2])
+    confirmados.sort(key=lambda d: (-abs(d['diferencia']), d['producto_id']))
+
+    return {
+        'foto': foto.isoformat(),
+        'productos_revisados': revisados,
+        'productos_sin_foto': sin_foto,
+        'productos_con_deriva': len(confirmados),
+        'unidades_de_deriva': sum(abs(d['diferencia']) for d in confirmados),
+        'bloques': len(rangos),
+        'hilos': hilos,
+        'duracion_s': round(time.perf_counter() - inicio, 3),
+        'desvios': confirmados[:MAX_DESVIOS],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fotos de stock y conciliación contra el historial')
+    parser.add_argument('--tomar', action='store_true', help='Guardar la foto del cierre de un día')
+    parser.add_argument('--conciliar', action='store_true', help='Reportar la deriva de stock desde la última foto')
+    parser.add_argument('--fecha', help='Día de la foto a tomar o a usar para conciliar (YYYY-MM-DD)')
+    parser.add_argument('--hilos', type=int, help=f"Hilos de la conciliación (por defecto {CONFIG['hilos']})")
+    parser.add_argument('--salida', help='Archivo JSON con el reporte de conciliación')
+    args = parser.parse_args()
+    if not args.tomar and not args.conciliar:
+        parser.print_help()
+        return 0
+    fecha = date.fromisoformat(args.fecha) if args.fecha else None
+
+    from inventory_api import get_db_connection
+    if args.tomar:
+        conn = get_db_connection()
+        if not conn:
+            print("No se pudo conectar a la base de datos")
+            return 1
+        try:
+            resumen = tomar(conn, fecha)
+            print(f"[OK] Foto de stock del {resumen['fecha']}: {resumen['productos']} productos")
+        finally:
+            conn.close()
+    if args.conciliar:
+        reporte = conciliar(get_db_connection, fecha if not args.tomar else None, args.hilos)
+        if args.salida:
+            with open(args.salida, 'w', encoding='utf-8') as f:
+                json.dump(reporte, f, indent=2, ensure_ascii=False)
+        print(f"[{'OK' if not reporte['productos_con_deriva'] else 'DERIVA'}] "
+              f"{reporte['productos_revisados']} productos contra la foto del {reporte['foto']}: "
+              f"{reporte['productos_con_deriva']} con deriva ({reporte['unidades_de_deriva']} unidades) "
+              f"en {reporte['duracion_s']} s")
+        for desvio in reporte['desvios'][:20]:
+            print(f"  #{desvio['producto_id']} {desvio['nombre']}: stock {desvio['cantidad_stock']}, "
+                  f"historial {desvio['esperado']} ({desvio['diferencia']:+d})")
+        return 1 if reporte['productos_con_deriva'] else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Escritura de movimientos de stock.
+
+Lo usan tanto POST /movimientos (un movimiento por transacción) como el
+vaciado de la cola de ingesta (lotes coalescidos por producto), así las dos
+rutas insertan el movimiento, ajustan cantidad_stock y mantienen
+MovimientosDiarios de la misma forma.
+"""
+import rollups
+
+
+def crear_columnas(cursor):
+    """Agregar a MovimientosStock el costo unitario de cada movimiento si no existe"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_NAME = 'MovimientosStock' AND COLUMN_NAME = 'costo_unitario'
+    """)
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("ALTER TABLE MovimientosStock ADD costo_unitario DECIMAL(10, 2) NULL")
+
+
+TIPOS_MOVIMIENTO = ('ENTRADA', 'SALIDA')
+
+
+def validar_movimiento(producto_id, tipo_movimiento, cantidad):
+    """Comprobar los campos de un movimiento antes de escribirlo; ValueError con el motivo"""
+    if isinstance(producto_id, bool) or not isinstance(producto_id, int):
+        raise ValueError('producto_id debe ser un entero')
+    if tipo_movimiento not in TIPOS_MOVIMIENTO:
+        raise ValueError(f"tipo_movimiento debe ser uno de {', '.join(TIPOS_MOVIMIENTO)}")
+    if isinstance(cantidad, bool) or not isinstance(cantidad, int) or cantidad < 1:
+        raise ValueError('cantidad debe ser un entero mayor o igual a 1')
+
+
+def delta_stock(tipo_movimiento, cantidad):
+    """Variación de cantidad_stock que produce un movimiento"""
+    return cantidad if tipo_movimiento == 'ENTRADA' else -cantidad
+
+
+# Las entradas sin costo informado toman el costo vigente del producto; las
+# salidas quedan sin costo porque lo determina la valuación (FIFO o promedio)
+SQL_INSERTAR = """
+    INSERT INTO MovimientosStock (producto_id, tipo_movimiento, cantidad, motivo, numero_referencia,
+                                  costo_unitario)
+    {output}
+    SELECT p.id, ?, ?, ?, ?, CASE WHEN ? = 'ENTRADA' THEN COALESCE(?, p.costo) END
+    FROM Productos p
+    WHERE p.id = ?
+"""
+
+
+def insertar_movimiento(cursor, producto_id, tipo_movimiento, cantidad, motivo='', numero_referencia='',
+                        costo_unitario=None):
+    """Registrar un movimiento y aplicarlo al stock; devuelve el id del movimiento"""
+    cursor.execute(SQL_INSERTAR.format(output='OUTPUT INSERTED.id'), tipo_movimiento, cantidad, motivo,
+                   numero_referencia, tipo_movimiento, costo_unitario, producto_id)
+    movimiento_id = cursor.fetchone()[0]
+
+    cursor.execute("UPDATE Productos SET cantidad_stock = cantidad_stock + ? WHERE id = ?",
+                   delta_stock(tipo_movimiento, cantidad), producto_id)
+
+    # Mantener el resumen diario en la misma transacción
+    rollups.registrar_movimiento(cursor, producto_id, tipo_movimiento, cantidad)
+    return movimiento_id
+
+
+def aplicar_lote(cursor, movimientos):
+    """Insertar un lote de movimientos con un solo UPDATE de stock por producto
+
+    movimientos: lista de dicts con producto_id, tipo_movimiento, cantidad y
+    opcionalmente motivo, numero_referencia y costo_unitario.
+    """
+    if not movimientos:
+        return
+    cursor.executemany(SQL_INSERTAR.format(output=''), [
+        (m['tipo_movimiento'], m['cantidad'], m.get('motivo', ''), m.get('numero_referencia', ''),
+         m['tipo_movimiento'], m.get('costo_unitario'), m['producto_id'])
+        for m in movimientos])
+
+    netos = {}
+    por_tipo = {}
+    for m in movimientos:
+        netos[m['producto_id']] = netos.get(m['producto_id'], 0) + delta_stock(m['tipo_movimiento'], m['cantidad'])
+        clave = (m['producto_id'], m['tipo_movimiento'])
+        cantidad, veces = por_tipo.get(clave, (0, 0))
+        por_tipo[clave] = (cantidad + m['cantidad'], veces + 1)
+
+    # Orden fijo de productos para que dos lotes concurrentes no se bloqueen mutuamente
+    actualizaciones = [(neto, producto_id) for producto_id, neto in sorted(netos.items()) if neto]
+    if actualizaciones:
+        cursor.executemany("UPDATE Productos SET cantidad_stock = cantidad_stock + ? WHERE id = ?",
+                           actualizaciones)
+    for (producto_id, tipo), (cantidad, veces) in sorted(por_tipo.items()):
+        rollups.registrar_movimiento(cursor, producto_id, tipo, cantidad, movimientos=veces)
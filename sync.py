@@ -0,0 +1,72 @@
+"""
+Sincronización incremental del catálogo de productos.
+
+Productos tiene una columna ROWVERSION (version_fila) que SQL Server renueva
+en cada INSERT o UPDATE de la fila, incluidos los cambios de stock y las bajas
+lógicas (activo = 0). GET /sync/productos?since=<token> devuelve solo las filas
+con version_fila mayor al token, en orden de versión y usando el índice sobre
+esa columna; las filas dadas de baja viajan como tombstones (solo el id).
+
+Las filas llevan categoria_id y proveedor_id, no los nombres: renombrar una
+categoría o un proveedor no cambia la versión de sus productos, así que el
+cliente toma los nombres de /categorias y /proveedores.
+
+El token es la última versión entregada. Se lee hasta MIN_ACTIVE_ROWVERSION()
+para no saltear filas de transacciones todavía abiertas que obtuvieron una
+versión menor a otra ya confirmada.
+"""
+
+LIMITE_POR_DEFECTO = 1000
+LIMITE_MAXIMO = 5000
+
+
+def crear_columnas(cursor):
+    """Agregar a Productos la versión de fila y su índice si no existen"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_NAME = 'Productos' AND COLUMN_NAME = 'version_fila'
+    """)
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("ALTER TABLE Productos ADD version_fila ROWVERSION")
+        cursor.execute("CREATE INDEX IX_Productos_version_fila ON Productos (version_fila)")
+
+
+def leer_token(texto):
+    """Versión a partir de la cual sincronizar (0 = catálogo completo)"""
+    if not texto:
+        return 0
+    version = int(texto)
+    if version < 0:
+        raise ValueError(texto)
+    return version
+
+
+def cambios(cursor, desde, limite=LIMITE_POR_DEFECTO):
+    """Filas de Productos modificadas después de la versión `desde`
+
+    Devuelve (filas, hay_mas, reiniciar). Cada fila trae version, activo y el
+    resto de las columnas de Productos del listado (sin los nombres de
+    categoría y proveedor). reiniciar es True si el
+    token es posterior a la última versión de la base (p. ej. se restauró un
+    respaldo) y el cliente debe descartar su copia.
+    """
+    if desde:
+        cursor.execute("SELECT CAST(MAX(version_fila) AS BIGINT) FROM Productos")
+        maxima = cursor.fetchone()[0] or 0
+        if desde > maxima:
+            return [], False, True
+
+    # En la carga inicial las bajas no hacen falta: el cliente todavía no las tiene
+    solo_activos = "" if desde else "AND p.activo = 1"
+    cursor.execute(f"""
+        SELECT TOP (?) CAST(p.version_fila AS BIGINT) as version, p.activo,
+               p.id, p.nombre, p.descripcion, p.codigo_sku, p.precio,
+               p.cantidad_stock, p.stock_minimo, p.fecha_creacion,
+               p.categoria_id, p.proveedor_id
+        FROM Productos p
+        WHERE p.version_fila > CAST(? AS BINARY(8)) AND p.version_fila < MIN_ACTIVE_ROWVERSION()
+          {solo_activos}
+        ORDER BY p.version_fila
+    """, limite + 1, desde)
+    filas = cursor.fetchall()
+    return filas[:limite], len(filas) > limite, False
@@ -0,0 +1,61 @@
+"""Archivado de MovimientosStock contra el sustituto SQLite"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive  # noqa: E402
+from benchmark import sqlite_odbc  # noqa: E402
+
+
+def _conexion(tmp_path, dias_por_id):
+    sqlite_odbc.configurar(str(tmp_path / 'db'))
+    conn = sqlite_odbc.connect('DATABASE=InventarioDB')
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE MovimientosStock (
+            id INTEGER PRIMARY KEY, producto_id INTEGER, tipo_movimiento TEXT, cantidad INTEGER,
+            motivo TEXT, numero_referencia TEXT, fecha_movimiento DATETIME, costo_unitario REAL)
+    """)
+    for id_, dias in dias_por_id.items():
+        cursor.execute("INSERT INTO MovimientosStock VALUES (?, 1, 'ENTRADA', 1, '', '', ?, NULL)",
+                       id_, datetime.now() - timedelta(days=dias))
+    conn.commit()
+    return conn
+
+
+def test_id_menor_que_cruza_el_corte_despues_no_se_pierde(tmp_path, monkeypatch):
+    monkeypatch.setitem(archive.CONFIG, 'directorio', str(tmp_path / 'archivo'))
+    conn = _conexion(tmp_path, {1: 300, 2: 150, 3: 250})
+
+    archive.archivar(conn, retencion_dias=200)
+    archive.archivar(conn, retencion_dias=100)
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM MovimientosStock")
+    vivos = [row[0] for row in cursor.fetchall()]
+    archivados = sorted(m['id'] for m in archive.leer())
+    conn.close()
+    assert vivos == []
+    assert archivados == [1, 2, 3]
+
+
+def test_corrida_interrumpida_antes_de_borrar_no_duplica(tmp_path, monkeypatch):
+    monkeypatch.setitem(archive.CONFIG, 'directorio', str(tmp_path / 'archivo'))
+    conn = _conexion(tmp_path, {1: 300, 2: 250, 3: 10})
+    cursor = conn.cursor()
+    archive.archivar(conn, retencion_dias=200)
+    # Simular que el borrado no llegó a ejecutarse
+    cursor.execute("INSERT INTO MovimientosStock VALUES (1, 1, 'ENTRADA', 1, '', '', ?, NULL)",
+                   datetime.now() - timedelta(days=300))
+    conn.commit()
+
+    resultado = archive.archivar(conn, retencion_dias=200)
+
+    cursor.execute("SELECT id FROM MovimientosStock")
+    vivos = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    assert resultado['borradas'] == 1
+    assert vivos == [3]
+    assert sorted(m['id'] for m in archive.leer()) == [1, 2]
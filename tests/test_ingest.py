@@ -0,0 +1,55 @@
+"""Reproducción del diario de ingesta con entradas mal formadas"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest  # noqa: E402
+from benchmark import sqlite_odbc  # noqa: E402
+
+
+def _cola(tmp_path):
+    sqlite_odbc.configurar(str(tmp_path / 'db'))
+    conn = sqlite_odbc.connect('DATABASE=InventarioDB')
+    conn.cursor().execute(ingest.SQL_CREAR_TABLA)
+    conn.commit()
+    conn.close()
+    return ingest.ColaIngesta(lambda: sqlite_odbc.connect('DATABASE=InventarioDB'),
+                              ruta=str(tmp_path / 'ingesta' / 'movimientos.jsonl'))
+
+
+def test_reproducir_aparta_las_entradas_mal_formadas(tmp_path):
+    cola = _cola(tmp_path)
+    entradas = [
+        {'seq': 1, 'producto_id': 1, 'tipo_movimiento': 'ENTRADA', 'cantidad': 5},
+        {'seq': 2, 'producto_id': 1, 'tipo_movimiento': 'ENTRADA', 'cantidad': '5'},
+        {'seq': 3, 'producto_id': 1, 'tipo_movimiento': 'X', 'cantidad': 2},
+        {'seq': 4, 'producto_id': 1, 'tipo_movimiento': 'SALIDA', 'cantidad': 2},
+    ]
+    os.makedirs(os.path.dirname(cola.ruta))
+    with open(cola.ruta, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(entrada) + '\n' for entrada in entradas)
+
+    assert cola.reproducir() == 2
+
+    assert cola.pendiente(1) == 3
+    with open(str(tmp_path / 'ingesta' / 'movimientos.rechazados.jsonl'), encoding='utf-8') as f:
+        assert [json.loads(linea)['seq'] for linea in f] == [2, 3]
+
+
+def test_encolar_valida_antes_de_escribir_el_diario(tmp_path):
+    cola = _cola(tmp_path)
+    cola._abrir_diario()
+    try:
+        with pytest.raises(ValueError):
+            cola.encolar(1, 'ENTRADA', '5')
+        with pytest.raises(ValueError):
+            cola.encolar(1, 'X', 5)
+    finally:
+        cola._diario.close()
+
+    assert os.path.getsize(cola.ruta) == 0
+    assert cola.pendiente(1) == 0
@@ -0,0 +1,70 @@
+"""Reconstrucción de MovimientosDiarios con movimientos archivados"""
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive  # noqa: E402
+import rollups  # noqa: E402
+from benchmark import sqlite_odbc  # noqa: E402
+
+DIAS = {1: 300, 2: 150, 3: 10, 4: 10}
+
+
+def _conexion(tmp_path, monkeypatch):
+    monkeypatch.setitem(archive.CONFIG, 'directorio', str(tmp_path / 'archivo'))
+    sqlite_odbc.configurar(str(tmp_path / 'db'))
+    conn = sqlite_odbc.connect('DATABASE=InventarioDB')
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE MovimientosStock (
+            id INTEGER PRIMARY KEY, producto_id INTEGER, tipo_movimiento TEXT, cantidad INTEGER,
+            motivo TEXT, numero_referencia TEXT, fecha_movimiento DATETIME, costo_unitario REAL)
+    """)
+    rollups.crear_tabla(cursor)
+    for id_, dias in DIAS.items():
+        cursor.execute("INSERT INTO MovimientosStock VALUES (?, 1, 'ENTRADA', ?, '', '', ?, NULL)",
+                       id_, id_, datetime.now() - timedelta(days=dias))
+    conn.commit()
+    return conn
+
+
+def _resumen(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT fecha, cantidad_total, movimientos FROM MovimientosDiarios ORDER BY fecha")
+    return [(str(row[0])[:10], row[1], row[2]) for row in cursor.fetchall()]
+
+
+def _esperado(ids):
+    dias = {}
+    for id_ in ids:
+        dia = str(date.today() - timedelta(days=DIAS[id_]))
+        cantidad, veces = dias.get(dia, (0, 0))
+        dias[dia] = (cantidad + id_, veces + 1)
+    return sorted((dia, cantidad, veces) for dia, (cantidad, veces) in dias.items())
+
+
+def test_backfill_completo_conserva_los_dias_archivados(tmp_path, monkeypatch):
+    conn = _conexion(tmp_path, monkeypatch)
+    archive.archivar(conn, retencion_dias=100)
+
+    rollups.backfill(conn)
+
+    assert _resumen(conn) == _esperado([1, 2, 3, 4])
+    conn.close()
+
+
+def test_completar_historial_llena_los_dias_anteriores_al_resumen(tmp_path, monkeypatch):
+    conn = _conexion(tmp_path, monkeypatch)
+    archive.archivar(conn, retencion_dias=200)
+    cursor = conn.cursor()
+    rollups.registrar_movimiento(cursor, 1, 'ENTRADA', 5)
+
+    rollups.completar_historial(cursor)
+    conn.commit()
+
+    assert _resumen(conn) == _esperado([1, 2, 3, 4]) + [(str(date.today()), 5, 1)]
+    # Ya completo: una segunda corrida no agrega nada
+    assert rollups.completar_historial(cursor) == 0
+    conn.close()
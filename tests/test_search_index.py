@@ -0,0 +1,45 @@
+"""Nombres de categoría en los resultados del índice de búsqueda"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search_index  # noqa: E402
+import sync  # noqa: E402
+from benchmark import sqlite_odbc  # noqa: E402
+
+
+def _conectar():
+    return sqlite_odbc.connect('DATABASE=InventarioDB')
+
+
+def test_resultados_con_el_nombre_actual_de_la_categoria(tmp_path, monkeypatch):
+    monkeypatch.setitem(search_index.CONFIG, 'refresco_s', 0)
+    sqlite_odbc.configurar(str(tmp_path / 'db'))
+    conn = _conectar()
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE Categorias (id INTEGER PRIMARY KEY, nombre TEXT)")
+    cursor.execute("""
+        CREATE TABLE Productos (
+            id INTEGER PRIMARY KEY, nombre TEXT, descripcion TEXT, codigo_sku TEXT, precio REAL,
+            cantidad_stock INTEGER, stock_minimo INTEGER, fecha_creacion DATETIME,
+            categoria_id INTEGER, proveedor_id INTEGER, activo INTEGER DEFAULT 1)
+    """)
+    sync.crear_columnas(cursor)
+    cursor.execute("INSERT INTO Categorias VALUES (3, 'Ferretería')")
+    cursor.execute("INSERT INTO Productos (id, nombre, descripcion, codigo_sku, precio, cantidad_stock, "
+                   "stock_minimo, fecha_creacion, categoria_id) "
+                   "VALUES (1, 'Tornillo', '', 'T-1', 1, 10, 1, CURRENT_TIMESTAMP, 3)")
+    conn.commit()
+
+    indice = search_index.IndiceBusqueda(_conectar)
+    indice._construyendo = True
+    indice.construir()
+    assert indice.buscar('tornillo')['resultados'][0]['categoria_nombre'] == 'Ferretería'
+
+    cursor.execute("UPDATE Categorias SET nombre = 'Bulonería' WHERE id = 3")
+    conn.commit()
+    conn.close()
+    indice.refrescar()
+
+    assert indice.buscar('tornillo')['resultados'][0]['categoria_nombre'] == 'Bulonería'
@@ -0,0 +1,56 @@
+"""Stock a una fecha fuera de la cobertura del resumen diario"""
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rollups  # noqa: E402
+import snapshots  # noqa: E402
+from benchmark import sqlite_odbc  # noqa: E402
+
+
+def _conexion(tmp_path):
+    sqlite_odbc.configurar(str(tmp_path / 'db'))
+    conn = sqlite_odbc.connect('DATABASE=InventarioDB')
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE Categorias (id INTEGER PRIMARY KEY, nombre TEXT)")
+    cursor.execute("""
+        CREATE TABLE Productos (
+            id INTEGER PRIMARY KEY, nombre TEXT, codigo_sku TEXT, categoria_id INTEGER,
+            cantidad_stock INTEGER, fecha_creacion DATETIME)
+    """)
+    cursor.execute("""
+        CREATE TABLE MovimientosStock (
+            id INTEGER PRIMARY KEY, producto_id INTEGER, tipo_movimiento TEXT, cantidad INTEGER,
+            motivo TEXT, numero_referencia TEXT, fecha_movimiento DATETIME, costo_unitario REAL)
+    """)
+    rollups.crear_tabla(cursor)
+    snapshots.crear_tabla(cursor)
+    cursor.execute("INSERT INTO Productos VALUES (1, 'Tornillo', 'T-1', NULL, 15, ?)",
+                   datetime.now() - timedelta(days=400))
+    for id_, dias, cantidad in ((1, 30, 10), (2, 5, 5)):
+        cursor.execute("INSERT INTO MovimientosStock VALUES (?, 1, 'ENTRADA', ?, '', '', ?, NULL)",
+                       id_, cantidad, datetime.now() - timedelta(days=dias))
+    conn.commit()
+    rollups.backfill(conn)
+    return conn
+
+
+def test_stock_al_dentro_del_resumen(tmp_path):
+    conn = _conexion(tmp_path)
+
+    resultado = snapshots.stock_al(conn.cursor(), date.today() - timedelta(days=10))
+
+    assert resultado['productos'][0]['cantidad_stock'] == 10
+    conn.close()
+
+
+def test_stock_al_anterior_al_resumen_se_rechaza(tmp_path):
+    conn = _conexion(tmp_path)
+
+    with pytest.raises(ValueError, match='resumen diario'):
+        snapshots.stock_al(conn.cursor(), date.today() - timedelta(days=60))
+    conn.close()
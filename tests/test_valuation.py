@@ -0,0 +1,79 @@
+"""Avance del último id procesado en Valuador.actualizar"""
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive  # noqa: E402
+import valuation  # noqa: E402
+from benchmark import sqlite_odbc  # noqa: E402
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setitem(archive.CONFIG, 'directorio', str(tmp_path / 'archivo'))
+    sqlite_odbc.configurar(str(tmp_path / 'db'))
+    conn = sqlite_odbc.connect('DATABASE=InventarioDB')
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE Productos (id INTEGER PRIMARY KEY, costo REAL)")
+    cursor.execute("""
+        CREATE TABLE MovimientosStock (
+            id INTEGER PRIMARY KEY, producto_id INTEGER, tipo_movimiento TEXT, cantidad INTEGER,
+            motivo TEXT, numero_referencia TEXT, fecha_movimiento DATETIME, costo_unitario REAL)
+    """)
+    cursor.execute("INSERT INTO Productos VALUES (1, 10), (2, 20)")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _entrada(conn, id_, producto_id, cantidad):
+    conn.cursor().execute("INSERT INTO MovimientosStock VALUES (?, ?, 'ENTRADA', ?, '', '', ?, 5)",
+                          id_, producto_id, cantidad, datetime.now())
+    conn.commit()
+
+
+def _unidades(valuador):
+    return {int(p): float(valuador.capas_cantidad[valuador.capas_producto == p].sum())
+            for p in set(valuador.capas_producto.tolist())}
+
+
+def test_id_menor_confirmado_despues_se_procesa(conn):
+    valuador = valuation.Valuador()
+    _entrada(conn, 1, 1, 3)
+    _entrada(conn, 3, 2, 4)
+    valuador.actualizar(conn)
+    _entrada(conn, 2, 1, 5)  # confirmó después que el id 3
+
+    valuador.actualizar(conn)
+    valuador.actualizar(conn)
+
+    assert _unidades(valuador) == {1: 8.0, 2: 4.0}
+    assert valuador.movimientos_procesados == 3
+
+
+def test_pasada_fallida_no_avanza_ni_aplica_a_medias(conn, monkeypatch):
+    monkeypatch.setitem(valuation.CONFIG, 'filas_por_bloque', 1)
+    valuador = valuation.Valuador()
+    _entrada(conn, 1, 1, 3)
+    _entrada(conn, 2, 2, 4)
+    original = valuador._procesar_filas
+    llamadas = []
+
+    def fallar_en_el_segundo_bloque(filas, costos):
+        llamadas.append(filas)
+        if len(llamadas) == 2:
+            raise TimeoutError('timeout de consulta')
+        original(filas, costos)
+
+    monkeypatch.setattr(valuador, '_procesar_filas', fallar_en_el_segundo_bloque)
+    with pytest.raises(TimeoutError):
+        valuador.actualizar(conn)
+    assert valuador.ultimo_id == 0 and valuador.movimientos_procesados == 0
+
+    monkeypatch.setattr(valuador, '_procesar_filas', original)
+    valuador.actualizar(conn)
+    assert _unidades(valuador) == {1: 3.0, 2: 4.0}
@@ -0,0 +1,361 @@
+"""
+Valuación del inventario a costo: FIFO y costo promedio ponderado móvil.
+
+Recorre MovimientosStock (y el archivo histórico) en bloques ordenados por
+producto y calcula con NumPy, para todos los productos del bloque a la vez:
+
+- FIFO: las capas de entrada que siguen vivas. Las salidas de cada producto
+  consumen las entradas más viejas, así que una capa sobrevive en
+  clip(entradas acumuladas - salidas totales, 0, cantidad).
+- Promedio ponderado: la existencia (que no baja de cero) y el valor al final
+  de la secuencia. Cada salida multiplica el valor por existencia/previa y cada
+  entrada le suma cantidad * costo; esa recurrencia se resuelve con sumas
+  acumuladas de logaritmos, cortando donde la existencia llega a cero.
+
+El estado por producto (capas, faltante y existencia/valor promedio) queda en
+memoria junto con el último id procesado; cada consulta solo lee los
+movimientos nuevos y los aplica sobre ese estado. Cada pasada llega hasta el
+MAX(id) tomado al empezar y el último id solo avanza si termina entera (si
+falla, el estado vuelve al anterior). Un id menor que confirma después que uno
+mayor se recoge en la pasada siguiente: se vuelven a leer los últimos
+VALUATION_LATE_ID_WINDOW ids y se saltean los ya procesados.
+
+Las entradas sin costo_unitario (el historial anterior a esta columna) se
+valúan al costo actual del producto. El resultado se ajusta al cantidad_stock
+real: si hay más stock que capas, el excedente va al costo del producto; si hay
+menos, se descartan las capas más viejas.
+"""
+import os
+import threading
+
+import numpy as np
+
+import archive
+
+CONFIG = {
+    'filas_por_bloque': int(os.environ.get('VALUATION_CHUNK_ROWS', 200000)),
+    'ventana_ids': int(os.environ.get('VALUATION_LATE_ID_WINDOW', 10000)),
+}
+
+# Atributos del estado que una pasada fallida tiene que restaurar
+_ESTADO = ('movimientos_procesados', 'capas_producto', 'capas_cantidad', 'capas_costo', 'faltante_producto',
+           'faltante_cantidad', 'promedio_producto', 'promedio_cantidad', 'promedio_valor')
+
+
+# ==================== CÁLCULO VECTORIZADO ====================
+
+def _inicios_de_grupo(grupos):
+    """Máscara de las filas que abren un grupo (grupos ordenados)"""
+    inicio = np.ones(len(grupos), dtype=bool)
+    inicio[1:] = grupos[1:] != grupos[:-1]
+    return inicio
+
+
+def _cumsum_por_grupo(valores, grupos):
+    """Suma acumulada que se reinicia en cada grupo"""
+    acumulada = np.cumsum(valores)
+    inicio = _inicios_de_grupo(grupos)
+    base = (acumulada - valores)[inicio]
+    return acumulada - base[np.cumsum(inicio) - 1]
+
+
+def fifo(grupos, cantidades, entradas, costos, n_grupos):
+    """Capas FIFO vivas al final de cada grupo
+
+    Devuelve (grupo, cantidad, costo) de las capas y el faltante por grupo:
+    unidades que salieron sin entradas que las cubran y que consumirán las
+    próximas entradas.
+    """
+    salidas = np.bincount(grupos, weights=np.where(entradas, 0.0, cantidades), minlength=n_grupos)
+    grupos_e, cantidades_e, costos_e = grupos[entradas], cantidades[entradas], costos[entradas]
+    acumulado = _cumsum_por_grupo(cantidades_e, grupos_e)
+    restante = np.clip(acumulado - salidas[grupos_e], 0, cantidades_e)
+    vivas = restante > 0
+    total_entradas = np.bincount(grupos_e, weights=cantidades_e, minlength=n_grupos)
+    faltante = np.maximum(salidas - total_entradas, 0)
+    return grupos_e[vivas], restante[vivas], costos_e[vivas], faltante
+
+
+def promedio(grupos, cantidades, entradas, costos, n_grupos):
+    """Existencia y valor al costo promedio ponderado móvil al final de cada grupo"""
+    delta = np.where(entradas, cantidades, -cantidades)
+    acumulado = _cumsum_por_grupo(delta, grupos)
+
+    # Existencia que no baja de cero: acumulado menos el mínimo corrido del grupo si es negativo.
+    # El desplazamiento por grupo hace que el mínimo acumulado no arrastre valores del grupo anterior.
+    desplazamiento = grupos * (2 * np.abs(delta).sum() + 1)
+    minimo = np.minimum.accumulate(acumulado - desplazamiento) + desplazamiento
+    existencia = acumulado - np.minimum(minimo, 0)
+
+    inicio = _inicios_de_grupo(grupos)
+    previa = np.empty_like(existencia)
+    previa[1:] = existencia[:-1]
+    previa[inicio] = 0
+
+    # Factor por el que cada movimiento multiplica el valor acumulado (0 = se agotó)
+    factor = np.ones_like(existencia)
+    salidas = ~entradas
+    con_previa = salidas & (previa > 0)
+    factor[salidas] = 0
+    factor[con_previa] = existencia[con_previa] / previa[con_previa]
+    aporte = np.where(entradas, cantidades * np.nan_to_num(costos), 0.0)
+
+    fin = np.empty(len(grupos), dtype=bool)
+    fin[:-1] = inicio[1:]
+    fin[-1] = True
+    ultimos = np.nonzero(fin)[0]
+
+    tramo = _cumsum_por_grupo((factor == 0).astype(np.float64), grupos)
+    log_factor = _cumsum_por_grupo(np.log(np.where(factor > 0, factor, 1.0)), grupos)
+    tramo_final = np.zeros(n_grupos)
+    log_final = np.zeros(n_grupos)
+    tramo_final[grupos[ultimos]] = tramo[ultimos]
+    log_final[grupos[ultimos]] = log_factor[ultimos]
+
+    vigente = tramo == tramo_final[grupos]
+    pesos = np.where(vigente, aporte * np.exp(np.where(vigente, log_final[grupos] - log_factor, 0.0)), 0.0)
+    valor = np.bincount(grupos, weights=pesos, minlength=n_grupos)
+    cantidad = np.zeros(n_grupos)
+    cantidad[grupos[ultimos]] = existencia[ultimos]
+    return cantidad, valor
+
+
+# ==================== ESTADO INCREMENTAL ====================
+
+def _vacio(tipo=np.float64):
+    return np.empty(0, dtype=tipo)
+
+
+class Valuador:
+    """Estado de valuación por producto, actualizado con los movimientos nuevos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self.ultimo_id = 0
+        # Ids procesados dentro de la ventana de relectura (ultimo_id - ventana_ids, ultimo_id]
+        self.recientes = set()
+        self.movimientos_procesados = 0
+        # Capas FIFO ordenadas por producto y antigüedad
+        self.capas_producto = _vacio(np.int64)
+        self.capas_cantidad = _vacio()
+        self.capas_costo = _vacio()
+        # Salidas sin capa que cubrir
+        self.faltante_producto = _vacio(np.int64)
+        self.faltante_cantidad = _vacio()
+        # Costo promedio: existencia y valor por producto
+        self.promedio_producto = _vacio(np.int64)
+        self.promedio_cantidad = _vacio()
+        self.promedio_valor = _vacio()
+
+    def _aplicar_bloque(self, productos, cantidades, entradas, costos):
+        """Incorporar un bloque de movimientos (en orden por producto) al estado"""
+        bloque = np.unique(productos)
+
+        # FIFO: faltante previo (como salida) + capas previas (como entradas) + bloque
+        en_f = np.isin(self.faltante_producto, bloque)
+        en_c = np.isin(self.capas_producto, bloque)
+        prod = np.concatenate([self.faltante_producto[en_f], self.capas_producto[en_c], productos])
+        cant = np.concatenate([self.faltante_cantidad[en_f], self.capas_cantidad[en_c], cantidades])
+        ent = np.concatenate([np.zeros(en_f.sum(), dtype=bool), np.ones(en_c.sum(), dtype=bool), entradas])
+        cost = np.concatenate([np.full(en_f.sum(), np.nan), self.capas_costo[en_c], costos])
+        orden = np.argsort(prod, kind='stable')
+        ids, grupos = np.unique(prod[orden], return_inverse=True)
+        g_capa, q_capa, c_capa, faltante = fifo(grupos, cant[orden], ent[orden], cost[orden], len(ids))
+
+        prod = np.concatenate([self.capas_producto[~en_c], ids[g_capa]])
+        orden = np.argsort(prod, kind='stable')
+        self.capas_producto = prod[orden]
+        self.capas_cantidad = np.concatenate([self.capas_cantidad[~en_c], q_capa])[orden]
+        self.capas_costo = np.concatenate([self.capas_costo[~en_c], c_capa])[orden]
+        con_faltante = faltante > 0
+        prod = np.concatenate([self.faltante_producto[~en_f], ids[con_faltante]])
+        orden = np.argsort(prod)
+        self.faltante_producto = prod[orden]
+        self.faltante_cantidad = np.concatenate([self.faltante_cantidad[~en_f], faltante[con_faltante]])[orden]
+
+        # Promedio: la existencia previa entra como una entrada al costo promedio vigente
+        en_p = np.isin(self.promedio_producto, bloque)
+        previa = en_p.copy()
+        previa[en_p] = self.promedio_cantidad[en_p] > 0
+        costo_previo = self.promedio_valor[previa] / self.promedio_cantidad[previa]
+        prod = np.concatenate([self.promedio_producto[previa], productos])
+        orden = np.argsort(prod, kind='stable')
+        ids, grupos = np.unique(prod[orden], return_inverse=True)
+        cantidad, valor = promedio(
+            grupos,
+            np.concatenate([self.promedio_cantidad[previa], cantidades])[orden],
+            np.concatenate([np.ones(previa.sum(), dtype=bool), entradas])[orden],
+            np.concatenate([costo_previo, costos])[orden],
+            len(ids))
+
+        prod = np.concatenate([self.promedio_producto[~en_p], ids])
+        orden = np.argsort(prod)
+        self.promedio_producto = prod[orden]
+        self.promedio_cantidad = np.concatenate([self.promedio_cantidad[~en_p], cantidad])[orden]
+        self.promedio_valor = np.concatenate([self.promedio_valor[~en_p], valor])[orden]
+        self.movimientos_procesados += len(productos)
+
+    def _procesar_filas(self, filas, costos_producto):
+        """Convertir filas (id, producto_id, tipo, cantidad, costo_unitario) y aplicarlas"""
+        if not filas:
+            return
+        ids, productos, tipos, cantidades, costos = zip(*filas)
+        productos = np.asarray(productos, dtype=np.int64)
+        entradas = np.asarray([t == 'ENTRADA' for t in tipos], dtype=bool)
+        cantidades = np.asarray(cantidades, dtype=np.float64)
+        costos = np.asarray([np.nan if c is None else float(c) for c in costos], dtype=np.float64)
+
+        # Entradas sin costo registrado: costo actual del producto
+        sin_costo = entradas & np.isnan(costos)
+        if sin_costo.any():
+            costos[sin_costo] = costos_producto(productos[sin_costo])
+
+        orden = np.lexsort((np.asarray(ids, dtype=np.int64), productos))
+        self._aplicar_bloque(productos[orden], cantidades[orden], entradas[orden], costos[orden])
+
+    def actualizar(self, conn, recalcular=False):
+        """Aplicar al estado los movimientos posteriores al último procesado"""
+        with self._lock:
+            if recalcular:
+                self._reiniciar()
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, costo FROM Productos")
+            filas = cursor.fetchall()
+            ids_producto = np.asarray([row[0] for row in filas], dtype=np.int64)
+            costo = np.asarray([float(row[1]) if row[1] is not None else 0.0 for row in filas])
+            orden = np.argsort(ids_producto)
+            ids_producto, costo = ids_producto[orden], costo[orden]
+
+            def costos_producto(productos):
+                posicion = np.clip(np.searchsorted(ids_producto, productos), 0, max(len(ids_producto) - 1, 0))
+                encontrado = ids_producto[posicion] == productos if len(ids_producto) else np.zeros(0, bool)
+                return np.where(encontrado, costo[posicion] if len(costo) else 0.0, 0.0)
+
+            cursor.execute("SELECT MAX(id) FROM MovimientosStock")
+            id_archivo = archive.leer_indice().get('id_max', 0)
+            tope = max(cursor.fetchone()[0] or 0, id_archivo)
+            desde_id = max(self.ultimo_id - CONFIG['ventana_ids'], 0)
+            ventana = tope - CONFIG['ventana_ids']
+            procesados = set()
+
+            def procesar(filas):
+                nuevas = [f for f in filas if f[0] not in self.recientes]
+                self._procesar_filas(nuevas, costos_producto)
+                procesados.update(f[0] for f in nuevas if f[0] > ventana)
+
+            anterior = {atributo: getattr(self, atributo) for atributo in _ESTADO}
+            try:
+                # Movimientos ya archivados que todavía no se procesaron
+                if id_archivo > desde_id:
+                    procesar([(m['id'], m['producto_id'], m['tipo_movimiento'], m['cantidad'],
+                               m.get('costo_unitario')) for m in archive.leer() if desde_id < m['id'] <= tope])
+
+                cursor.execute("""
+                    SELECT id, producto_id, tipo_movimiento, cantidad, costo_unitario
+                    FROM MovimientosStock
+                    WHERE id > ? AND id <= ?
+                    ORDER BY producto_id, id
+                """, desde_id, tope)
+                while True:
+                    filas = cursor.fetchmany(CONFIG['filas_por_bloque'])
+                    if not filas:
+                        break
+                    procesar(filas)
+            except Exception:
+                # Sin avanzar el último id, la próxima pasada repite todo: el estado tiene que ser el previo
+                for atributo, valor in anterior.items():
+                    setattr(self, atributo, valor)
+                raise
+            self.ultimo_id = max(self.ultimo_id, tope)
+            self.recientes = {i for i in self.recientes | procesados if i > self.ultimo_id - CONFIG['ventana_ids']}
+
+    def valuar(self, cursor):
+        """Valor a costo (FIFO y promedio) y de venta, total y por categoría y proveedor"""
+        cursor.execute("""
+            SELECT p.id, p.cantidad_stock, p.costo, p.precio,
+                   p.categoria_id, c.nombre, p.proveedor_id, pr.nombre
+            FROM Productos p
+            LEFT JOIN Categorias c ON p.categoria_id = c.id
+            LEFT JOIN Proveedores pr ON p.proveedor_id = pr.id
+            WHERE p.activo = 1
+            ORDER BY p.id
+        """)
+        filas = cursor.fetchall()
+        ids = np.asarray([row[0] for row in filas], dtype=np.int64)
+        stock = np.maximum(np.asarray([row[1] or 0 for row in filas], dtype=np.float64), 0)
+        costo = np.asarray([np.nan if row[2] is None else float(row[2]) for row in filas])
+        precio = np.asarray([float(row[3] or 0) for row in filas])
+        n = len(ids)
+
+        with self._lock:
+            capas_producto, capas_cantidad, capas_costo = \
+                self.capas_producto, self.capas_cantidad, self.capas_costo
+            promedio_producto, promedio_cantidad, promedio_valor = \
+                self.promedio_producto, self.promedio_cantidad, self.promedio_valor
+
+        # FIFO: quedarse con las capas más nuevas hasta cubrir el stock real
+        posicion = np.clip(np.searchsorted(ids, capas_producto), 0, max(n - 1, 0))
+        activa = (ids[posicion] == capas_producto) if n else np.zeros(len(capas_producto), dtype=bool)
+        posicion, cantidad, costo_capa = posicion[activa], capas_cantidad[activa], capas_costo[activa]
+        total_capas = np.bincount(posicion, weights=cantidad, minlength=n)
+        mas_nuevas = total_capas[posicion] - _cumsum_por_grupo(cantidad, posicion) if len(posicion) else cantidad
+        vigente = np.clip(stock[posicion] - mas_nuevas, 0, cantidad)
+        costo_base = np.nan_to_num(costo)
+        valor_fifo = np.bincount(posicion, weights=vigente * costo_capa, minlength=n) + \
+            np.maximum(stock - total_capas, 0) * costo_base
+
+        # Promedio: stock real por el costo promedio vigente (o el costo del producto si no hay historia)
+        unitario = costo_base.copy()
+        posicion = np.clip(np.searchsorted(promedio_producto, ids), 0, max(len(promedio_producto) - 1, 0))
+        if len(promedio_producto):
+            con_promedio = (promedio_producto[posicion] == ids) & (promedio_cantidad[posicion] > 0)
+            origen = posicion[con_promedio]
+            unitario[con_promedio] = promedio_valor[origen] / promedio_cantidad[origen]
+        valor_promedio = stock * unitario
+        valor_venta = stock * precio
+
+        def agrupar(columna_id, columna_nombre):
+            claves = np.asarray([row[columna_id] if row[columna_id] is not None else -1 for row in filas],
+                                dtype=np.int64)
+            nombres = {row[columna_id]: row[columna_nombre] or '' for row in filas}
+            unicas, indice = np.unique(claves, return_inverse=True)
+            k = len(unicas)
+            sumas = {
+                'productos': np.bincount(indice, minlength=k),
+                'unidades': np.bincount(indice, weights=stock, minlength=k),
+                'costo_fifo': np.bincount(indice, weights=valor_fifo, minlength=k),
+                'costo_promedio': np.bincount(indice, weights=valor_promedio, minlength=k),
+                'valor_venta': np.bincount(indice, weights=valor_venta, minlength=k),
+            }
+            grupos = []
+            for i, clave in enumerate(unicas):
+                clave = int(clave) if clave >= 0 else None
+                grupos.append({
+                    'id': clave,
+                    'nombre': nombres.get(clave) or ('Sin asignar' if clave is None else ''),
+                    'productos': int(sumas['productos'][i]),
+                    'unidades': int(sumas['unidades'][i]),
+                    'costo_fifo': round(float(sumas['costo_fifo'][i]), 2),
+                    'costo_promedio': round(float(sumas['costo_promedio'][i]), 2),
+                    'valor_venta': round(float(sumas['valor_venta'][i]), 2),
+                })
+            return sorted(grupos, key=lambda g: g['costo_fifo'], reverse=True)
+
+        return {
+            'totales': {
+                'productos': n,
+                'productos_sin_costo': int(np.isnan(costo).sum()),
+                'unidades': int(stock.sum()),
+                'costo_fifo': round(float(valor_fifo.sum()), 2),
+                'costo_promedio': round(float(valor_promedio.sum()), 2),
+                'valor_venta': round(float(valor_venta.sum()), 2),
+            },
+            'por_categoria': agrupar(4, 5),
+            'por_proveedor': agrupar(6, 7),
+            'movimientos_procesados': self.movimientos_procesados,
+            'ultimo_movimiento_id': self.ultimo_id,
+        }
+